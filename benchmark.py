@@ -0,0 +1,750 @@
+#!/usr/bin/env python
+
+# Cat Herding Laser: benchmark suite
+#
+# Usage: python benchmark.py [--lines 200] [--mix Text=1,Radio=2,...] [--output results.json] [--skip-load] ...
+#        python benchmark.py --help for every option
+#
+# Generates a synthetic survey in the survey.txt format, micro-benchmarks the parser, renderer, completed page and
+# Get_Permutations(), then drives a local CherryPy instance of Root with concurrent /survey, /submit and /validate
+# traffic.  Results are printed and saved as JSON so runs from different commits can be compared.
+#
+# The cross-talk check serves several surveys at once from many threads and fails (exit status 1) if any request
+# sees another's state: a letter block, page or completed letter that differs from the one a single thread produces.
+# The writer check submits responses from many threads at once and fails if any is lost, saved twice or broken.
+# The seed check renders the same survey with the same seeds from many threads at once and fails if any page or pick differs.
+#
+# Everything runs in a temporary directory; nothing is written next to your surveys.
+
+import argparse
+import collections
+import distutils.spawn
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import urllib
+import urllib2
+
+import cherrypy
+
+import catherdinglaser
+
+BLOCK_TYPES = ['Text', 'Random Text', 'Radio', 'Random Radio', 'Checkbox', 'Random Checkbox']
+
+def Generate_Line(block_type, options=4, variants=3, rng=random):
+
+    """ Generate_Line(block_type, options, variants, rng): Returns one survey line of the given block type in the survey.txt format.
+            options: number of options for Radio and Checkbox blocks (and their Random versions)
+            variants: number of values to pick from for each option of a Random block
+    """
+
+    def Words(count=6):
+        return ' '.join(rng.choice(['equality', 'vote', 'support', 'community', 'family', 'fair', 'work', 'rights', 'today']) for x in xrange(count))
+
+    required = rng.choice(['Required', 'Not Required'])
+
+    if block_type == 'Text':
+        return '\t'.join(['Text', required, Words()])
+    elif block_type == 'Random Text':
+        return '\t'.join(['Random Text', required] + [Words() for x in xrange(variants)])
+
+    cells = [block_type, required, "{}?".format(Words(4))]
+
+    for option in xrange(options):
+        if block_type == 'Radio':
+            cells.extend(["Option {}".format(option), Words()])
+        elif block_type == 'Checkbox':
+            cells.extend(["Option {}".format(option), Words(), ", and "])
+        elif block_type == 'Random Radio':
+            cells.extend(["", "", "Option {}".format(option)] + [Words() for x in xrange(variants)])
+        else:
+            cells.extend(["", "", "Option {}".format(option)] + [Words() for x in xrange(variants)] + [", and "])
+
+    return '\t'.join(cells)
+
+def Generate_Survey(lines, block_types=BLOCK_TYPES, options=4, variants=3, seed=0):
+
+    """ Generate_Survey(lines, block_types, options, variants, seed): Returns a survey of the given number of lines.
+            block_types: list of block types to cycle through; repeat a type to give it more weight
+    """
+
+    rng = random.Random(seed)
+
+    return '\n'.join(Generate_Line(block_types[x % len(block_types)], options, variants, rng) for x in xrange(lines))
+
+def Parse_Mix(mix):
+
+    """ Parse_Mix(mix): Turns "Text=1,Radio=3" into the block_types list for Generate_Survey().
+    """
+
+    block_types = []
+
+    for part in mix.split(","):
+        (block_type, weight) = part.split("=")
+        block_type = block_type.strip()
+        if block_type not in BLOCK_TYPES:
+            raise ValueError("Unknown block type {}; choose from {}".format(block_type, ", ".join(BLOCK_TYPES)))
+        block_types.extend([block_type] * int(weight))
+
+    return block_types
+
+def Time(function, number, repeat=3):
+
+    """ Time(function, number, repeat): Returns a dictionary with the best and median time per call, in microseconds.
+    """
+
+    timings = sorted(timeit.repeat(function, number=number, repeat=repeat))
+
+    return {'best_us': timings[0] / number * 1000000, 'median_us': timings[len(timings) // 2] / number * 1000000, 'calls': number * repeat}
+
+def Fake_Response(compiled, rng):
+
+    """ Fake_Response(compiled, rng): Returns the values a browser would submit for a random set of answers to the Compiled_Survey.
+    """
+
+    response_values = {'survey_id': compiled.survey_id}
+
+    for (field, options) in compiled.answer_values.iteritems():
+        if field.startswith('static'):
+            response_values[field] = rng.choice(options[0])
+        elif field.startswith('rd'):
+            response_values[field] = rng.choice(rng.choice(options))
+        else:
+            chosen = [rng.choice(option) for option in options if rng.random() < 0.5]
+            if len(chosen) == 1:
+                response_values[field] = chosen[0]
+            elif len(chosen) > 1:
+                response_values[field] = chosen
+
+    response_values['CHL_choices'] = catherdinglaser.Rebuild_Letter(response_values, compiled.answer_values)
+
+    return response_values
+
+def Micro_Benchmarks(survey, number):
+
+    """ Micro_Benchmarks(survey, number): Times the hot paths on the given survey; run from the benchmark's working directory.
+    """
+
+    root = catherdinglaser.Root()
+    root.createsurvey(survey=survey)
+    survey_id = catherdinglaser.hashlib.new('md5', survey).hexdigest()
+    survey_filename = "{}.txt".format(survey_id)
+
+    (survey_id, all_letter_blocks, required_fields) = catherdinglaser.Load_Letter_Blocks(survey_filename, use_artifact=False)
+    template = catherdinglaser.Compile_EndUser_Survey(survey_id, all_letter_blocks, required_fields)
+    compiled = catherdinglaser.survey_cache.Get(survey_id)
+    letter = Fake_Response(compiled, random.Random(0))['CHL_choices']
+
+    results = {}
+    results['Load_Letter_Blocks (text)'] = Time(lambda: catherdinglaser.Load_Letter_Blocks(survey_filename, use_artifact=False), number)
+    results['Load_Letter_Blocks (artifact)'] = Time(lambda: catherdinglaser.Load_Letter_Blocks(survey_filename), number)
+    results['Load_Letter_Blocks (validation)'] = Time(lambda: catherdinglaser.Load_Letter_Blocks(survey, validation_mode=True), number)
+    results['Create_EndUser_Survey'] = Time(lambda: catherdinglaser.Create_EndUser_Survey(survey_id, all_letter_blocks, required_fields), number)
+    results['Survey_Template.Render'] = Time(lambda: template.Render(), number * 10)
+    results['Survey_Completed_Page'] = Time(lambda: catherdinglaser.Survey_Completed_Page(letter, header="<html><body>", footer="</body></html>"), number * 10)
+
+    for block_type in sorted(set(block.block_type for block in all_letter_blocks.itervalues())):
+        blocks = [block for block in all_letter_blocks.itervalues() if block.block_type == block_type]
+        results['{}.Get_Permutations'.format(block_type)] = Time(lambda: [block.Get_Permutations() for block in blocks], number)
+        results['{}.Get_Permutations'.format(block_type)]['blocks'] = len(blocks)
+
+    return (survey_id, results)
+
+def Percentile(sorted_values, percent):
+    if len(sorted_values) == 0:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100.0))]
+
+# Seconds before a load test request counts as an error, so a server whose threads are all held by slow clients is reported rather than waited on
+LOAD_TIMEOUT = 5
+
+def Load_Test(survey, port, concurrency, requests, event_server=False, slow_clients=0):
+
+    """ Load_Test(survey, port, concurrency, requests, event_server, slow_clients): Serves Root on 127.0.0.1:port and sends it concurrent /survey, /submit and /validate requests.
+        Returns a dictionary per endpoint of throughput and p50/p95/p99 latency in milliseconds.
+            event_server: serve with catherdinglaser.Event_Server instead of CherryPy's threaded server
+            slow_clients: connections held open throughout, each sending another header line of a request it never finishes every second
+    """
+
+    cherrypy.config.update({'server.socket_host': '127.0.0.1', 'server.socket_port': port, 'server.thread_pool': concurrency, 'log.screen': False, 'engine.autoreload.on': False, 'checker.on': False})
+    cherrypy.tree.mount(catherdinglaser.Root(), '/')
+    if event_server:
+        cherrypy.server.instance = catherdinglaser.Event_Server(('127.0.0.1', port), cherrypy.tree, numthreads=concurrency, timeout=cherrypy.server.socket_timeout)
+    cherrypy.engine.start()
+    slow = []
+    finished = threading.Event()
+
+    def Trickle():
+        while not finished.wait(1):
+            for client in slow:
+                try:
+                    client.sendall("X-Slow: 1\r\n")
+                except socket.error:
+                    pass
+
+    try:
+        base_url = "http://127.0.0.1:{}".format(port)
+        survey_id = urllib2.urlopen("{}/createsurvey".format(base_url), urllib.urlencode({'survey': survey})).read().split("survey_id=")[1].split("'")[0]
+        compiled = catherdinglaser.survey_cache.Get(survey_id)
+
+        for x in xrange(slow_clients):
+            slow.append(socket.create_connection(('127.0.0.1', port)))
+            slow[-1].sendall("GET /survey HTTP/1.1\r\nHost: 127.0.0.1\r\n")
+        trickler = threading.Thread(target=Trickle)
+        trickler.daemon = True
+        trickler.start()
+
+        endpoints = [
+            ('survey', lambda rng: urllib2.urlopen("{}/survey?survey_id={}".format(base_url, survey_id), timeout=LOAD_TIMEOUT).read()),
+            ('submit', lambda rng: urllib2.urlopen("{}/submit".format(base_url), urllib.urlencode(Fake_Response(compiled, rng), True), timeout=LOAD_TIMEOUT).read()),
+            ('validate', lambda rng: urllib2.urlopen("{}/validate".format(base_url), urllib.urlencode({'survey': survey}), timeout=LOAD_TIMEOUT).read()),
+        ]
+
+        results = {}
+
+        for (endpoint, request) in endpoints:
+            latencies = []
+            errors = [0]
+            lock = threading.Lock()
+
+            def Client(client_number, count):
+                rng = random.Random(client_number)
+                for x in xrange(count):
+                    started = time.time()
+                    try:
+                        request(rng)
+                    except (IOError, urllib2.HTTPError):
+                        with lock:
+                            errors[0] += 1
+                        continue
+                    with lock:
+                        latencies.append(time.time() - started)
+
+            clients = [threading.Thread(target=Client, args=(x, requests // concurrency)) for x in xrange(concurrency)]
+            started = time.time()
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.time() - started
+
+            latencies.sort()
+            results[endpoint] = {
+                'requests': len(latencies),
+                'errors': errors[0],
+                'seconds': elapsed,
+                'requests_per_second': len(latencies) / elapsed,
+                'p50_ms': Percentile(latencies, 50) * 1000 if len(latencies) > 0 else None,
+                'p95_ms': Percentile(latencies, 95) * 1000 if len(latencies) > 0 else None,
+                'p99_ms': Percentile(latencies, 99) * 1000 if len(latencies) > 0 else None,
+            }
+
+        return results
+
+    finally:
+        finished.set()
+        for client in slow:
+            client.close()
+        cherrypy.engine.exit()
+        (cherrypy.server.instance, cherrypy.server.httpserver) = (None, None)
+
+def Block_Outputs(all_letter_blocks, seed):
+
+    """ Block_Outputs(all_letter_blocks, seed): Returns what Get_DDC() and Get_AWA() give for every block, in line order, picking random values with a random.Random(seed).
+    """
+
+    rng = random.Random(seed)
+    outputs = []
+
+    for line_number in sorted(all_letter_blocks):
+        block = all_letter_blocks[line_number]
+        if 'Randomized' in block.block_type:
+            outputs.append((block.Get_DDC(), block.Get_AWA(rng=rng)))
+        else:
+            outputs.append((block.Get_DDC(), block.Get_AWA()))
+
+    return outputs
+
+def Cross_Talk(surveys, port, concurrency, requests, seeds=20):
+
+    """ Cross_Talk(surveys, port, concurrency, requests, seeds): Checks that concurrent requests for different surveys never see each other's state.
+        First builds the letter blocks' values and renders the pages of every survey from concurrent threads, all sharing one parsed copy of each survey,
+        and compares them with the same work done on one thread.  Then serves Root on 127.0.0.1:port and sends concurrent /survey and /submit requests
+        spread across every survey, checking that each page names only its own survey and each completed letter comes back as it was sent.
+        Returns a dictionary per check of how many calls were made and how many came back wrong.
+    """
+
+    root = catherdinglaser.Root()
+    compiled_surveys = []
+
+    for survey in surveys:
+        root.createsurvey(survey=survey)
+        compiled_surveys.append(catherdinglaser.survey_cache.Get(catherdinglaser.hashlib.new('md5', survey).hexdigest()))
+
+    survey_ids = [compiled.survey_id for compiled in compiled_surveys]
+
+    # The answers from one thread, to hold the concurrent ones to
+    expected_blocks = [[Block_Outputs(compiled.all_letter_blocks, seed) for seed in xrange(seeds)] for compiled in compiled_surveys]
+    expected_pages = [[compiled.template.Render(seed=seed) for seed in xrange(seeds)] for compiled in compiled_surveys]
+
+    def Check_Blocks(rng):
+        (index, seed) = (rng.randrange(len(compiled_surveys)), rng.randrange(seeds))
+        return Block_Outputs(compiled_surveys[index].all_letter_blocks, seed) == expected_blocks[index][seed]
+
+    def Check_Render(rng):
+        (index, seed) = (rng.randrange(len(compiled_surveys)), rng.randrange(seeds))
+        return compiled_surveys[index].template.Render(seed=seed) == expected_pages[index][seed]
+
+    def Others_Absent(page, index):
+        return all(survey_id not in page for survey_id in survey_ids if survey_id != survey_ids[index])
+
+    cherrypy.config.update({'server.socket_host': '127.0.0.1', 'server.socket_port': port, 'server.thread_pool': concurrency, 'log.screen': False, 'engine.autoreload.on': False, 'checker.on': False})
+    cherrypy.tree.mount(root, '/')
+    cherrypy.engine.start()
+
+    try:
+        base_url = "http://127.0.0.1:{}".format(port)
+
+        def Check_Survey(rng):
+            index = rng.randrange(len(compiled_surveys))
+            page = urllib2.urlopen("{}/survey?survey_id={}".format(base_url, survey_ids[index])).read()
+            return survey_ids[index] in page and Others_Absent(page, index)
+
+        def Check_Submit(rng):
+            index = rng.randrange(len(compiled_surveys))
+            response_values = Fake_Response(compiled_surveys[index], rng)
+            response_values['CHL_choices'] = "{} {}".format(response_values['CHL_choices'], survey_ids[index]) # Root.submit strips the survey's own id from the completed page, and only that
+            page = urllib2.urlopen("{}/submit".format(base_url), urllib.urlencode(response_values, True)).read()
+            return response_values['CHL_choices'].replace("!!", "\n").replace(survey_ids[index], '') in page and Others_Absent(page, index)
+
+        results = {}
+
+        for (check, request) in [('blocks', Check_Blocks), ('render', Check_Render), ('survey', Check_Survey), ('submit', Check_Submit)]:
+            counts = {'calls': 0, 'wrong': 0, 'errors': 0}
+            lock = threading.Lock()
+
+            def Client(client_number, count):
+                rng = random.Random(client_number)
+                for x in xrange(count):
+                    try:
+                        outcome = 'calls' if request(rng) else 'wrong'
+                    except (IOError, urllib2.HTTPError):
+                        outcome = 'errors'
+                    with lock:
+                        counts[outcome] += 1
+
+            clients = [threading.Thread(target=Client, args=(x, requests // concurrency)) for x in xrange(concurrency)]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+
+            counts['calls'] += counts['wrong'] + counts['errors']
+            results[check] = counts
+
+        return results
+
+    finally:
+        cherrypy.engine.exit()
+
+def Seed_Check(survey, threads, seeds=50):
+
+    """ Seed_Check(survey, threads, seeds): Checks that a seed renders the same page, with the same picks, whichever thread renders it.
+        Every thread renders the survey with each of the same seeds in the same order, so that each seed is being rendered by several threads at once,
+        both from an ordinary template ('plain') and from one moved into a memory-mapped file by Share() ('shared').  Each page must match the one rendered
+        on this thread beforehand and carry its seed in CHL_seed, and Picks() must give the same result as it did beforehand.
+        Returns a dictionary per template of how many renders were made and how many came back wrong.
+    """
+
+    with open("seeds.txt", "w") as survey_file:
+        survey_file.write(survey)
+    (survey_id, all_letter_blocks, required_fields) = catherdinglaser.Load_Letter_Blocks("seeds.txt", use_artifact=False)
+
+    templates = {'plain': catherdinglaser.Compile_EndUser_Survey(survey_id, all_letter_blocks, required_fields), 'shared': catherdinglaser.Compile_EndUser_Survey(survey_id, all_letter_blocks, required_fields)}
+    templates['shared'].Share()
+
+    seed_list = [catherdinglaser.New_Seed() for x in xrange(seeds)]
+    expected = dict((seed, (templates['plain'].Render(seed), templates['plain'].Picks(seed))) for seed in seed_list)
+
+    results = {}
+
+    for (name, template) in sorted(templates.iteritems()):
+        counts = {'calls': 0, 'wrong': 0}
+        lock = threading.Lock()
+        start = threading.Event()
+
+        def Client():
+            start.wait()
+            for seed in seed_list:
+                page = template.Render(seed)
+                right = (page, template.Picks(seed)) == expected[seed] and 'name="CHL_seed" value="{}"'.format(seed) in page
+                with lock:
+                    counts['calls'] += 1
+                    if not right:
+                        counts['wrong'] += 1
+
+        clients = [threading.Thread(target=Client) for x in xrange(threads)]
+        for client in clients:
+            client.start()
+        start.set()
+        for client in clients:
+            client.join()
+
+        results[name] = counts
+
+    return results
+
+def Writer_Check(threads, responses, surveys=3, segment_bytes=64*1024):
+
+    """ Writer_Check(threads, responses, surveys, segment_bytes): Checks that responses submitted from many threads at once are all saved, each exactly once and whole.
+        The threads share out the responses, some of them tens of kilobytes long, and write them through a started Response_Writer ('group_commit'),
+        then straight to storage as Root.submit does with the writer off ('direct'), with the responses files rolling over every segment_bytes.
+        Every response is then read back with storage.Read_Responses().
+        Returns a dictionary per mode of how many responses were written and how many were missing, saved more than once or broken.
+    """
+
+    original_storage = catherdinglaser.storage
+    catherdinglaser.storage = catherdinglaser.File_Storage(segment_bytes=segment_bytes)
+
+    results = {}
+
+    try:
+        for mode in ['group_commit', 'direct']:
+            survey_ids = ["writer-{}-{}".format(mode, x) for x in xrange(surveys)]
+            rng = random.Random(0)
+            writes = [[] for x in xrange(threads)]
+            expected = collections.Counter()
+
+            for x in xrange(responses):
+                survey_id = rng.choice(survey_ids)
+                response = catherdinglaser.Serialize_Response({'survey_id': survey_id, 'CHL_submitted': x, 'CHL_choices': "response {} {}".format(x, "w" * rng.choice([10, 1000, 30000]))})
+                writes[x % threads].append((survey_id, response))
+                expected[(survey_id, response)] += 1
+
+            writer = catherdinglaser.Response_Writer(flush_bytes=16*1024, flush_interval=0.01)
+            if mode == 'group_commit':
+                writer.Start()
+
+            def Client(client_writes):
+                for (survey_id, response) in client_writes:
+                    writer.Write(survey_id, response)
+
+            clients = [threading.Thread(target=Client, args=(client_writes,)) for client_writes in writes]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            writer.Stop()
+
+            saved = collections.Counter()
+            for survey_id in survey_ids:
+                for (cursor, response) in catherdinglaser.storage.Read_Responses(survey_id):
+                    saved[(survey_id, response.rstrip("\n") + "\n")] += 1
+
+            results[mode] = {
+                'responses': responses,
+                'segments': sum(len(catherdinglaser.storage.Segments(survey_id)) for survey_id in survey_ids),
+                'missing': sum(1 for key in expected if saved[key] == 0),
+                'duplicated': sum(1 for key in expected if saved[key] > 1),
+                'broken': sum(count for (key, count) in saved.iteritems() if key not in expected),
+            }
+
+        return results
+
+    finally:
+        catherdinglaser.storage = original_storage
+
+def Scaling(sizes, options_sizes):
+
+    """ Scaling(sizes, options_sizes): Times the parser on ever larger surveys and ever wider Random Checkbox rows; time per line should stay flat.
+    """
+
+    results = {'lines': [], 'random_checkbox_options': []}
+
+    for lines in sizes:
+        with open("scaling.txt", "w") as survey_file:
+            survey_file.write(Generate_Survey(lines))
+        seconds = Time(lambda: catherdinglaser.Load_Letter_Blocks("scaling.txt", use_artifact=False), 1)['best_us'] / 1000000
+        results['lines'].append({'lines': lines, 'seconds': seconds, 'us_per_line': seconds / lines * 1000000})
+
+    for options in options_sizes:
+        with open("scaling.txt", "w") as survey_file:
+            survey_file.write(Generate_Survey(100, ['Random Checkbox'], options=options))
+        seconds = Time(lambda: catherdinglaser.Load_Letter_Blocks("scaling.txt", use_artifact=False), 1)['best_us'] / 1000000
+        results['random_checkbox_options'].append({'options': options, 'seconds': seconds, 'us_per_option': seconds / (options * 100) * 1000000})
+
+    return results
+
+# The survey script as it was before build_index(), kept so Engine_Benchmark() can compare against it
+LEGACY_ENGINE_JS = """
+function generate_unform()
+{
+    document.forms['cat_herding_laser'].CHL_choices.value = "";
+    var elem = document.getElementById('cat_herding_laser').elements;
+    var write_this = "";
+    for (var i=0;i<elem.length-1;i++)
+    {
+        if (elem[i].value != undefined && elem[i].value != '' && elem[i].value != false && elem[i].name != 'CHL_seed')
+        {
+            if ((elem[i].type == 'radio' && elem[i].checked) || (elem[i].type == 'checkbox' && elem[i].checked) || (elem[i].type != 'radio' && elem[i].type != 'checkbox'))
+            {
+                write_this += elem[i].value + " ";
+            }
+        }
+    }
+    document.forms['cat_herding_laser'].CHL_choices.value = write_this;// DEBUG ONLY; COMMENT OUT THIS FULL LINE
+    
+}
+function validate_unform() // Checks that all required fields have been filled out
+{
+        var required = CHL_required;
+        all_required_completed = true; // will get toggled if incomplete
+
+        for (var i=0;i<required.length;i++)
+        {
+        	var radio_options = document.getElementsByName(required[i]);
+        	var is_checked = false;
+        	for (var x=0;x<radio_options.length;x++)
+        	{
+			if (document.getElementsByName(required[i])[x].checked)
+			{
+				is_checked = true;
+			}
+		}
+		if (is_checked == true)
+		{
+			document.getElementById('fieldset_' + required[i]).style.background="#ffffff";
+		}
+		else
+		{
+			all_required_completed = false;
+			document.getElementById('fieldset_' + required[i]).style.background="#ff9933";
+		}
+	}
+	if (all_required_completed == true)
+	{
+		generate_unform();
+		document.forms['cat_herding_laser'].submit();
+	}
+}
+
+"""
+
+# Just enough of a browser for the survey script to run under node.  getElementsByName() scans every element each time it's called,
+# like a browser that doesn't cache name lookups.
+ENGINE_HARNESS = """
+var elements = %(elements)s.map(function (e) { return {'type': e[0], 'name': e[1], 'value': e[2], 'checked': false}; });
+var by_id = {};
+%(fieldsets)s.forEach(function (id) { by_id[id] = {'style': {}}; });
+var form = {'elements': elements, 'submit': function () {}};
+elements.forEach(function (e) { if (e.name == 'CHL_choices') form.CHL_choices = e; });
+by_id['cat_herding_laser'] = form;
+var document = {
+    'forms': {'cat_herding_laser': form},
+    'getElementById': function (id) { return by_id[id] || null; },
+    'getElementsByName': function (name) { return elements.filter(function (e) { return e.name == name; }); }
+};
+var window = {};
+
+// Answer every question so validate_unform() goes on to generate the letter
+var answered = {};
+elements.forEach(function (e, i) {
+    if (e.type == 'radio' && !answered[e.name]) { e.checked = answered[e.name] = true; }
+    if (e.type == 'checkbox') { e.checked = (i %% 2 == 0); }
+});
+
+%(engine)s
+
+var started = performance.now();
+if (typeof build_index == 'function') { build_index(); }
+var index_ms = performance.now() - started;
+
+var presses = [];
+for (var r = 0; r < %(presses)d; r++) {
+    started = performance.now();
+    validate_unform();
+    presses.push(performance.now() - started);
+}
+presses.sort(function (a, b) { return a - b; });
+
+console.log(JSON.stringify({'index_ms': index_ms, 'press_ms': presses[Math.floor(presses.length / 2)], 'letter': form.CHL_choices.value}));
+"""
+
+def Survey_Elements(page):
+
+    """ Survey_Elements(page): Returns the (type, name, value) of every form element on a survey page, in order, and the ids of its fieldsets.
+    """
+
+    elements = [(input_type, name, value.replace("&quot;", '"')) for (input_type, name, value) in re.findall(r'<input type="(\w+)" name="([^"]+)" value="([^"]*)"', page)]
+    elements.append(('textarea', 'CHL_choices', ''))
+    elements.append(('button', 'Submit', 'Finished!'))
+
+    return (elements, re.findall(r'<fieldset id="([^"]+)"', page))
+
+def Engine_Benchmark(questions, options, presses=5):
+
+    """ Engine_Benchmark(questions, options, presses): Times pressing "Finished!" on a generated survey under node, with ENGINE_JS and with LEGACY_ENGINE_JS.
+        Only Radio and Checkbox questions are generated, since LEGACY_ENGINE_JS stops with an error on a required Text block.
+        Returns None if node isn't installed.
+    """
+
+    node = distutils.spawn.find_executable('node')
+
+    if node is None:
+        return None
+
+    survey = Generate_Survey(questions, ['Radio', 'Checkbox', 'Random Radio', 'Random Checkbox'], options=options)
+
+    with open("engine.txt", "w") as survey_file:
+        survey_file.write(survey)
+    (survey_id, all_letter_blocks, required_fields) = catherdinglaser.Load_Letter_Blocks("engine.txt", use_artifact=False)
+    page = catherdinglaser.Compile_EndUser_Survey(survey_id, all_letter_blocks, required_fields).Render(seed=0)
+    (elements, fieldsets) = Survey_Elements(page)
+
+    results = {'questions': questions, 'options': options, 'elements': len(elements)}
+
+    for (name, engine) in [('legacy', LEGACY_ENGINE_JS), ('current', catherdinglaser.ENGINE_JS)]:
+        with open("engine.js", "w") as harness_file:
+            harness_file.write(ENGINE_HARNESS % {'elements': json.dumps(elements), 'fieldsets': json.dumps(fieldsets), 'engine': "var CHL_required = {};\n{}".format(json.dumps(required_fields), engine), 'presses': presses})
+        results[name] = json.loads(subprocess.check_output([node, "engine.js"]))
+
+    results['letters_match'] = results['legacy'].pop('letter') == results['current'].pop('letter')
+
+    return results
+
+def Git_Commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Cat Herding Laser benchmark suite")
+    parser.add_argument('--lines', type=int, default=200, help="lines in the generated survey")
+    parser.add_argument('--mix', default=','.join("{}=1".format(block_type) for block_type in BLOCK_TYPES), help="block types and weights, e.g. Text=1,Radio=3,Random Checkbox=1")
+    parser.add_argument('--options', type=int, default=4, help="options per Radio or Checkbox block")
+    parser.add_argument('--variants', type=int, default=3, help="values per option of a Random block")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the generated survey")
+    parser.add_argument('--number', type=int, default=20, help="calls per micro-benchmark timing")
+    parser.add_argument('--port', type=int, default=8099, help="port for the load test")
+    parser.add_argument('--concurrency', type=int, default=10, help="concurrent clients (and server threads) for the load test")
+    parser.add_argument('--requests', type=int, default=500, help="requests per endpoint for the load test")
+    parser.add_argument('--skip-load', action='store_true', help="skip the load test")
+    parser.add_argument('--event-server', action='store_true', help="serve the load test with Event_Server instead of CherryPy's threaded server")
+    parser.add_argument('--slow-clients', type=int, default=0, help="connections that send half a request and then go quiet, held open during the load test")
+    parser.add_argument('--cross-talk-surveys', type=int, default=4, help="surveys to serve at once for the cross-talk check")
+    parser.add_argument('--skip-cross-talk', action='store_true', help="skip the cross-talk check")
+    parser.add_argument('--skip-seed-check', action='store_true', help="skip the seed check")
+    parser.add_argument('--writer-responses', type=int, default=2000, help="responses to submit in the writer check")
+    parser.add_argument('--skip-writer-check', action='store_true', help="skip the writer check")
+    parser.add_argument('--engine-questions', type=int, default=300, help="questions in the survey used to time the survey script under node")
+    parser.add_argument('--engine-options', type=int, default=8, help="options per question in that survey")
+    parser.add_argument('--skip-engine', action='store_true', help="skip timing the survey script")
+    parser.add_argument('--scaling', action='store_true', help="also time the parser on surveys from 1,250 to 20,000 lines and Random Checkbox rows up to 2,000 options wide")
+    parser.add_argument('--output', default="benchmark-results.json", help="where to save the JSON results")
+    arguments = parser.parse_args()
+
+    survey = Generate_Survey(arguments.lines, Parse_Mix(arguments.mix), arguments.options, arguments.variants, arguments.seed)
+    output_filename = os.path.abspath(arguments.output)
+
+    results = {
+        'started': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'commit': Git_Commit(),
+        'python': platform.python_version(),
+        'cherrypy': cherrypy.__version__,
+        'survey': {'lines': arguments.lines, 'mix': arguments.mix, 'options': arguments.options, 'variants': arguments.variants, 'seed': arguments.seed, 'bytes': len(survey)},
+    }
+
+    working_directory = tempfile.mkdtemp()
+    original_directory = os.getcwd()
+    os.chdir(working_directory)
+
+    try:
+        (survey_id, results['micro']) = Micro_Benchmarks(survey, arguments.number)
+        if not arguments.skip_load:
+            results['load'] = Load_Test(survey, arguments.port, arguments.concurrency, arguments.requests, arguments.event_server, arguments.slow_clients)
+        if not arguments.skip_cross_talk:
+            surveys = [Generate_Survey(arguments.lines, Parse_Mix(arguments.mix), arguments.options, arguments.variants, arguments.seed + x + 1) for x in xrange(arguments.cross_talk_surveys)]
+            results['cross_talk'] = Cross_Talk(surveys, arguments.port, arguments.concurrency, arguments.requests)
+        if not arguments.skip_seed_check:
+            results['seeds'] = Seed_Check(survey, arguments.concurrency)
+        if not arguments.skip_writer_check:
+            results['writer'] = Writer_Check(arguments.concurrency, arguments.writer_responses)
+        if not arguments.skip_engine:
+            results['engine'] = Engine_Benchmark(arguments.engine_questions, arguments.engine_options)
+        if arguments.scaling:
+            results['scaling'] = Scaling([1250, 2500, 5000, 10000, 20000], [125, 250, 500, 1000, 2000])
+    finally:
+        os.chdir(original_directory)
+        shutil.rmtree(working_directory)
+
+    print "{:<45} {:>14} {:>14}".format("micro-benchmark", "best (us)", "median (us)")
+    for (name, timing) in sorted(results['micro'].iteritems()):
+        print "{:<45} {:>14,.1f} {:>14,.1f}".format(name, timing['best_us'], timing['median_us'])
+
+    if 'load' in results:
+        print
+        print "{:<10} {:>10} {:>8} {:>10} {:>10} {:>10}   {}, {} slow clients".format("endpoint", "req/s", "errors", "p50 (ms)", "p95 (ms)", "p99 (ms)", "Event_Server" if arguments.event_server else "threaded server", arguments.slow_clients)
+        for (endpoint, load) in sorted(results['load'].iteritems()):
+            print "{:<10} {:>10,.1f} {:>8} {:>10} {:>10} {:>10}".format(endpoint, load['requests_per_second'], load['errors'], *["-" if load[key] is None else "{:.2f}".format(load[key]) for key in ('p50_ms', 'p95_ms', 'p99_ms')])
+
+    if 'cross_talk' in results:
+        print
+        print "{:<10} {:>10} {:>8} {:>8}   cross-talk, {} surveys at once".format("check", "calls", "wrong", "errors", arguments.cross_talk_surveys)
+        for (check, counts) in sorted(results['cross_talk'].iteritems()):
+            print "{:<10} {:>10,} {:>8} {:>8}".format(check, counts['calls'], counts['wrong'], counts['errors'])
+
+    if 'seeds' in results:
+        print
+        print "{:<10} {:>10} {:>8}   seeds, {} threads".format("template", "renders", "wrong", arguments.concurrency)
+        for (name, counts) in sorted(results['seeds'].iteritems()):
+            print "{:<10} {:>10,} {:>8}".format(name, counts['calls'], counts['wrong'])
+
+    if 'writer' in results:
+        print
+        print "{:<14} {:>10} {:>9} {:>8} {:>11} {:>7}   writer, {} threads".format("mode", "responses", "segments", "missing", "duplicated", "broken", arguments.concurrency)
+        for (mode, counts) in sorted(results['writer'].iteritems()):
+            print "{:<14} {:>10,} {:>9,} {:>8} {:>11} {:>7}".format(mode, counts['responses'], counts['segments'], counts['missing'], counts['duplicated'], counts['broken'])
+
+    if results.get('engine') is not None:
+        print
+        print "Survey script, {questions} questions x {options} options ({elements:,} form elements), under node:".format(**results['engine'])
+        for name in ['legacy', 'current']:
+            print "{:<10} build index {:>10.2f} ms   press Finished! {:>10.2f} ms".format(name, results['engine'][name]['index_ms'], results['engine'][name]['press_ms'])
+        print "Letters match: {}".format(results['engine']['letters_match'])
+    elif 'engine' in results:
+        print
+        print "node not found; skipped timing the survey script"
+
+    if 'scaling' in results:
+        print
+        for row in results['scaling']['lines']:
+            print "{:>10,} lines {:>12.4f} s {:>10.2f} us/line".format(row['lines'], row['seconds'], row['us_per_line'])
+        for row in results['scaling']['random_checkbox_options']:
+            print "{:>10,} options {:>10.4f} s {:>10.2f} us/option".format(row['options'], row['seconds'], row['us_per_option'])
+
+    with open(output_filename, "w") as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+
+    print
+    print "Results saved to {}".format(output_filename)
+
+    if any(counts['wrong'] > 0 for counts in results.get('cross_talk', {}).itervalues()):
+        sys.exit("Cross-talk: some requests saw another request's state")
+
+    if any(counts['wrong'] > 0 for counts in results.get('seeds', {}).itervalues()):
+        sys.exit("Seeds: some pages rendered differently from the same seed")
+
+    if any(counts['missing'] + counts['duplicated'] + counts['broken'] > 0 for counts in results.get('writer', {}).itervalues()):
+        sys.exit("Writer: some responses were lost, saved twice or broken")
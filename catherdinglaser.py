@@ -2,13 +2,78 @@
 
 # Cat Herding Laser
 
+import ast
+import base64
+import bisect
 import cherrypy # Download at: http://cherrypy.org/
+import cherrypy.wsgiserver
+import collections
+import csv
+import errno
+import functools
+import glob
+import gzip
 import hashlib # For Survey ID generation
+import hmac
+import json
+import marshal
+import math
+import mmap
+import multiprocessing
+import os
+import posixpath
+import Queue
 import random
+import select
+import shutil
+import signal
+import socket
+import sqlite3
+import StringIO
+import sys
+import tarfile
+import threading
+import time
+import urllib
+import xml.etree.cElementTree as ElementTree
+import zipfile
+import zlib
+
+try:
+    import brotli # Optional; adds br to the encodings offered by the Compressor
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl # Locks the responses files while several processes append to them; not available on Windows
+except ImportError:
+    fcntl = None
+
+thread_random = threading.local()
+
+def Thread_Random():
+
+    """ Thread_Random(): Returns a random.Random belonging to the calling thread, so worker threads never share random state.
+    """
+
+    try:
+        return thread_random.generator
+    except AttributeError:
+        thread_random.generator = random.Random()
+        return thread_random.generator
+
+def New_Seed():
+
+    """ New_Seed(): Returns a fresh seed for rendering one survey page; see Survey_Template.Render().
+    """
+
+    return Thread_Random().getrandbits(64)
 
 class Letter_Block(object):
 
     """ class Letter_Block: Parent Class for all other Block objects; not called directly.
+        Blocks aren't changed once a survey is loaded: the Set methods are only for building them, and the Get methods keep nothing on the block,
+        so one parsed survey can be shared by every thread (see Survey_Cache and Parse_Cache) without locking.
     """
     
     def __init__(self):
@@ -27,6 +92,14 @@ class Letter_Block(object):
     def Get_Permutations(self):
         return 1
 
+    def Iter_Options(self):
+
+        """\t Iter_Options(): Yields a tuple of (display during choice, are written as candidates, in-between text) once per option, without copying the block's lists.
+            Blocks without a choice yield a single option whose display is None; only Checkbox blocks have in-between text.
+        """
+
+        return iter([])
+
 class Static_Block(Letter_Block):
 
     """ class Static_Block(Letter_Block): used for any independent static string.  Common usage: static headers and footers, static in-between text.
@@ -41,6 +114,9 @@ class Static_Block(Letter_Block):
     def Get_AWA(self):
         return [self.are_written_as]
 
+    def Iter_Options(self):
+        yield (None, (self.are_written_as,), None)
+
     def SetValue(self, are_written_as):
         self.are_written_as = are_written_as
 
@@ -56,8 +132,11 @@ class Randomized_Static_Block(Letter_Block):
         self.alias = "Random Text"
         self.are_written_as = args[0]
 
-    def Get_AWA(self):
-        return [random.choice(self.are_written_as)]
+    def Get_AWA(self, rng=None):
+        return [(rng or Thread_Random()).choice(self.are_written_as)]
+
+    def Iter_Options(self):
+        yield (None, self.are_written_as, None)
 
     def SetValues(self, are_written_as):
         if type(are_written_as) == list: # I hate to do explicit type testing but Randomized_Static_Blocks don't work without a list to choose from
@@ -89,11 +168,8 @@ class Dynamic_Block(Letter_Block):
 
         if items is None:
             items = xrange(len(self.display_during_choice))
-        
-        self.DDCs = []
-        for x in items:
-            self.DDCs.append(self.display_during_choice[x])
-        return self.DDCs         
+
+        return [self.display_during_choice[x] for x in items]
 
     def Get_AWA(self, items = None):
 
@@ -103,10 +179,11 @@ class Dynamic_Block(Letter_Block):
         if items is None:
             items = xrange(len(self.are_written_as))
 
-        self.AWAs = []
-        for x in items:
-            self.AWAs.append(self.are_written_as[x])
-        return self.AWAs
+        return [self.are_written_as[x] for x in items]
+
+    def Iter_Options(self):
+        for (display_during_choice, are_written_as) in zip(self.display_during_choice, self.are_written_as):
+            yield (display_during_choice, (are_written_as,), None)
 
     def GetTitle(self):
         return self.display_title
@@ -146,20 +223,26 @@ class Randomized_Dynamic_Block(Dynamic_Block):
         self.block_type = "Randomized_Dynamic_Block"
         self.alias = "Random Radio"
         
-    def Get_AWA(self, items = None):
+    def Get_AWA(self, items = None, rng = None):
 
-        """\t Get_AWA(item): Returns the 'Are Written As' value for the specified list item, randomly selected from the corresponding list.
+        """\t Get_AWA(item, rng): Returns the 'Are Written As' value for the specified list item, randomly selected from the corresponding list using rng (a random.Random; defaults to Thread_Random()).
         """
 
+        rng = rng or Thread_Random()
+
         if items is None:
             items = xrange(len(self.are_written_as))
 
-        self.possible_values = []
+        possible_values = []
 
         for x in items:
-            self.possible_values.extend(self.are_written_as[x].values())
-            
-        return random.choice(random.choice(self.possible_values))
+            possible_values.extend(self.are_written_as[x].values())
+
+        return rng.choice(rng.choice(possible_values))
+
+    def Iter_Options(self):
+        for (display_during_choice, are_written_as) in zip(self.display_during_choice, self.are_written_as):
+            yield (display_during_choice, are_written_as.values()[0], None)
 
     def Get_Permutations(self):
 
@@ -171,7 +254,7 @@ class Randomized_Dynamic_Block(Dynamic_Block):
         permutations = 0
         
         for x in xrange(len(self.are_written_as)): 
-            permutations += len(self.are_written_as[x].values().pop()) 
+            permutations += len(self.are_written_as[x].values()[0]) 
 
         return permutations + one_if_optional
             
@@ -195,15 +278,19 @@ class Multiple_Dynamic_Block(Dynamic_Block):
         if items is None:
             items = xrange(len(self.are_written_as))
         
-        self.AWAs = []
-        for x in items: 
-            if (len(items) > list(items).index(x) + 1):
-                ##  NOTE: Here, items references the object's DisplayDuringChoice list; there will never be two identical DisplayDuringChoice items
-                ##      otherwise it would be confusing for the user; therefore I can take this shortcut without worrying about .index() returning the first of a set of two identical list items
-                self.AWAs.append("{}{}".format(self.are_written_as[x][0], self.are_written_as[x][1]))
+        last = len(items) - 1
+
+        AWAs = []
+        for (position, x) in enumerate(items):
+            if position < last:
+                AWAs.append("{}{}".format(self.are_written_as[x][0], self.are_written_as[x][1]))
             else:
-                self.AWAs.append(self.are_written_as[x][0])
-        return self.AWAs
+                AWAs.append(self.are_written_as[x][0])
+        return AWAs
+
+    def Iter_Options(self):
+        for (display_during_choice, (are_written_as, in_between)) in zip(self.display_during_choice, self.are_written_as):
+            yield (display_during_choice, (are_written_as,), in_between)
 
     def Get_Permutations(self):
         if self.required_field == True:
@@ -222,21 +309,29 @@ class Multiple_Randomized_Dynamic_Block(Dynamic_Block):
         self.block_type = "Multiple_Randomized_Dynamic_Block"
         self.alias = "Random Checkbox"
 
-    def Get_AWA(self, items = None):
+    def Get_AWA(self, items = None, rng = None):
 
-        """\t Get_AWA(items): Returns the 'Are Written As' values for specified list items, each randomly selected from its corresponding list, with natural language between list items preserved.
+        """\t Get_AWA(items, rng): Returns the 'Are Written As' values for specified list items, each randomly selected from its corresponding list using rng (a random.Random; defaults to Thread_Random()), with natural language between list items preserved.
         """
 
+        rng = rng or Thread_Random()
+
         if items is None:
             items = xrange(len(self.are_written_as))
         
-        self.AWAs = []
-        for x in items:
-            if (len(items) > list(items).index(x) + 1):
-                self.AWAs.append("{}{}".format(random.choice(self.are_written_as[x][0][self.are_written_as[x][0].keys().pop()]), self.are_written_as[x][1]))
+        last = len(items) - 1
+
+        AWAs = []
+        for (position, x) in enumerate(items):
+            if position < last:
+                AWAs.append("{}{}".format(rng.choice(self.are_written_as[x][0].values()[0]), self.are_written_as[x][1]))
             else:
-                self.AWAs.append(random.choice(self.are_written_as[x][0][self.are_written_as[x][0].keys().pop()]))
-        return self.AWAs
+                AWAs.append(rng.choice(self.are_written_as[x][0].values()[0]))
+        return AWAs
+
+    def Iter_Options(self):
+        for (display_during_choice, (are_written_as, in_between)) in zip(self.display_during_choice, self.are_written_as):
+            yield (display_during_choice, are_written_as.values()[0], in_between)
 
     def Get_Permutations(self):
 
@@ -248,7 +343,7 @@ class Multiple_Randomized_Dynamic_Block(Dynamic_Block):
         permutations = 1
         
         for x in xrange(len(self.are_written_as)): 
-            permutations_per_box = len(self.are_written_as[x][0].values().pop()) + one_if_optional
+            permutations_per_box = len(self.are_written_as[x][0].values()[0]) + one_if_optional
             permutations *= permutations_per_box
 
         return permutations 
@@ -260,20 +355,205 @@ def Find_DoubleTab_Dividers(split_line):
     """
 
     separators = []
-            
-    for (index, value) in enumerate(split_line):
-        if value == "" and split_line[index+1] == "":
-            separators.append(index) 
+
+    for index in xrange(1, len(split_line)):
+        if split_line[index] == "" and split_line[index-1] == "":
+            separators.append(index-1)
 
     return separators
 
-def Load_Letter_Blocks(letter_blocks_filename, validation_mode=False):
+class Missing_Tabs(Exception):
+
+    """ class Missing_Tabs(Exception): Raised while parsing a Random Checkbox option that has nothing between its double tabs.
+    """
+
+# Each parser takes a survey line split on tabs:
+# split_line[0] is reserved for the name of the type of letter block
+# split_line[1] is reserved for whether the block is required or not; any value other than "Required", including blanks, denotes optional fields
+# split_line[2] and beyond correspond to the individual letter block's specifications
+# Parsers raise IndexError when there aren't enough items.
+
+def Parse_Static_Block(split_line):
+    return Static_Block(split_line[2])
+
+def Parse_Randomized_Static_Block(split_line):
+    return Randomized_Static_Block(split_line[2:])
+
+def Parse_Dynamic_Block(split_line):
+    ddc = split_line[3::2]
+    awa = split_line[4::2]
+
+    return Dynamic_Block(split_line[2], ddc[:len(awa)], awa)
+
+def Parse_Randomized_Dynamic_Block(split_line):
+    separators = Find_DoubleTab_Dividers(split_line)
+
+    ddc = []
+    dict_awa = {}
+
+    for (index, separator) in enumerate(separators): # Separators are going to be in between each set of ddc/awa pairs
+        if index + 1 < len(separators):
+            next_separator = separators[index+1]
+        else:
+            next_separator = len(split_line)
+
+        ddc.append(split_line[separator+2])
+        dict_awa[split_line[separator+2]] = split_line[separator+3:next_separator]
+
+    awa = [{single_ddc: dict_awa[single_ddc]} for single_ddc in ddc]
+
+    return Randomized_Dynamic_Block(split_line[2], ddc, awa)
+
+def Parse_Multiple_Dynamic_Block(split_line):
+    ddc = []
+    awa = []
+
+    for x in xrange(4, len(split_line), 3):
+        ddc.append(split_line[x-1])
+        awa.append((split_line[x], split_line[x+1]))
+
+    return Multiple_Dynamic_Block(split_line[2], ddc, awa)
+
+def Parse_Multiple_Randomized_Dynamic_Block(split_line):
+    separators = Find_DoubleTab_Dividers(split_line)
+
+    ddc = []
+    inb = []
+    dict_awa = {}
+
+    for (index, separator) in enumerate(separators): # Separators are going to be in between each set of ddc/awa/inb trios
+        if index + 1 < len(separators):
+            inb_index = separators[index+1] - 1
+        else:
+            inb_index = len(split_line) - 1
+
+        ddc.append(split_line[separator+2])
+
+        if inb_index <= separator + 3:
+            raise Missing_Tabs("no values given for {}".format(split_line[separator+2]))
+
+        dict_awa[split_line[separator+2]] = split_line[separator+3:inb_index]
+        inb.append(split_line[inb_index])
+
+    awa = [({single_ddc: dict_awa[single_ddc]}, single_inb) for (single_ddc, single_inb) in zip(ddc, inb)]
+
+    return Multiple_Randomized_Dynamic_Block(split_line[2], ddc, awa)
+
+# User-friendly aliases for types of letter blocks
+# Static Block:                             Text
+# Randomized Static Block:                  Random Text
+# Dynamic Block:                            Radio
+# Randomized Dynamic Block:                 Random Radio
+# Multiple Dynamic Block:                   Checkbox
+# Multiple Randomized Dynamic Block:        Random Checkbox
+BLOCK_PARSERS = {
+    'Static_Block': Parse_Static_Block,
+    'Text': Parse_Static_Block,
+    'Randomized_Static_Block': Parse_Randomized_Static_Block,
+    'Random_Text': Parse_Randomized_Static_Block,
+    'Dynamic_Block': Parse_Dynamic_Block,
+    'Radio': Parse_Dynamic_Block,
+    'Randomized_Dynamic_Block': Parse_Randomized_Dynamic_Block,
+    'Random_Radio': Parse_Randomized_Dynamic_Block,
+    'Multiple_Dynamic_Block': Parse_Multiple_Dynamic_Block,
+    'Checkbox': Parse_Multiple_Dynamic_Block,
+    'Multiple_Randomized_Dynamic_Block': Parse_Multiple_Randomized_Dynamic_Block,
+    'Random_Checkbox': Parse_Multiple_Randomized_Dynamic_Block,
+}
+
+def Parse_Letter_Block(line, line_number):
+
+    """ Parse_Letter_Block(line, line_number): Parses a single line of a survey.
+        Returns a tuple of (block, validation): block is None if the line couldn't be loaded, and validation is a list of error messages for the line.
+    """
+
+    split_line = line.strip('\n').split("\t")
+    block_parser = BLOCK_PARSERS.get(split_line[0].replace(" ", "_"))
+
+    if block_parser is None:
+        return (None, ["Unrecognized type of block: {}; ignoring and moving to the next line".format(split_line[0])])
+
+    try:
+        block = block_parser(split_line)
+    except IndexError, e:
+        return (None, ["Failed to load {0} at line number {1} for reason {2}; {0} is formatted incorrectly (not enough items).\n".format(split_line[0], line_number, e),
+                       "\tHere's the text I stumbled over: {}\n".format(line)])
+    except Missing_Tabs, e:
+        return (None, ["Failed to load {0} at line number {1} for reason {2}; {0} is formatted incorrectly (not enough items, or missing tabs).\n".format(split_line[0], line_number, e)])
+
+    if len(split_line) > 1 and split_line[1].capitalize() == "Required":
+        block.SetRequired(True)
+
+    return (block, [])
+
+def Letter_Diversity(all_letter_blocks):
+
+    """ Letter_Diversity(all_letter_blocks): Returns how varied the survey's letters can be as a JSON-ready dictionary.  Works with the logarithm of each block's Get_Permutations()
+        rather than multiplying them together, so a survey with an astronomical number of letters costs no more than a small one.
+        Assumes every choice is equally likely, so real letters are less varied than this; Distinct_Letters counts how varied they turn out to be.
+            entropy_bits: log2 of the survey's (or the block's) number of permutations
+            collision_probability: chance that the block gives two supporters the same text
+            log10_permutations: log10 of the survey's number of permutations (the product of every block's Get_Permutations())
+            log10_collision_probability: log10 of the chance that two supporters write the same letter
+            log10_letters_before_duplicate: log10 of how many letters are likely to be sent before two match (the birthday bound, sqrt(pi / 2 * permutations))
+    """
+
+    blocks = []
+    entropy_bits = 0.0
+
+    for line_number in sorted(all_letter_blocks):
+        block = all_letter_blocks[line_number]
+        bits = math.log(max(block.Get_Permutations(), 1), 2)
+        entropy_bits += bits
+        blocks.append(collections.OrderedDict([('line_number', line_number), ('block_type', block.alias), ('title', block.GetTitle() or None), ('entropy_bits', bits), ('collision_probability', 2.0 ** -bits)]))
+
+    log10_permutations = entropy_bits * math.log10(2)
+
+    return collections.OrderedDict([
+        ('entropy_bits', entropy_bits),
+        ('log10_permutations', log10_permutations),
+        ('log10_collision_probability', -log10_permutations),
+        ('log10_letters_before_duplicate', (math.log10(math.pi / 2) + log10_permutations) / 2),
+        ('blocks', blocks),
+    ])
+
+def Log10_Amount(log10_value, html=True):
+
+    """ Log10_Amount(log10_value, html): Writes out 10 ** log10_value for people: exactly while it's small enough to read, otherwise as a power of ten (with <sup> if html, or ^ if not).
+    """
+
+    if log10_value < 12:
+        return "{:,}".format(int(round(10 ** log10_value)))
+    if html:
+        return "about 10<sup>{:,.0f}</sup>".format(log10_value)
+    return "about 10^{:,.0f}".format(log10_value)
+
+def Diversity_Message(diversity):
+
+    """ Diversity_Message(diversity): Describes the Letter_Diversity() of a survey for Root.createsurvey() and Root.validate(); blank for a survey with errors.
+    """
+
+    if diversity is None:
+        return ""
+
+    return ("Based on your supporters' choices, this could create as many as <b>{}</b> unique Un-form letters.  Mathematical!<br>&nbsp;<br>"
+            "That's {:,.1f} bits of variety: if every choice were equally likely, two supporters would write the same letter once in {} pairs, "
+            "and the first two matching letters would come after {} letters.").format(Log10_Amount(diversity['log10_permutations']), diversity['entropy_bits'], Log10_Amount(diversity['log10_permutations']), Log10_Amount(diversity['log10_letters_before_duplicate']))
+
+def Load_Letter_Blocks(letter_blocks_filename, validation_mode=False, use_artifact=True):
 
     """ Load_Letter_Blocks(): Loads all letter blocks from the specified file.
+        Uses the precompiled artifact saved by Save_Survey_Artifact() instead of parsing the file whenever the artifact is up to date, unless use_artifact is False.
+        With validation_mode, letter_blocks_filename is the survey itself; returns (True, the survey page, Letter_Diversity()) if it's valid and (False, error messages, None) if not.
     """
 
     if validation_mode == False:
 
+        if use_artifact == True:
+            loaded = Load_Survey_Artifact(letter_blocks_filename)
+            if loaded is not None:
+                return loaded
+
         try:
             with open(letter_blocks_filename) as letter_blocks_file:
                 letter_blocks = letter_blocks_file.read()
@@ -286,6 +566,25 @@ def Load_Letter_Blocks(letter_blocks_filename, validation_mode=False):
     else:
         letter_blocks = letter_blocks_filename.split("\n") # letter_blocks_filename in this case is actually the survey passed in directly from the validation form, not an actual file.
 
+    (all_letter_blocks, required_fields, validation) = Parse_Survey(letter_blocks, use_parse_cache=validation_mode)
+
+    if validation_mode == True:
+        if len(validation) == 0:            
+            with handler_metrics.Timer('create_enduser_survey'):
+                returned_source = Create_EndUser_Survey(0, all_letter_blocks, required_fields)
+            return (True, returned_source, Letter_Diversity(all_letter_blocks))
+        else:
+            return (False, validation, None)
+    else:
+        return (survey_id, all_letter_blocks, required_fields)
+
+def Parse_Survey(letter_blocks, use_parse_cache=False):
+
+    """ Parse_Survey(letter_blocks, use_parse_cache): Parses the lines of a survey.
+        Returns a tuple of (all_letter_blocks, required_fields, validation), where validation lists the error messages for every line that couldn't be loaded.
+            use_parse_cache: look lines up in parse_cache first, as when validating
+    """
+
     all_letter_blocks = {}
     required_fields = []
 
@@ -297,458 +596,3080 @@ def Load_Letter_Blocks(letter_blocks_filename, validation_mode=False):
         if line.strip() == "":
             continue
 
-        split_line= line.strip('\n')
-        split_line = split_line.split("\t")        
+        if use_parse_cache == True:
+            (block, block_validation, line_hash) = parse_cache.Parse(line, line_number)
+        else:
+            (block, block_validation) = Parse_Letter_Block(line, line_number)
 
-        # split_line[0] is reserved for the name of the type of letter block
-        # split_line[1] is reserved for whether the block is required or not; any value other than "Required", including blanks, denotes optional fields
-        # split_line[2] and beyond correspond to the individual letter block's specifications
-        
+        if block is None:
+            validation.extend(block_validation)
+            continue
 
-        # split_line[0]: User-friendly aliases for types of letter blocks
-        # Static Block:                             Text
-        # Randomized Static Block:                  Random Text
-        # Dynamic Block:                            Radio
-        # Randomized Dynamic Block:                 Random Radio
-        # Multiple Dynamic Block:                   Checkbox
-        # Multiple Randomized Dynamic Block:        Random Checkbox
+        all_letter_blocks[line_number] = block
 
-        if (split_line[0].replace(" ","_") == "Static_Block" or split_line[0].replace(" ","_") == "Text"):
+        if block.required_field == True:
+            if 'Multiple' in block.block_type:
+                required_fields.append('ck{}'.format(line_number))
+            else:
+                required_fields.append('rd{}'.format(line_number))
 
-            try:
-                all_letter_blocks[line_number] = Static_Block(split_line[2])
-                
-            except IndexError, e:
-                validation.append("Failed to load {0} at line number {1} for reason {2}; {0} is formatted incorrectly (not enough items).\n".format(split_line[0], line_number, e))
-                validation.append("\tHere's the text I stumbled over: {}\n".format(line))
-            
-        elif (split_line[0].replace(" ","_") == "Randomized_Static_Block" or split_line[0].replace(" ","_") == "Random_Text"):
+    return (all_letter_blocks, required_fields, validation)
 
-            try:
-                all_letter_blocks[line_number] = Randomized_Static_Block(split_line[2:])
-                
-            except IndexError, e:
-                validation.append("Failed to load {0} at line number {1} for reason {2}; {0} is formatted incorrectly (not enough items).\n".format(split_line[0], line_number, e))
-                validation.append("\tHere's the text I stumbled over: {}\n".format(line))
-            
-        elif (split_line[0].replace(" ","_") == "Dynamic_Block" or split_line[0].replace(" ","_") == "Radio"):
+def Line_Hash(line):
+    return hashlib.new('md5', line.strip('\n')).hexdigest()
 
-            try:
-                ddc = []
-                awa = []
-                
-                for x in xrange(4, len(split_line), 2):
+class Parse_Cache(object):
 
-                    ddc.append(split_line[x-1])
-                    awa.append(split_line[x])       
-                    
-                all_letter_blocks[line_number] = Dynamic_Block(split_line[2], ddc, awa)
-                
-            except IndexError, e:
-                validation.append("Failed to load {0} at line number {1} for reason {2}; {0} is formatted incorrectly (not enough items).\n".format(split_line[0], line_number, e))
-                validation.append("\tHere's the text I stumbled over: {}\n".format(line))
-            
-        elif (split_line[0].replace(" ","_") == "Randomized_Dynamic_Block" or split_line[0].replace(" ","_") == "Random_Radio"): 
+    """ class Parse_Cache(object): Letter blocks parsed by Parse_Letter_Block(), keyed by Line_Hash() of the line they came from, so that a line is only parsed again once it changes.
+        Used while validating, where authors send the whole survey again after every edit.  Lines that fail to parse aren't kept: they fail quickly, and their messages name the line number.
+            max_entries: most lines to keep; least recently used lines are dropped first
+    """
 
-            try:
-                separators = Find_DoubleTab_Dividers(split_line)    
-                
-                ddc = []
-                awa = []
-                dict_awa = {}
+    def __init__(self, max_entries=100000):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.max_entries = max_entries
 
-                for (index, separator) in enumerate(separators): # Separators are going to be in between each set of ddc/awa pairs
-                    
-                    ddc.append(split_line[separator+2])
+    def Parse(self, line, line_number):
 
-                    current_awa = []
-                    
-                    try:
-                        for x in xrange(separator+3, separators[index+1]):
-                            current_awa.append(split_line[x])
-                        dict_awa[split_line[separator+2]] = current_awa
-                    except IndexError:
-                        for x in xrange(separator+3, len(split_line)):
-                            current_awa.append(split_line[x])
-                        dict_awa[split_line[separator+2]] = current_awa
-
-                for single_ddc in ddc:
-                    awa.append(({single_ddc: dict_awa[single_ddc]}))
-
-                all_letter_blocks[line_number] = Randomized_Dynamic_Block(split_line[2], ddc, awa)
-                
-            except IndexError, e:
-                validation.append("Failed to load {0} at line number {1} for reason {2}; {0} is formatted incorrectly (not enough items).\n".format(split_line[0], line_number, e))
-                validation.append("\tHere's the text I stumbled over: {}\n".format(line))
-            
-        elif (split_line[0].replace(" ","_") == "Multiple_Dynamic_Block" or split_line[0].replace(" ","_") == "Checkbox"):
+        """\t Parse(line, line_number): Returns the same (block, validation) as Parse_Letter_Block(), followed by the line's hash.
+        """
 
-            try:
-                ddc = []
-                awa = []
-                inb = []
+        line_hash = Line_Hash(line)
 
-                for x in xrange(4, len(split_line), 3):
-                    ddc.append(split_line[x-1])
-                    awa.append(split_line[x])
-                    inb.append(split_line[x+1]) 
+        with self.lock:
+            block = self.entries.pop(line_hash, None)
+            if block is not None:
+                self.entries[line_hash] = block
+                return (block, [], line_hash)
 
-                write_awa = []
-                
-                for x in xrange(len(awa)):
-                    write_awa.append((awa[x], inb[x]))
+        (block, validation) = Parse_Letter_Block(line, line_number)
 
-                all_letter_blocks[line_number] = Multiple_Dynamic_Block(split_line[2], ddc, write_awa)
-                
-            except IndexError, e:
-                validation.append("Failed to load {0} at line number {1} for reason {2}; {0} is formatted incorrectly (not enough items).\n".format(split_line[0], line_number, e))
-                validation.append("\tHere's the text I stumbled over: {}\n".format(line))
-            
-        elif (split_line[0].replace(" ","_") == "Multiple_Randomized_Dynamic_Block" or split_line[0].replace(" ","_") == "Random_Checkbox"):
+        if block is not None:
+            with self.lock:
+                self.entries[line_hash] = block
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
 
-            try:
-                separators = Find_DoubleTab_Dividers(split_line)
+        return (block, validation, line_hash)
 
-                ddc = []
-                awa = []
-                inb = []
-                dict_awa = {}
+parse_cache = Parse_Cache()
 
-                for (index, separator) in enumerate(separators): # Separators are going to be in between each set of ddc/awa/inb trios
+def Validate_Lines(survey, known=()):
 
-                    ddc.append(split_line[separator+2])
+    """ Validate_Lines(survey, known): Validates a survey line by line for an editor that validates as the author types, and returns the results as a JSON-ready dictionary.
+            known: tokens ("<line number>:<line hash>") of the lines the editor already has results for
+        'lines' lists the token of every line that isn't blank, so the editor can drop results for lines that have gone; 'changed' holds the error messages and preview of every other line.
+        'log10_permutations' is Letter_Diversity()'s figure for the whole survey, or None while it has errors.
+    """
 
-                    current_awa = []            
+    known = set(known)
+    lines = []
+    changed = []
+    all_letter_blocks = {}
+    required_fields = []
+    errors = 0
 
-                    try:
-                        try:
-                            for x in xrange(separator+3, separators[index+1]-1):
-                                current_awa.append(split_line[x])
-                            inb.append(split_line[x+1])
-                            dict_awa[split_line[separator+2]] = current_awa
-                        except UnboundLocalError, e:
-                            validation.append("Failed to load {0} at line number {1} for reason {2}; {0} is formatted incorrectly (not enough items, or missing tabs).\n".format(split_line[0], line_number, e))
-                    except IndexError:
-                        try:
-                            for x in xrange(separator+3, len(split_line)-1):
-                                current_awa.append(split_line[x])
-                            inb.append(split_line[x+1])
-                            dict_awa[split_line[separator+2]] = current_awa
-                        except UnboundLocalError, e:
-                            validation.append("Failed to load {0} at line number {1} for reason {2}; {0} is formatted incorrectly (not enough items, or missing tabs).\n".format(split_line[0], line_number, e))
-
-                for (single_ddc, single_inb) in zip(ddc, inb):
-                    try:
-                        awa.append(({single_ddc: dict_awa[single_ddc]}, single_inb))
-                    except KeyError:
-                        pass
+    for (line_number, line) in enumerate(survey.split("\n")):
 
-                all_letter_blocks[line_number] = Multiple_Randomized_Dynamic_Block(split_line[2], ddc, awa)
-            except IndexError, e:
-                validation.append("Failed to load {0} at line number {1} for reason {2}; {0} is formatted incorrectly (not enough items).\n".format(split_line[0], line_number, e))
-                validation.append("\tHere's the text I stumbled over: {}\n".format(line))
-            
+        if line.strip() == "":
+            continue
+
+        (block, validation, line_hash) = parse_cache.Parse(line, line_number)
+        token = "{}:{}".format(line_number, line_hash)
+        lines.append(token)
+
+        if block is None:
+            errors += 1
         else:
-            validation.append("Unrecognized type of block: {}; ignoring and moving to the next line".format(split_line[0]))
+            all_letter_blocks[line_number] = block
+            if block.required_field == True:
+                if 'Multiple' in block.block_type:
+                    required_fields.append('ck{}'.format(line_number))
+                else:
+                    required_fields.append('rd{}'.format(line_number))
+
+        if token in known:
             continue
 
-        if split_line[1].capitalize() == "Required":
-            all_letter_blocks[line_number].SetRequired(True)
-            if 'Multiple' in str(all_letter_blocks[line_number].block_type):
-                required_fields.append('ck{}'.format(line_number))
-            else:
-                required_fields.append('rd{}'.format(line_number))
+        if block is None:
+            preview = None
+        else:
+            chunks = []
+            Compile_Block(line_number, block, chunks, [])
+            preview = Survey_Template(chunks).Render()
 
-    total_permutations = 1
+        changed.append(collections.OrderedDict([('token', token), ('line_number', line_number), ('errors', validation), ('preview', preview)]))
 
-    for block in all_letter_blocks.itervalues():
-        total_permutations *= block.Get_Permutations()
+    log10_permutations = None
 
-    if validation_mode == True:
-        if len(validation) == 0:            
-            return (True, Create_EndUser_Survey(0, all_letter_blocks, required_fields), total_permutations)
-        else:
-            return (False, validation, 0)
-    else:
-        return (survey_id, all_letter_blocks, required_fields)
+    if errors == 0:
+        log10_permutations = Letter_Diversity(all_letter_blocks)['log10_permutations']
 
-def UnformLetter_Generating_JS(required_fields):
+    return collections.OrderedDict([('valid', errors == 0), ('errors', errors), ('log10_permutations', log10_permutations), ('required_fields', required_fields), ('lines', lines), ('changed', changed)])
 
-    """ UnformLetter_Generating_JS(): Helper function that simply returns a string - the javascript that generates the Unform letter values
-            required_fields: Return value of Load_Letter_Blocks()
+# Bump whenever the layout saved by Save_Survey_Artifact() changes; older artifacts are then ignored
+ARTIFACT_MAGIC = "CHL-SURVEY"
+ARTIFACT_VERSION = 2
+
+BLOCK_CLASSES = {
+    'Static_Block': Static_Block,
+    'Randomized_Static_Block': Randomized_Static_Block,
+    'Dynamic_Block': Dynamic_Block,
+    'Randomized_Dynamic_Block': Randomized_Dynamic_Block,
+    'Multiple_Dynamic_Block': Multiple_Dynamic_Block,
+    'Multiple_Randomized_Dynamic_Block': Multiple_Randomized_Dynamic_Block,
+}
+
+def Artifact_Filename(letter_blocks_filename):
+    return "{}.chl".format(letter_blocks_filename[:-4])
+
+def Save_Survey_Artifact(letter_blocks_filename):
+
+    """ Save_Survey_Artifact(letter_blocks_filename): Parses a survey file and saves the result next to it as <survey_id>.chl, so later loads can skip parsing.
+        The artifact holds each block's type and attributes (required flag, title and options), the required fields and Letter_Diversity()'s log10_permutations, plus the size and mtime of the survey file it came from.
+        Returns log10_permutations.
     """
 
-    required_fields = "', '".join(required_fields)
-    required_fields = "['{}']".format(required_fields)
+    file_stat = os.stat(letter_blocks_filename)
+    (survey_id, all_letter_blocks, required_fields) = Load_Letter_Blocks(letter_blocks_filename, use_artifact=False)
 
-    javascript = """
-<script language="JavaScript">
-function generate_unform()
-{{
-    document.forms['cat_herding_laser'].CHL_choices.value = "";
+    (blocks, log10_permutations) = Pack_Blocks(all_letter_blocks)
+
+    artifact = marshal.dumps((ARTIFACT_VERSION, file_stat.st_size, file_stat.st_mtime, blocks, required_fields, log10_permutations), 2)
+
+    with open("{}.tmp".format(Artifact_Filename(letter_blocks_filename)), "wb") as artifact_file:
+        artifact_file.write(ARTIFACT_MAGIC)
+        artifact_file.write(artifact)
+    os.rename("{}.tmp".format(Artifact_Filename(letter_blocks_filename)), Artifact_Filename(letter_blocks_filename))
+
+    return log10_permutations
+
+def Load_Survey_Artifact(letter_blocks_filename):
+
+    """ Load_Survey_Artifact(letter_blocks_filename): Loads the blocks saved by Save_Survey_Artifact() with a single read.
+        Returns the same tuple as Load_Letter_Blocks(), or None if there's no artifact, it's from another version, or the survey file has changed since it was saved.
+    """
+
+    try:
+        file_stat = os.stat(letter_blocks_filename)
+        with open(Artifact_Filename(letter_blocks_filename), "rb") as artifact_file:
+            artifact = artifact_file.read()
+    except (IOError, OSError):
+        return None
+
+    if not artifact.startswith(ARTIFACT_MAGIC):
+        return None
+
+    try:
+        (version, size, mtime, blocks, required_fields, log10_permutations) = marshal.loads(artifact[len(ARTIFACT_MAGIC):])
+    except (ValueError, EOFError, TypeError):
+        return None
+
+    if version != ARTIFACT_VERSION or size != file_stat.st_size or mtime != file_stat.st_mtime:
+        return None
+
+    return (letter_blocks_filename[:-4], Unpack_Blocks(blocks), required_fields)
+
+def Pack_Blocks(all_letter_blocks):
+
+    """ Pack_Blocks(all_letter_blocks): Returns a tuple of (blocks, log10_permutations), where blocks lists the (line number, block type, attributes) of every block, ready for marshal,
+        and log10_permutations comes from Letter_Diversity().
+    """
+
+    blocks = []
+
+    for (line_number, block) in all_letter_blocks.iteritems():
+        blocks.append((line_number, block.block_type, block.__dict__))
+
+    return (blocks, Letter_Diversity(all_letter_blocks)['log10_permutations'])
+
+def Unpack_Blocks(blocks):
+
+    """ Unpack_Blocks(blocks): Turns the blocks listed by Pack_Blocks() back into all_letter_blocks.
+    """
+
+    all_letter_blocks = {}
+
+    for (line_number, block_type, attributes) in blocks: # Blocks were checked when they were parsed, so skip __init__ and restore them as saved
+        block = object.__new__(BLOCK_CLASSES[block_type])
+        block.__dict__ = attributes
+        all_letter_blocks[line_number] = block
+
+    return all_letter_blocks
+
+# The script behind every survey page; only the required fields differ between surveys, and those are passed in CHL_required
+ENGINE_JS = """
+var CHL_index = null;
+
+function build_index() // One pass over the form, at page load: the inputs that can go into the letter, in order, and every input by name
+{
     var elem = document.getElementById('cat_herding_laser').elements;
-    var write_this = "";
+    CHL_index = {'letter': [], 'by_name': {}};
     for (var i=0;i<elem.length-1;i++)
-    {{
-        if (elem[i].value != undefined && elem[i].value != '' && elem[i].value != false)
-        {{
-            if ((elem[i].type == 'radio' && elem[i].checked) || (elem[i].type == 'checkbox' && elem[i].checked) || (elem[i].type != 'radio' && elem[i].type != 'checkbox'))
-            {{
-                write_this += elem[i].value + " ";
-            }}
-        }}
-    }}
-    document.forms['cat_herding_laser'].CHL_choices.value = write_this;// DEBUG ONLY; COMMENT OUT THIS FULL LINE
+    {
+        if (elem[i].name)
+        {
+            (CHL_index.by_name[elem[i].name] || (CHL_index.by_name[elem[i].name] = [])).push(elem[i]);
+        }
+        if (elem[i].value != undefined && elem[i].value != '' && elem[i].value != false && elem[i].name != 'CHL_seed' && elem[i].name != 'CHL_choices')
+        {
+            CHL_index.letter.push(elem[i]);
+        }
+    }
+}
+if (window.addEventListener)
+{
+    window.addEventListener('DOMContentLoaded', build_index, false);
+}
+
+function generate_unform()
+{
+    if (CHL_index == null) build_index();
+    var letter = CHL_index.letter;
+    var write_this = [];
+    for (var i=0;i<letter.length;i++)
+    {
+        if ((letter[i].type != 'radio' && letter[i].type != 'checkbox') || letter[i].checked)
+        {
+            write_this.push(letter[i].value);
+        }
+    }
+    document.forms['cat_herding_laser'].CHL_choices.value = write_this.length > 0 ? write_this.join(" ") + " " : "";// DEBUG ONLY; COMMENT OUT THIS FULL LINE
     
-}}
+}
 function validate_unform() // Checks that all required fields have been filled out
-{{
-        var required = {};
-        all_required_completed = true; // will get toggled if incomplete
+{
+        if (CHL_index == null) build_index();
+        var required = CHL_required;
+        var all_required_completed = true; // will get toggled if incomplete
 
         for (var i=0;i<required.length;i++)
-        {{
-        	var radio_options = document.getElementsByName(required[i]);
+        {
+        	var fieldset = document.getElementById('fieldset_' + required[i]);
+        	if (fieldset == null) // Required Text blocks have nothing to fill in
+        	{
+        		continue;
+        	}
+        	var radio_options = CHL_index.by_name[required[i]] || [];
         	var is_checked = false;
-        	for (var x=0;x<radio_options.length;x++)
-        	{{
-			if (document.getElementsByName(required[i])[x].checked)
-			{{
-				is_checked = true;
-			}}
-		}}
+        	for (var x=0;x<radio_options.length && !is_checked;x++)
+        	{
+			is_checked = radio_options[x].checked;
+		}
 		if (is_checked == true)
-		{{
-			document.getElementById('fieldset_' + required[i]).style.background="#ffffff";
-		}}
+		{
+			fieldset.style.background="#ffffff";
+		}
 		else
-		{{
+		{
 			all_required_completed = false;
-			document.getElementById('fieldset_' + required[i]).style.background="#ff9933";
-		}}
-	}}
+			fieldset.style.background="#ff9933";
+		}
+	}
 	if (all_required_completed == true)
-	{{
+	{
 		generate_unform();
 		document.forms['cat_herding_laser'].submit();
-	}}
-}}
+	}
+}
 
-</script>
-""".format(required_fields)
+"""
 
-    return javascript
+# Changes whenever ENGINE_JS does, so /engine?v=<ENGINE_VERSION> can be cached by browsers indefinitely
+ENGINE_VERSION = hashlib.new('md5', ENGINE_JS).hexdigest()[:12]
 
-def Create_EndUser_Survey(survey_id, all_letter_blocks, required_fields, form_attributes=None, header=None, footer=None): 
-    
-    """ Create_EndUser_Survey(all_letter_blocks, header, footer): Creates an HTML form that end-users interact with to generate the un-form letter.
-            all_letter_blocks: Return value of Load_Letter_Blocks()
+def UnformLetter_Generating_JS(required_fields, external=False):
+
+    """ UnformLetter_Generating_JS(): Helper function that simply returns a string - the javascript that generates the Unform letter values
             required_fields: Return value of Load_Letter_Blocks()
-            form_attributes: set method, action, and anything else needed here
-            header: load in css, branding, heading, or anything else needed here
-            footer: footer for the page / pair to the header
+            external: if True, load ENGINE_JS from /engine rather than writing it into the page; only the required fields are written inline
     """
 
-    if (survey_id == None and all_letter_blocks == None and required_fields == None):
-        return "Survey not found."
-    
-    source_snippet = []
-
-    if header != None:
-        source_snippet.append(header)
-
-    source_snippet.append(UnformLetter_Generating_JS(required_fields))
-
-    if form_attributes == None and survey_id != 0:
-        form_attributes = 'method="post" action="submit"'
+    survey_data = '<script language="JavaScript">\nvar CHL_required = {};\n'.format(json.dumps(required_fields))
 
-    source_snippet.append('<form id="cat_herding_laser" name="cat_herding_laser" {}>'.format(form_attributes))
-    source_snippet.append('<input type="hidden" name="survey_id" value="{}">'.format(survey_id))
+    if external:
+        return '{}</script>\n<script language="JavaScript" src="engine?v={}"></script>\n'.format(survey_data, ENGINE_VERSION)
 
-    for x in xrange(len(all_letter_blocks)):
-        if 'Static' in all_letter_blocks[x].block_type:
-            source_snippet.append('<input type="hidden" name="static{0}" value="{1}">'.format(x, all_letter_blocks[x].Get_AWA().pop().replace('"', "&quot;").rstrip("\n")))
-            continue
-        if 'Multiple' in str(all_letter_blocks[x].block_type):
-            if all_letter_blocks[x].required_field == True:
-                source_snippet.append('<fieldset id="fieldset_ck{}"><legend>{} <b>(Required)</b></legend>'.format(x, all_letter_blocks[x].GetTitle()))
-            else:
-                source_snippet.append('<fieldset id="fieldset_ck{}"><legend>{}</legend>'.format(x, all_letter_blocks[x].GetTitle()))
-        else:
-            if all_letter_blocks[x].required_field == True:
-                source_snippet.append('<fieldset id="fieldset_rd{}"><legend>{} <b>(Required)</b></legend>'.format(x, all_letter_blocks[x].GetTitle()))
-            else:
-                source_snippet.append('<fieldset id="fieldset_rd{}"><legend>{}</legend>'.format(x, all_letter_blocks[x].GetTitle()))
-        for y in xrange(len(all_letter_blocks[x].Get_DDC())):
-            if 'Multiple' in str(all_letter_blocks[x].block_type):
-                source_snippet.append('<input type="checkbox" name="ck{0}" value="{1}">{2}<br>\n'.format(x, all_letter_blocks[x].Get_AWA([y]).pop().replace('"', "&quot;").rstrip("\n"), all_letter_blocks[x].Get_DDC([y]).pop().replace('"', "&quot;").rstrip("\n")))
-            else:
-                try: # handles everything except Dynamic_Block
-                    source_snippet.append('<input type="radio" name="rd{0}" value="{1}">{2}<br>\n'.format(x, all_letter_blocks[x].Get_AWA([y]).pop().replace('"', "&quot;").rstrip("\n"), all_letter_blocks[x].Get_DDC([y]).pop()))
-                except AttributeError: # to handle Dynamic_Block
-                    source_snippet.append('<input type="radio" name="rd{0}" value="{1}">{2}<br>\n'.format(x, all_letter_blocks[x].Get_AWA([y]).replace('"', "&quot;").rstrip("\n"), all_letter_blocks[x].Get_DDC([y]).pop()))
-                    
-        source_snippet.append('</fieldset>\n\n')
+    return '\n{}{}</script>\n'.format(survey_data, ENGINE_JS)
 
-    source_snippet.append('<textarea name="CHL_choices" rows=5 cols=30 hidden></textarea>')
-    source_snippet.append('<input type="button" name="Submit" onclick=validate_unform() value="Finished!">\n</form>')
+class Seed_Slot(object):
 
-    if footer != None:
-        source_snippet.append(footer)
+    """ class Seed_Slot(object): Marks the spot in a Survey_Template where Render() writes the seed it made its random picks with.
+    """
 
-    return ''.join(source_snippet)
+SEED_SLOT = Seed_Slot()
 
-def Survey_Completed_Page(generated_unform_letter, textarea_attributes='name="cat_herding_laser_ta" rows="14" cols="18"', header=None, form_engine=None, cleanup=None, footer=None):
+class Survey_Template(object):
 
-    """ Output_Blocks(generated_unform_letter, textarea_attributes, header, form_engine, cleanup, footer): Generates the source code for the send-form page that the end-user will see after they've completed the survey.
-        This is not called directly; it is called by the submitted form page.
-            generated_unform_letter: return value of submitted form
-            textarea_attributes: default given; customize html attributes according to need
-            header: load in css, branding, heading, or anything else needed here
-            form_engine: load in the html needed for the form to work
-            cleanup: intended for the form cleanup
-            footer: footer for the page / pair to the header
+    """ class Survey_Template(object): A survey page compiled by Compile_EndUser_Survey(), ready to be rendered any number of times.
+            chunks: list of pre-escaped strings and slots; a slot is either a tuple of pre-escaped candidates, one of which is picked at random on each render, or SEED_SLOT
+            slot_owners: (form field, option) for each tuple slot, in order
+        Adjacent strings are joined at compile time, so a survey without random blocks is a single chunk.
     """
 
-    source_snippet = []
+    def __init__(self, chunks, slot_owners=None):
+        self.chunks = []
+        self.slot_owners = slot_owners or []
+        self.shared = None
+        self.shared_filename = None
 
-    if header != None:
-        source_snippet.append(header)
+        run = [] # Adjacent strings, joined once the run ends; adding each to the last chunk would copy the run again every time
 
-    if form_engine != None:
-        source_snippet.append(form_engine)
+        for chunk in chunks:
+            if isinstance(chunk, basestring):
+                run.append(chunk)
+            else:
+                if len(run) > 0:
+                    self.chunks.append(''.join(run))
+                    run = []
+                self.chunks.append(chunk)
 
-    source_snippet.append('<textarea {}>{}</textarea>'.format(textarea_attributes, generated_unform_letter.replace("!!","\n"))) 
+        if len(run) > 0:
+            self.chunks.append(''.join(run))
 
-    if cleanup != None:
-        source_snippet.append(cleanup)
+        self.randomized = any(isinstance(chunk, tuple) for chunk in self.chunks)
 
-    if footer != None:
-        source_snippet.append(footer)
+        if not self.randomized:
+            self.page = ''.join([chunk for chunk in self.chunks if isinstance(chunk, basestring)])
+            self.etag = '"{}"'.format(hashlib.new('md5', self.page).hexdigest())
+        else:
+            self.etag = None
 
-    source_snippet.append('</body></html>')
-    
-    return ''.join(source_snippet)
+    def Render(self, seed=None):
 
-class Root(object):
+        """\t Render(seed): Returns the survey page source, with a random pick for every slot.
+            The picks come from random.Random(seed), so the same seed always renders the same page; a new seed is drawn with New_Seed() when none is given.
+        """
 
-    """ CherryPy Root class for serving the survey page. """
+        if self.shared is not None:
+            return self.Render_Shared(seed)
 
-    def __init__(self):
-        pass
+        if not self.randomized:
+            return self.page
 
-    def admin(self, **kwargs):
+        if seed is None:
+            seed = New_Seed()
 
-        """ cherrypy.Root.admin(): This is where the admin goes to create the survey. """
+        choice = random.Random(seed).choice
+        seed = str(seed)
 
-        admin_filename = "admin.txt"
+        return ''.join([choice(chunk) if isinstance(chunk, tuple) else (seed if chunk is SEED_SLOT else chunk) for chunk in self.chunks])
 
-        with open(admin_filename) as admin_file:
-            admin_source = admin_file.read()
-        
-        return admin_source
+    def Render_Shared(self, seed=None):
 
-    def createsurvey(self, **kwargs):
+        """\t Render_Shared(seed): Render() for a template moved into a memory-mapped file by Share(); every string chunk is a slice of self.shared.
+        """
 
-        """ cherrypy.Root.createsurvey(): Action of cherrypy.Root.admin(); survey_id is displayed here. """
+        shared = self.shared
 
-        if kwargs.get('survey', "") != "":
-            survey_id = hashlib.new('md5', kwargs['survey']).hexdigest()
-            with open("{}.txt".format(survey_id), "w") as write_survey_file:
-                write_survey_file.write(kwargs['survey'])
-        else:
-            return "Can't create a blank survey!"
+        if not self.randomized:
+            return shared[:]
 
-        # Just to get the Total Permutations - I think this is a cool stat to display for those creating the survey
-        (survey_validation, returned_source, total_permutations) = Load_Letter_Blocks(kwargs['survey'], validation_mode=True)
+        if seed is None:
+            seed = New_Seed()
 
-        kwargs.pop('survey')
+        choice = random.Random(seed).choice
+        seed = str(seed)
 
-        for (key, value) in kwargs.iteritems():
-            if value != "":
-                with open("{}_{}.txt".format(survey_id, key), "w") as write_file:
-                    write_file.write(value)
-        
-        return "<a href='../survey?survey_id={0}'>Survey #{0}</a> created successfully.<br>&nbsp;<br>Based on your supporters' choices, this could create as many as <b>{1:,}</b> unique Un-form letters.  Mathematical!".format(survey_id, total_permutations)
+        return ''.join([shared[choice(chunk)] if isinstance(chunk, tuple) else (seed if chunk is SEED_SLOT else shared[chunk]) for chunk in self.chunks])
 
-    def index(self, **kwargs):
+    def Share(self, directory="."):
 
-        """ cherrypy.Root.index(): Without this, a 404 error would occur at the root.  Customize as desired. """
-        
-        return # Returns nothing; change as needed
+        """\t Share(directory): Moves the template's text into a memory-mapped file so that every process serving the survey reads the same copy from the OS page cache.
+            The file is named after a hash of its contents, so processes compiling the same survey find and map the same file rather than each writing their own.
+            Survey_Cache removes it with Unshare() once the template is dropped; Prefork() clears any left from an earlier run.
+        """
 
-    def survey(self, **kwargs):
+        text = []
+        offset = [0]
 
-        """ cherrypy.Root.survey(): The survey page to send supporters to.  Access through /survey?survey_id=<md5 hash> """
+        def Place(chunk):
+            if isinstance(chunk, tuple):
+                return tuple([Place(candidate) for candidate in chunk])
+            if chunk is SEED_SLOT:
+                return chunk
+            text.append(chunk)
+            offset[0] += len(chunk)
+            return slice(offset[0] - len(chunk), offset[0])
 
-        survey_id = kwargs.get('survey_id')
+        chunks = [Place(chunk) for chunk in self.chunks]
+        text = ''.join(text)
 
-        if survey_id == None:
-            return # Returns nothing; change as needed
+        if text == "": # mmap can't map an empty file
+            return
 
-        keys = ['survey_header', 'survey_footer']
+        shared_filename = os.path.join(directory, "{}.page".format(hashlib.new('md5', text).hexdigest()))
 
-        options = {}.fromkeys(keys, "")
+        try:
+            with open(shared_filename, "rb") as shared_file:
+                self.shared = mmap.mmap(shared_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except IOError: # Not written yet, or another process has just removed it
+            with open("{}.{}.tmp".format(shared_filename, os.getpid()), "w+b") as shared_file:
+                shared_file.write(text)
+                shared_file.flush()
+                self.shared = mmap.mmap(shared_file.fileno(), 0, access=mmap.ACCESS_READ)
+            os.rename("{}.{}.tmp".format(shared_filename, os.getpid()), shared_filename)
+
+        self.shared_filename = shared_filename
+        self.chunks = chunks
+        self.page = None
+
+    def Unshare(self):
+
+        """\t Unshare(): Removes the file written by Share().  The template stays mapped, so renders already under way, here or in other processes, carry on.
+        """
 
-        for key in keys:
+        if self.shared_filename is not None:
             try:
-                with open("{}_{}.txt".format(survey_id, key)) as options_file:
-                    options[key] = options_file.read()
+                os.remove(self.shared_filename)
+            except OSError:
+                pass
+            self.shared_filename = None
+
+    def Picks(self, seed):
+
+        """\t Picks(seed): Returns a list of (form field, option, variant) giving the candidate each slot picked when the page was rendered with seed.
+        """
+
+        choice = random.Random(seed).choice
+
+        variants = [choice(xrange(len(chunk))) for chunk in self.chunks if isinstance(chunk, tuple)] # Draws exactly as Render() does
+
+        return [(field, option, variant) for ((field, option), variant) in zip(self.slot_owners, variants)]
+
+def Escape_Value(value):
+
+    """ Escape_Value(value): Prepares an 'Are Written As' value for use inside an input's value attribute.
+    """
+
+    return value.replace('"', "&quot;").rstrip("\n")
+
+def Field_Name(line_number, block):
+
+    """ Field_Name(line_number, block): Returns the name of the form field the block is submitted as: static<N>, ck<N> or rd<N>.
+    """
+
+    if 'Static' in block.block_type:
+        return 'static{}'.format(line_number)
+    elif 'Multiple' in block.block_type:
+        return 'ck{}'.format(line_number)
+    else:
+        return 'rd{}'.format(line_number)
+
+def Compile_Block(line_number, block, chunks, slot_owners):
+
+    """ Compile_Block(line_number, block, chunks, slot_owners): Appends the form inputs for one letter block to chunks, and the owner of each random slot among them to slot_owners.
+        Used by Compile_EndUser_Survey() for every block, and on its own for the previews returned by Root.validatelines.
+    """
+
+    name = Field_Name(line_number, block)
+    randomized = 'Randomized' in block.block_type
+
+    if 'Static' in block.block_type:
+        for (display_during_choice, candidates, in_between) in block.Iter_Options():
+            chunks.append('<input type="hidden" name="{}" value="'.format(name))
+            if randomized:
+                chunks.append(tuple([Escape_Value(value) for value in candidates]))
+                slot_owners.append((name, 0))
+            else:
+                chunks.append(Escape_Value(candidates[0]))
+            chunks.append('">')
+        return
+
+    if 'Multiple' in block.block_type:
+        input_type = 'checkbox'
+    else:
+        input_type = 'radio'
+
+    if block.required_field == True:
+        chunks.append('<fieldset id="fieldset_{}"><legend>{} <b>(Required)</b></legend>'.format(name, block.GetTitle()))
+    else:
+        chunks.append('<fieldset id="fieldset_{}"><legend>{}</legend>'.format(name, block.GetTitle()))
+
+    option_start = '<input type="{}" name="{}" value="'.format(input_type, name)
+
+    for (option, (display_during_choice, candidates, in_between)) in enumerate(block.Iter_Options()):
+        chunks.append(option_start)
+
+        if randomized:
+            chunks.append(tuple([Escape_Value(value) for value in candidates]))
+            slot_owners.append((name, option))
+        else:
+            chunks.append(Escape_Value(candidates[0]))
+
+        if input_type == 'checkbox':
+            chunks.append('">{}<br>\n'.format(Escape_Value(display_during_choice)))
+        else:
+            chunks.append('">{}<br>\n'.format(display_during_choice))
+
+    chunks.append('</fieldset>\n\n')
+
+def Compile_EndUser_Survey(survey_id, all_letter_blocks, required_fields, form_attributes=None, header=None, footer=None):
+
+    """ Compile_EndUser_Survey(survey_id, all_letter_blocks, required_fields, form_attributes, header, footer): Compiles the HTML form that end-users interact with into a Survey_Template.
+        Takes the same arguments as Create_EndUser_Survey(), which compiles and renders once; Random blocks get a fresh pick on each Render().
+    """
+
+    chunks = []
+    slot_owners = []
+
+    if header != None:
+        chunks.append(header)
+
+    chunks.append(UnformLetter_Generating_JS(required_fields, external=(survey_id != 0))) # The validation preview (survey_id 0) edits the script, so it keeps its own copy
+
+    if form_attributes == None and survey_id != 0:
+        form_attributes = 'method="post" action="submit"'
+
+    chunks.append('<form id="cat_herding_laser" name="cat_herding_laser" {}>'.format(form_attributes))
+    chunks.append('<input type="hidden" name="survey_id" value="{}">'.format(survey_id))
+
+    if any('Randomized' in block.block_type for block in all_letter_blocks.itervalues()): # Saved with the response so the page can be rendered again exactly
+        chunks.append('<input type="hidden" name="CHL_seed" value="')
+        chunks.append(SEED_SLOT)
+        chunks.append('">')
+
+    for x in xrange(len(all_letter_blocks)):
+        Compile_Block(x, all_letter_blocks[x], chunks, slot_owners)
+
+    chunks.append('<textarea name="CHL_choices" rows=5 cols=30 hidden></textarea>')
+    chunks.append('<input type="button" name="Submit" onclick=validate_unform() value="Finished!">\n</form>')
+
+    if footer != None:
+        chunks.append(footer)
+
+    return Survey_Template(chunks, slot_owners)
+
+def Create_EndUser_Survey(survey_id, all_letter_blocks, required_fields, form_attributes=None, header=None, footer=None): 
+    
+    """ Create_EndUser_Survey(all_letter_blocks, header, footer): Creates an HTML form that end-users interact with to generate the un-form letter.
+            all_letter_blocks: Return value of Load_Letter_Blocks()
+            required_fields: Return value of Load_Letter_Blocks()
+            form_attributes: set method, action, and anything else needed here
+            header: load in css, branding, heading, or anything else needed here
+            footer: footer for the page / pair to the header
+        Serving the same survey repeatedly? Compile it once with Compile_EndUser_Survey() and call Render() instead.
+    """
+
+    if (survey_id == None and all_letter_blocks == None and required_fields == None):
+        return "Survey not found."
+
+    return Compile_EndUser_Survey(survey_id, all_letter_blocks, required_fields, form_attributes, header, footer).Render()
+
+def Survey_Completed_Page(generated_unform_letter, textarea_attributes='name="cat_herding_laser_ta" rows="14" cols="18"', header=None, form_engine=None, cleanup=None, footer=None):
+
+    """ Output_Blocks(generated_unform_letter, textarea_attributes, header, form_engine, cleanup, footer): Generates the source code for the send-form page that the end-user will see after they've completed the survey.
+        This is not called directly; it is called by the submitted form page.
+            generated_unform_letter: return value of submitted form
+            textarea_attributes: default given; customize html attributes according to need
+            header: load in css, branding, heading, or anything else needed here
+            form_engine: load in the html needed for the form to work
+            cleanup: intended for the form cleanup
+            footer: footer for the page / pair to the header
+    """
+
+    source_snippet = []
+
+    if header != None:
+        source_snippet.append(header)
+
+    if form_engine != None:
+        source_snippet.append(form_engine)
+
+    source_snippet.append('<textarea {}>{}</textarea>'.format(textarea_attributes, generated_unform_letter.replace("!!","\n"))) 
+
+    if cleanup != None:
+        source_snippet.append(cleanup)
+
+    if footer != None:
+        source_snippet.append(footer)
+
+    source_snippet.append('</body></html>')
+    
+    return ''.join(source_snippet)
+
+# Option fragments saved by Root.createsurvey as <survey_id>_<key>.txt
+SURVEY_OPTION_KEYS = ['survey_header', 'survey_footer']
+COMPLETED_OPTION_KEYS = ['completed_textarea', 'completed_header', 'completed_engine', 'completed_cleanup', 'completed_footer']
+
+def Survey_Filenames(survey_id):
+
+    """ Survey_Filenames(survey_id): Returns the survey file followed by its fragment manifest and every option fragment file saved before fragments were shared.
+        The shared fragment files themselves never change (see Fragment_Hash()), so the manifest stands in for them.
+    """
+
+    return ["{}.txt".format(survey_id), "{}-fragments.json".format(survey_id)] + ["{}_{}.txt".format(survey_id, key) for key in SURVEY_OPTION_KEYS + COMPLETED_OPTION_KEYS]
+
+def Survey_Signature(survey_id):
+
+    """ Survey_Signature(survey_id): Returns a tuple of (mtime, size) for each of the survey's files, or None for files that don't exist.
+            Any edit to the survey or one of its fragments changes the signature.
+    """
+
+    signature = []
+
+    for filename in Survey_Filenames(survey_id):
+        try:
+            file_stat = os.stat(filename)
+            signature.append((file_stat.st_mtime, file_stat.st_size))
+        except OSError:
+            signature.append(None)
+
+    return tuple(signature)
+
+def Fragment_Hash(fragment):
+    return hashlib.new('md5', fragment).hexdigest()
+
+class Fragment_Cache(object):
+
+    """ class Fragment_Cache(object): Process-wide copies of option fragments, keyed by Fragment_Hash(), so that every survey sharing a header, footer or form engine shares one string in memory.
+            max_entries: most fragments to keep; least recently used fragments are dropped first (surveys still holding them keep their copy)
+    """
+
+    def __init__(self, max_entries=4096):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.max_entries = max_entries
+
+    def Intern(self, fragment, fragment_hash=None):
+
+        """\t Intern(fragment, fragment_hash): Returns the kept copy of fragment, keeping this one if there isn't one yet.
+        """
+
+        if fragment_hash is None:
+            fragment_hash = Fragment_Hash(fragment)
+
+        with self.lock:
+            kept = self.entries.pop(fragment_hash, fragment)
+            self.entries[fragment_hash] = kept
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return kept
+
+    def Get(self, fragment_hash, read_fragment):
+
+        """\t Get(fragment_hash, read_fragment): Returns the fragment, reading it with read_fragment(fragment_hash) if it isn't kept yet.  Missing fragments are blank.
+        """
+
+        with self.lock:
+            kept = self.entries.pop(fragment_hash, None)
+            if kept is not None:
+                self.entries[fragment_hash] = kept
+                return kept
+
+        fragment = read_fragment(fragment_hash)
+
+        if fragment is None:
+            return ""
+
+        return self.Intern(fragment, fragment_hash)
+
+fragment_cache = Fragment_Cache()
+
+class Storage(object):
+
+    """ class Storage(object): Where surveys, their option fragments, responses and tally snapshots are kept.  Root and everything it calls go through the module's storage object.
+        File_Storage keeps one file per survey, fragment and list of responses; SQLite_Storage keeps everything in one database.
+        Fragments are content-addressed: each distinct fragment is saved once under its Fragment_Hash(), and each survey keeps a manifest of {key: hash}.
+    """
+
+    def Read_Survey(self, survey_id):
+
+        """\t Read_Survey(survey_id): Returns the text of the survey, or None if it doesn't exist.
+        """
+
+        raise NotImplementedError
+
+    def Write_Survey(self, survey_id, survey, options):
+
+        """\t Write_Survey(survey_id, survey, options): Saves a survey and its option fragments ({key: text}); blank fragments aren't saved.
+        """
+
+        raise NotImplementedError
+
+    def Load_Survey(self, survey_id):
+
+        """\t Load_Survey(survey_id): Returns the same tuple as Load_Letter_Blocks() for the saved survey; (None, None, None) if it doesn't exist.
+        """
+
+        raise NotImplementedError
+
+    def Read_Options(self, survey_id):
+
+        """\t Read_Options(survey_id): Returns the survey's option fragments keyed by SURVEY_OPTION_KEYS and COMPLETED_OPTION_KEYS; missing fragments are blank.
+            Fragments come from fragment_cache, so surveys sharing a fragment share its copy.
+        """
+
+        options = {}.fromkeys(SURVEY_OPTION_KEYS + COMPLETED_OPTION_KEYS, "")
+
+        for (key, fragment_hash) in (self.Read_Manifest(survey_id) or {}).iteritems():
+            if key in options:
+                options[key] = fragment_cache.Get(fragment_hash, self.Read_Fragment)
+
+        return options
+
+    def Read_Manifest(self, survey_id):
+
+        """\t Read_Manifest(survey_id): Returns the survey's {key: fragment hash}, or None if it has no manifest.
+        """
+
+        raise NotImplementedError
+
+    def Read_Fragment(self, fragment_hash):
+
+        """\t Read_Fragment(fragment_hash): Returns the fragment saved under fragment_hash, or None.
+        """
+
+        raise NotImplementedError
+
+    def Signature(self, survey_id):
+
+        """\t Signature(survey_id): Returns a tuple that changes whenever the survey or one of its fragments does, or None if the survey doesn't exist.
+            Each item is None or a pair whose second value is a size in bytes (see Compiled_Survey.size).
+        """
+
+        raise NotImplementedError
+
+    def Survey_Ids(self):
+        raise NotImplementedError
+
+    def Append_Responses(self, survey_id, responses):
+
+        """\t Append_Responses(survey_id, responses): Saves a list of serialized responses, in order.
+        """
+
+        raise NotImplementedError
+
+    def Read_Responses(self, survey_id, cursor=0, since=None):
+
+        """\t Read_Responses(survey_id, cursor, since): Generator that yields (cursor, response) for each response saved before it started, skipping blank lines.
+            Each cursor is the one to pass back in to carry on after that response.
+                since: unix time; responses submitted before it may be left out wherever that's cheap to tell, so callers still check each response
+        """
+
+        raise NotImplementedError
+
+    def Skip_Responses(self, survey_id, count):
+
+        """\t Skip_Responses(survey_id, count): Returns a tuple of (cursor, skipped): the cursor after the first count responses, and how many there were if fewer.
+        """
+
+        (cursor, skipped) = (0, 0)
+
+        if count > 0:
+            for (cursor, response) in self.Read_Responses(survey_id):
+                skipped += 1
+                if skipped >= count:
+                    break
+
+        return (cursor, skipped)
+
+    def Responses_End(self, survey_id):
+
+        """\t Responses_End(survey_id): Returns the cursor after the last saved response, or 0 if there are none.  Cursors only grow, so a smaller one than before means the responses were replaced.
+        """
+
+        raise NotImplementedError
+
+    def Responses_Exist(self, survey_id):
+        raise NotImplementedError
+
+    def Read_Stats(self, survey_id):
+
+        """\t Read_Stats(survey_id): Returns the tally snapshot last saved with Write_Stats(), or None.
+        """
+
+        raise NotImplementedError
+
+    def Write_Stats(self, survey_id, snapshot):
+        raise NotImplementedError
+
+class File_Storage(Storage):
+
+    """ class File_Storage(Storage): Keeps each survey in the working directory as <survey_id>.txt (with its <survey_id>.chl artifact), its fragment manifest as <survey_id>-fragments.json,
+        each distinct fragment as <fragment hash>.fragment, responses as lines of <survey_id>-responses.txt and tally snapshots as <survey_id>-stats.json.
+        Surveys created before fragments were shared keep their <survey_id>_<key>.txt files until they're created again.
+        The responses file rolls over into numbered segments, <survey_id>-responses.<sequence>.txt, which Compress_Segments() gzips and lists in <survey_id>-responses.index
+        with their size, response count and range of CHL_submitted times.  Cursors are byte offsets into all of a survey's responses, segments first, as if they were still one file.
+            segment_bytes: roll over once the responses file reaches this many bytes; 0 never does
+            segment_age: roll over at the first response in each period of this many seconds (86400 rolls daily, at midnight UTC); 0 never does
+    """
+
+    def __init__(self, segment_bytes=0, segment_age=0):
+        self.segment_bytes = segment_bytes
+        self.segment_age = segment_age
+
+    def Read_Survey(self, survey_id):
+        try:
+            with open("{}.txt".format(survey_id)) as survey_file:
+                return survey_file.read()
+        except IOError:
+            return None
+
+    def Write_Survey(self, survey_id, survey, options):
+        if self.Read_Survey(survey_id) != survey: # survey_id is the survey's hash, so this only happens for new surveys (or ones edited by hand)
+            with open("{}.txt".format(survey_id), "w") as write_survey_file:
+                write_survey_file.write(survey)
+            Save_Survey_Artifact("{}.txt".format(survey_id))
+
+        manifest = self.Read_Manifest(survey_id)
+
+        if manifest is None:
+            manifest = {}
+            for (key, fragment) in self.Read_Options(survey_id).iteritems():
+                if fragment != "":
+                    manifest[key] = self.Write_Fragment(fragment)
+
+        updated = dict(manifest)
+
+        for key in SURVEY_OPTION_KEYS + COMPLETED_OPTION_KEYS:
+            if options.get(key, "") != "":
+                updated[key] = self.Write_Fragment(options[key])
+
+        if updated != manifest or not os.path.exists("{}-fragments.json".format(survey_id)):
+            with open("{}-fragments.json.{}.tmp".format(survey_id, os.getpid()), "w") as manifest_file:
+                json.dump(updated, manifest_file, sort_keys=True)
+            os.rename("{}-fragments.json.{}.tmp".format(survey_id, os.getpid()), "{}-fragments.json".format(survey_id))
+
+    def Load_Survey(self, survey_id):
+        return Load_Letter_Blocks("{}.txt".format(survey_id))
+
+    def Read_Options(self, survey_id):
+        if os.path.exists("{}-fragments.json".format(survey_id)):
+            return Storage.Read_Options(self, survey_id)
+
+        options = {}.fromkeys(SURVEY_OPTION_KEYS + COMPLETED_OPTION_KEYS, "")
+
+        for key in options:
+            try:
+                with open("{}_{}.txt".format(survey_id, key)) as options_file:
+                    options[key] = fragment_cache.Intern(options_file.read())
             except IOError:
                 pass
-            
-        (survey_id, all_letter_blocks, required_fields) = Load_Letter_Blocks("{}.txt".format(survey_id))
-        return Create_EndUser_Survey(survey_id, all_letter_blocks, required_fields, header=options['survey_header'], footer=options['survey_footer'])
+
+        return options
+
+    def Read_Manifest(self, survey_id):
+        try:
+            with open("{}-fragments.json".format(survey_id)) as manifest_file:
+                return dict((str(key), str(fragment_hash)) for (key, fragment_hash) in json.load(manifest_file).iteritems())
+        except (IOError, ValueError):
+            return None
+
+    def Read_Fragment(self, fragment_hash):
+        try:
+            with open("{}.fragment".format(fragment_hash)) as fragment_file:
+                return fragment_file.read()
+        except IOError:
+            return None
+
+    def Write_Fragment(self, fragment):
+
+        """\t Write_Fragment(fragment): Saves fragment unless it's already saved, and returns its hash.
+        """
+
+        fragment_hash = Fragment_Hash(fragment)
+
+        if not os.path.exists("{}.fragment".format(fragment_hash)):
+            with open("{}.fragment.{}.tmp".format(fragment_hash, os.getpid()), "w") as fragment_file:
+                fragment_file.write(fragment)
+            os.rename("{}.fragment.{}.tmp".format(fragment_hash, os.getpid()), "{}.fragment".format(fragment_hash))
+
+        return fragment_hash
+
+    def Signature(self, survey_id):
+        signature = Survey_Signature(survey_id)
+
+        if signature[0] is None:
+            return None
+
+        return signature
+
+    def Survey_Ids(self):
+        return sorted(filename[:-4] for filename in glob.glob("[0-9a-f]" * 32 + ".txt"))
+
+    def Responses_Filename(self, survey_id, sequence=None):
+
+        """\t Responses_Filename(survey_id, sequence): Returns the name of the responses file being appended to, or of the segment numbered sequence (before it's gzipped).
+        """
+
+        if sequence is None:
+            return "{}-responses.txt".format(survey_id)
+
+        return "{}-responses.{:06d}.txt".format(survey_id, sequence)
+
+    def Segments(self, survey_id):
+        filenames = glob.glob("{}-responses.{}.txt".format(survey_id, "[0-9]" * 6)) + glob.glob("{}-responses.{}.txt.gz".format(survey_id, "[0-9]" * 6))
+        return sorted(set(int(filename[len(survey_id) + len("-responses."):].split(".")[0]) for filename in filenames))
+
+    def Read_Index(self, survey_id):
+        index = {}
+
+        try:
+            with open("{}-responses.index".format(survey_id)) as index_file:
+                for line in index_file:
+                    try:
+                        entry = json.loads(line)
+                        index[entry['segment']] = entry
+                    except (ValueError, KeyError, TypeError):
+                        pass
+        except IOError:
+            pass
+
+        return index
+
+    def Open_Segment(self, survey_id, sequence):
+        try:
+            return open(self.Responses_Filename(survey_id, sequence), "rb")
+        except IOError:
+            return gzip.open("{}.gz".format(self.Responses_Filename(survey_id, sequence)), "rb")
+
+    def Segment_Bytes(self, survey_id, sequence, index):
+        if sequence in index:
+            return index[sequence]['bytes']
+
+        try:
+            return os.path.getsize(self.Responses_Filename(survey_id, sequence))
+        except OSError:
+            pass
+
+        with self.Open_Segment(survey_id, sequence) as segment_file: # Gzipped but missing from the index
+            return sum(len(chunk) for chunk in iter(lambda: segment_file.read(1024*1024), ""))
+
+    def Open_Responses(self, survey_id):
+
+        """\t Open_Responses(survey_id): Opens the responses file for appending and locks it (see Lock_Current()).
+        """
+
+        while True:
+            responses_file = open(self.Responses_Filename(survey_id), "a")
+            if self.Lock_Current(survey_id, responses_file):
+                return responses_file
+            responses_file.close()
+
+    def Lock_Current(self, survey_id, responses_file):
+
+        """\t Lock_Current(survey_id, responses_file): Locks an open responses file with Lock_Responses(), rolling it over into a new segment first if it's due.
+            Returns False, leaving it unlocked, if the file is no longer the one to append to; the caller should close it and call Open_Responses() instead.
+            Rolling over needs the lock to keep other writers out, so without fcntl (on Windows) the file never rolls over.
+        """
+
+        Lock_Responses(responses_file)
+
+        if fcntl is None:
+            return True
+
+        try:
+            current = os.fstat(responses_file.fileno()).st_ino == os.stat(self.Responses_Filename(survey_id)).st_ino
+        except OSError:
+            current = False
+
+        if current and self.Segment_Due(responses_file):
+            os.rename(self.Responses_Filename(survey_id), self.Responses_Filename(survey_id, (self.Segments(survey_id) or [0])[-1] + 1))
+            current = False
+
+        if not current:
+            Unlock_Responses(responses_file)
+
+        return current
+
+    def Segment_Due(self, responses_file):
+        file_stat = os.fstat(responses_file.fileno())
+
+        if file_stat.st_size == 0:
+            return False
+
+        if self.segment_bytes > 0 and file_stat.st_size >= self.segment_bytes:
+            return True
+
+        return self.segment_age > 0 and int(file_stat.st_mtime // self.segment_age) < int(time.time() // self.segment_age)
+
+    def Append_Responses(self, survey_id, responses):
+        with self.Open_Responses(survey_id) as responses_file:
+            responses_file.write(''.join(responses))
+            responses_file.flush()
+
+    def Read_Responses(self, survey_id, cursor=0, since=None):
+        for attempt in xrange(10):
+            segments = self.Segments(survey_id)
+            try:
+                responses_file = open(self.Responses_Filename(survey_id), "rb")
+            except IOError:
+                responses_file = None
+            if self.Segments(survey_id) == segments or attempt == 9:
+                break # Nothing rolled over in between, so responses_file follows the last of segments even if it rolls over from here on
+            if responses_file is not None:
+                responses_file.close()
+
+        try:
+            if responses_file is not None:
+                end = os.fstat(responses_file.fileno()).st_size
+
+            index = self.Read_Index(survey_id)
+            start = 0
+
+            for sequence in segments:
+                segment_bytes = self.Segment_Bytes(survey_id, sequence, index)
+                skip = since is not None and index.get(sequence, {}).get('last') is not None and index[sequence]['last'] < since
+
+                if start + segment_bytes > cursor and not skip:
+                    with self.Open_Segment(survey_id, sequence) as segment_file:
+                        for item in self.Read_Segment(segment_file, start, cursor, start + segment_bytes):
+                            yield item
+
+                start += segment_bytes
+
+            if responses_file is not None:
+                for item in self.Read_Segment(responses_file, start, cursor, start + end):
+                    yield item
+        finally:
+            if responses_file is not None:
+                responses_file.close()
+
+    def Read_Segment(self, responses_file, start, cursor, end):
+
+        """\t Read_Segment(responses_file, start, cursor, end): Generator that yields (cursor, response) for each response in one segment, which starts at cursor start and ends at cursor end.
+        """
+
+        cursor = max(cursor, start)
+        responses_file.seek(max(cursor - start - 1, 0))
+
+        if cursor > start and responses_file.read(1) != "\n": # Not at the start of a response; skip ahead to the next one
+            cursor += len(responses_file.readline())
+
+        while cursor < end:
+            response = responses_file.readline()
+            if response == "" or cursor + len(response) > end:
+                break # Still being written
+            cursor += len(response)
+
+            if response.strip() != "":
+                yield (cursor, response)
+
+    def Skip_Responses(self, survey_id, count):
+        index = self.Read_Index(survey_id)
+        (cursor, skipped) = (0, 0)
+
+        for sequence in self.Segments(survey_id):
+            if sequence not in index or skipped + index[sequence]['records'] > count:
+                break
+            cursor += index[sequence]['bytes']
+            skipped += index[sequence]['records']
+
+        if skipped < count:
+            for (cursor, response) in self.Read_Responses(survey_id, cursor):
+                skipped += 1
+                if skipped >= count:
+                    break
+
+        return (cursor, skipped)
+
+    def Responses_End(self, survey_id):
+        for attempt in xrange(10):
+            segments = self.Segments(survey_id)
+            try:
+                end = os.path.getsize(self.Responses_Filename(survey_id))
+            except OSError:
+                end = 0
+            if self.Segments(survey_id) == segments or attempt == 9:
+                break # Nothing rolled over in between, so end belongs after the last of segments
+
+        index = self.Read_Index(survey_id)
+
+        return end + sum(self.Segment_Bytes(survey_id, sequence, index) for sequence in segments)
+
+    def Responses_Exist(self, survey_id):
+        return os.path.exists(self.Responses_Filename(survey_id)) or len(self.Segments(survey_id)) > 0
+
+    def Replace_Responses(self, survey_id, filename):
+
+        """\t Replace_Responses(survey_id, filename): Makes filename hold all of the survey's responses, removing every segment.  Only safe while nothing else is saving responses.
+        """
+
+        os.rename(filename, self.Responses_Filename(survey_id))
+
+        for sequence in self.Segments(survey_id):
+            for segment_filename in (self.Responses_Filename(survey_id, sequence), "{}.gz".format(self.Responses_Filename(survey_id, sequence))):
+                if os.path.exists(segment_filename):
+                    os.remove(segment_filename)
+
+        if os.path.exists("{}-responses.index".format(survey_id)):
+            os.remove("{}-responses.index".format(survey_id))
+
+    def Compress_Segments(self):
+
+        """\t Compress_Segments(): Indexes and gzips every segment that has rolled over since the last call.  Runs from a background thread; writers never wait on it.
+        """
+
+        for filename in sorted(glob.glob("*-responses.{}.txt".format("[0-9]" * 6))):
+            survey_id = filename[:filename.rindex("-responses.")]
+            sequence = int(filename[-len("000000.txt"):-len(".txt")])
+            try:
+                self.Compress_Segment(survey_id, sequence)
+            except (IOError, OSError):
+                cherrypy.log("Failed to compress segment {} of the responses to survey {}".format(sequence, survey_id), traceback=True)
+
+    def Compress_Segment(self, survey_id, sequence):
+        filename = self.Responses_Filename(survey_id, sequence)
+
+        try:
+            segment_file = open(filename, "rb")
+        except IOError:
+            return
+
+        with segment_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(segment_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    return # Another process is compressing it, or a writer hasn't noticed the roll over yet; try again next time
+
+            if not os.path.exists(filename):
+                return
+
+            if sequence not in self.Read_Index(survey_id):
+                entry = collections.OrderedDict([('segment', sequence), ('bytes', 0), ('records', 0), ('first', None), ('last', None)])
+                for response in segment_file:
+                    entry['bytes'] += len(response)
+                    if response.strip() == "":
+                        continue
+                    entry['records'] += 1
+                    for (key, separator, value) in Parse_Response(response):
+                        if key == 'CHL_submitted' and value.isdigit():
+                            if entry['first'] is None or int(value) < entry['first']:
+                                entry['first'] = int(value)
+                            entry['last'] = max(entry['last'], int(value))
+                with open("{}-responses.index".format(survey_id), "a") as index_file:
+                    index_file.write("{}\n".format(json.dumps(entry)))
+                segment_file.seek(0)
+
+            if not os.path.exists("{}.gz".format(filename)):
+                with open("{}.gz.{}.tmp".format(filename, os.getpid()), "wb") as compressed_file:
+                    with gzip.GzipFile(filename=os.path.basename(filename), mode="wb", fileobj=compressed_file) as gzip_file:
+                        shutil.copyfileobj(segment_file, gzip_file, 1024*1024)
+                os.rename("{}.gz.{}.tmp".format(filename, os.getpid()), "{}.gz".format(filename))
+
+            os.remove(filename)
+
+    def Read_Stats(self, survey_id):
+        try:
+            with open("{}-stats.json".format(survey_id)) as snapshot_file:
+                return snapshot_file.read()
+        except IOError:
+            return None
+
+    def Write_Stats(self, survey_id, snapshot):
+        with open("{}-stats.json.{}.tmp".format(survey_id, os.getpid()), "w") as snapshot_file:
+            snapshot_file.write(snapshot)
+        os.rename("{}-stats.json.{}.tmp".format(survey_id, os.getpid()), "{}-stats.json".format(survey_id))
+
+class SQLite_Storage(Storage):
+
+    """ class SQLite_Storage(Storage): Keeps everything in one SQLite database, in WAL mode so that reading surveys and exports never waits on response writes.
+        Each thread (and each worker process, in pre-fork mode) opens its own connection the first time it needs one.
+        Surveys are saved already parsed, in the layout of Pack_Blocks(), so loading one doesn't parse it again.  Cursors are response row ids.
+            path: the database file; created if it doesn't exist
+    """
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS surveys (survey_id TEXT PRIMARY KEY, survey TEXT NOT NULL, artifact BLOB, revision INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS fragments (fragment_hash TEXT PRIMARY KEY, fragment TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS manifests (survey_id TEXT NOT NULL, key TEXT NOT NULL, fragment_hash TEXT NOT NULL, PRIMARY KEY (survey_id, key))",
+        "CREATE TABLE IF NOT EXISTS responses (cursor INTEGER PRIMARY KEY AUTOINCREMENT, survey_id TEXT NOT NULL, response TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS responses_by_survey ON responses (survey_id, cursor)",
+        "CREATE TABLE IF NOT EXISTS stats (survey_id TEXT PRIMARY KEY, snapshot TEXT NOT NULL)",
+    ]
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+        connection.close() # Not kept, so a pre-fork supervisor doesn't hand an open connection down to its workers
+
+    def Connection(self):
+        connection = getattr(self.local, 'connection', None)
+
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.text_factory = str
+            connection.execute("PRAGMA synchronous=NORMAL") # Safe with WAL; a power cut can lose the last few commits but can't corrupt the database
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+
+        return connection
+
+    def Read_Survey(self, survey_id):
+        row = self.Connection().execute("SELECT survey FROM surveys WHERE survey_id = ?", (survey_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0]
+
+    def Write_Survey(self, survey_id, survey, options):
+        connection = self.Connection()
+
+        with connection:
+            if self.Read_Survey(survey_id) == survey: # Only the fragments can have changed
+                connection.execute("UPDATE surveys SET revision = revision + 1 WHERE survey_id = ?", (survey_id,))
+            else:
+                (all_letter_blocks, required_fields, validation) = Parse_Survey(survey.split("\n"))
+                (blocks, log10_permutations) = Pack_Blocks(all_letter_blocks)
+                artifact = buffer(marshal.dumps((ARTIFACT_VERSION, blocks, required_fields, log10_permutations), 2))
+                if connection.execute("UPDATE surveys SET survey = ?, artifact = ?, revision = revision + 1 WHERE survey_id = ?", (survey, artifact, survey_id)).rowcount == 0:
+                    connection.execute("INSERT INTO surveys (survey_id, survey, artifact, revision) VALUES (?, ?, ?, 1)", (survey_id, survey, artifact))
+            for key in SURVEY_OPTION_KEYS + COMPLETED_OPTION_KEYS:
+                if options.get(key, "") != "":
+                    fragment_hash = Fragment_Hash(options[key])
+                    connection.execute("INSERT OR IGNORE INTO fragments (fragment_hash, fragment) VALUES (?, ?)", (fragment_hash, options[key]))
+                    connection.execute("INSERT OR REPLACE INTO manifests (survey_id, key, fragment_hash) VALUES (?, ?, ?)", (survey_id, key, fragment_hash))
+
+    def Load_Survey(self, survey_id):
+        row = self.Connection().execute("SELECT survey, artifact FROM surveys WHERE survey_id = ?", (survey_id,)).fetchone()
+
+        if row is None:
+            return (None, None, None)
+
+        (survey, artifact) = row
+
+        try:
+            (version, blocks, required_fields, log10_permutations) = marshal.loads(str(artifact))
+            if version == ARTIFACT_VERSION:
+                return (survey_id, Unpack_Blocks(blocks), required_fields)
+        except (ValueError, EOFError, TypeError):
+            pass
+
+        (all_letter_blocks, required_fields, validation) = Parse_Survey(survey.split("\n"))
+
+        return (survey_id, all_letter_blocks, required_fields)
+
+    def Read_Manifest(self, survey_id):
+        return dict(self.Connection().execute("SELECT key, fragment_hash FROM manifests WHERE survey_id = ?", (survey_id,)))
+
+    def Read_Fragment(self, fragment_hash):
+        row = self.Connection().execute("SELECT fragment FROM fragments WHERE fragment_hash = ?", (fragment_hash,)).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0]
+
+    def Signature(self, survey_id):
+        row = self.Connection().execute("SELECT revision, length(survey) FROM surveys WHERE survey_id = ?", (survey_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        return (tuple(row),)
+
+    def Survey_Ids(self):
+        return [row[0] for row in self.Connection().execute("SELECT survey_id FROM surveys ORDER BY survey_id")]
+
+    def Append_Responses(self, survey_id, responses):
+        connection = self.Connection()
+
+        with connection:
+            connection.executemany("INSERT INTO responses (survey_id, response) VALUES (?, ?)", [(survey_id, response) for response in responses])
+
+    def Read_Responses(self, survey_id, cursor=0, since=None, batch_size=1000):
+        connection = self.Connection()
+        end = connection.execute("SELECT max(cursor) FROM responses WHERE survey_id = ?", (survey_id,)).fetchone()[0]
+
+        if end is None:
+            return
+
+        while cursor < end:
+            rows = connection.execute("SELECT cursor, response FROM responses WHERE survey_id = ? AND cursor > ? AND cursor <= ? ORDER BY cursor LIMIT ?", (survey_id, cursor, end, batch_size)).fetchall()
+            if len(rows) == 0:
+                break
+            for (cursor, response) in rows:
+                if response.strip() != "":
+                    yield (cursor, response)
+
+    def Skip_Responses(self, survey_id, count):
+        if count <= 0:
+            return (0, 0)
+
+        row = self.Connection().execute("SELECT cursor FROM responses WHERE survey_id = ? ORDER BY cursor LIMIT 1 OFFSET ?", (survey_id, count - 1)).fetchone()
+
+        if row is not None:
+            return (row[0], count)
+
+        return tuple(self.Connection().execute("SELECT coalesce(max(cursor), 0), count(*) FROM responses WHERE survey_id = ?", (survey_id,)).fetchone())
+
+    def Responses_End(self, survey_id):
+        return self.Connection().execute("SELECT coalesce(max(cursor), 0) FROM responses WHERE survey_id = ?", (survey_id,)).fetchone()[0]
+
+    def Responses_Exist(self, survey_id):
+        return self.Connection().execute("SELECT 1 FROM responses WHERE survey_id = ? LIMIT 1", (survey_id,)).fetchone() is not None
+
+    def Read_Stats(self, survey_id):
+        row = self.Connection().execute("SELECT snapshot FROM stats WHERE survey_id = ?", (survey_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0]
+
+    def Write_Stats(self, survey_id, snapshot):
+        connection = self.Connection()
+
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO stats (survey_id, snapshot) VALUES (?, ?)", (survey_id, snapshot))
+
+# Replaced with a SQLite_Storage when chl.storage.backend is 'sqlite'
+storage = File_Storage()
+
+def Migrate_Storage(source, destination):
+
+    """ Migrate_Storage(source, destination): Copies every survey, with its option fragments, responses and tally snapshot, from one Storage to another.
+        Returns a tuple of (surveys, responses) copied.
+    """
+
+    (surveys, responses) = (0, 0)
+
+    for survey_id in source.Survey_Ids():
+        survey = source.Read_Survey(survey_id)
+        if survey is None:
+            continue
+
+        destination.Write_Survey(survey_id, survey, source.Read_Options(survey_id))
+        surveys += 1
+
+        batch = []
+        for (cursor, response) in source.Read_Responses(survey_id):
+            batch.append(response)
+            if len(batch) >= 1000:
+                destination.Append_Responses(survey_id, batch)
+                responses += len(batch)
+                batch = []
+        if len(batch) > 0:
+            destination.Append_Responses(survey_id, batch)
+            responses += len(batch)
+
+        snapshot = source.Read_Stats(survey_id)
+        if snapshot is not None:
+            destination.Write_Stats(survey_id, snapshot)
+
+    return (surveys, responses)
+
+XLSX_NAMESPACE = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_RELATIONSHIP = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+
+def XLSX_Column(cell_reference):
+    column = 0
+    for letter in cell_reference:
+        if not letter.isalpha():
+            break
+        column = column * 26 + ord(letter.upper()) - ord('A') + 1
+    return column - 1
+
+def Read_XLSX(data):
+
+    """ Read_XLSX(data): Returns the first worksheet of an Excel workbook as survey text, the same as saving it in tab-delimited format: one line per row, one tab between cells.
+        Empty rows and cells in the middle are kept, since line numbers and double tabs both matter to a survey.
+    """
+
+    workbook = zipfile.ZipFile(StringIO.StringIO(data))
+
+    shared_strings = []
+    if 'xl/sharedStrings.xml' in workbook.namelist():
+        for item in ElementTree.fromstring(workbook.read('xl/sharedStrings.xml')).iter(XLSX_NAMESPACE + 'si'):
+            shared_strings.append(''.join(text.text or '' for text in item.iter(XLSX_NAMESPACE + 't')))
+
+    # The first sheet in the workbook's own order isn't necessarily sheet1.xml
+    first_sheet = ElementTree.fromstring(workbook.read('xl/workbook.xml')).find('{0}sheets/{0}sheet'.format(XLSX_NAMESPACE))
+    if first_sheet is None:
+        raise ValueError("the workbook has no worksheets")
+    sheet_filename = 'xl/worksheets/sheet1.xml'
+    for relationship in ElementTree.fromstring(workbook.read('xl/_rels/workbook.xml.rels')):
+        if relationship.get('Id') == first_sheet.get(XLSX_RELATIONSHIP):
+            sheet_filename = posixpath.normpath(posixpath.join('xl', relationship.get('Target')))
+
+    lines = []
+
+    for row in ElementTree.fromstring(workbook.read(sheet_filename)).iter(XLSX_NAMESPACE + 'row'):
+        while len(lines) < int(row.get('r', len(lines) + 1)) - 1:
+            lines.append("")
+
+        cells = []
+        for cell in row.iter(XLSX_NAMESPACE + 'c'):
+            if cell.get('r') is not None:
+                cells.extend([""] * (XLSX_Column(cell.get('r')) - len(cells)))
+            if cell.get('t') == 'inlineStr':
+                value = ''.join(text.text or '' for text in cell.iter(XLSX_NAMESPACE + 't'))
+            else:
+                value = cell.findtext(XLSX_NAMESPACE + 'v') or ''
+                if cell.get('t') == 's' and value != '':
+                    value = shared_strings[int(value)]
+            cells.append(value)
+
+        lines.append("\t".join(cells).encode('utf-8'))
+
+    return "\n".join(lines)
+
+def Bundle_Files(source):
+
+    """ Bundle_Files(source): Generator that yields (path, contents) for every file in a directory, zip archive or (optionally compressed) tar archive.
+            source: a directory or archive path, or an open archive file
+    """
+
+    if isinstance(source, basestring) and os.path.isdir(source):
+        for (directory, directory_names, filenames) in os.walk(source):
+            directory_names.sort()
+            for filename in sorted(filenames):
+                with open(os.path.join(directory, filename), "rb") as bundle_file:
+                    yield (os.path.relpath(os.path.join(directory, filename), source).replace(os.sep, '/'), bundle_file.read())
+
+    elif zipfile.is_zipfile(source):
+        if not isinstance(source, basestring):
+            source.seek(0)
+        archive = zipfile.ZipFile(source)
+        for member in archive.infolist():
+            if not member.filename.endswith('/'):
+                yield (member.filename, archive.read(member))
+
+    else:
+        if isinstance(source, basestring):
+            archive = tarfile.open(source, 'r:*')
+        else:
+            source.seek(0)
+            archive = tarfile.open(fileobj=source, mode='r:*')
+        for member in archive:
+            if member.isfile():
+                yield (member.name, archive.extractfile(member).read())
+
+def Read_Survey_Bundle(source):
+
+    """ Read_Survey_Bundle(source): Collects the surveys in a directory or archive (see Bundle_Files()), with their option fragments, named the way Root.createsurvey saves them:
+            <name>.txt or <name>.xlsx: a survey
+            <name>_<key>.txt: one of that survey's fragments, where key is one of SURVEY_OPTION_KEYS or COMPLETED_OPTION_KEYS (survey_header, completed_footer and so on)
+            <key>.txt: a fragment for every survey in the same directory that doesn't have its own
+        Fragments may also end in .html.  Hidden files are skipped.  Returns an OrderedDict of {name: {'survey': text, key: fragment, ...}}, sorted by name.
+        A workbook that can't be read is listed as {'survey': None, 'unreadable': the reason}, so Import_Surveys() can report it with the other surveys.
+    """
+
+    option_keys = SURVEY_OPTION_KEYS + COMPLETED_OPTION_KEYS
+
+    surveys = {}
+    unreadable = {}
+    fragments = {}
+
+    for (path, contents) in Bundle_Files(source):
+        parts = [part for part in path.split('/') if part not in ('', '.')]
+        if any(part.startswith('.') or part == '__MACOSX' for part in parts):
+            continue
+
+        (directory, filename) = posixpath.split('/'.join(parts))
+        (name, extension) = posixpath.splitext(filename)
+        extension = extension.lower()
+
+        if extension == '.xlsx':
+            try:
+                surveys[posixpath.join(directory, name)] = Read_XLSX(contents)
+            except (zipfile.BadZipfile, KeyError, SyntaxError, IndexError, ValueError), e: # SyntaxError covers broken XML, IndexError a missing shared string
+                surveys[posixpath.join(directory, name)] = None
+                unreadable[posixpath.join(directory, name)] = "Couldn't read {} as an Excel workbook: {}".format(path, e)
+        elif extension in ('.txt', '.html'):
+            for key in option_keys:
+                if name == key:
+                    fragments[(directory, key)] = contents
+                    break
+                if name.endswith('_' + key):
+                    fragments[(posixpath.join(directory, name[:-len(key) - 1]), key)] = contents
+                    break
+            else:
+                if extension == '.txt':
+                    surveys[posixpath.join(directory, name)] = contents
+
+    bundle = collections.OrderedDict()
+
+    for name in sorted(surveys):
+        bundle[name] = {'survey': surveys[name]}
+        if name in unreadable:
+            bundle[name]['unreadable'] = unreadable[name]
+        for key in option_keys:
+            bundle[name][key] = fragments.get((name, key), fragments.get((posixpath.dirname(name), key), ""))
+
+    return bundle
+
+def Check_Survey(survey):
+
+    """ Check_Survey(survey): Validates one survey for Import_Surveys().  Returns a tuple of (survey_id, log10_permutations, validation); log10_permutations is Letter_Diversity()'s figure, or None if validation found errors.
+        May run in a pool's worker processes (see import_surveys.py), so it leaves parse_cache alone: its lock may have been held by another thread when the worker was forked.
+    """
+
+    (all_letter_blocks, required_fields, validation) = Parse_Survey(survey.split("\n"))
+
+    log10_permutations = None
+
+    if len(validation) == 0:
+        log10_permutations = Letter_Diversity(all_letter_blocks)['log10_permutations']
+
+    return (hashlib.new('md5', survey).hexdigest(), log10_permutations, validation)
+
+def Import_Surveys(bundle, processes=0, create=True):
+
+    """ Import_Surveys(bundle, processes, create): Validates every survey in a bundle from Read_Survey_Bundle(), optionally across a pool of worker processes, then saves the ones that passed.
+        Surveys with errors, and workbooks that couldn't be read, aren't saved.  Returns the batch result as a JSON-ready dictionary.
+            processes: size of the pool; 0 uses one process per CPU, and 1 validates in this process.  Only use a pool from a single-threaded program
+                like import_surveys.py: forking a threaded server copies every thread's locks in whatever state they're in
+            create: False only validates
+    """
+
+    surveys = [options['survey'] for options in bundle.itervalues() if 'unreadable' not in options]
+
+    if processes == 0:
+        processes = multiprocessing.cpu_count()
+
+    processes = min(processes, len(surveys))
+
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            checked = pool.map(Check_Survey, surveys)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        checked = map(Check_Survey, surveys)
+
+    checked = iter(checked)
+    results = []
+    (created, failed) = (0, 0)
+
+    for (name, options) in bundle.iteritems():
+        options = dict(options)
+
+        if 'unreadable' in options:
+            (survey_id, log10_permutations, validation) = (None, None, [options.pop('unreadable')])
+        else:
+            (survey_id, log10_permutations, validation) = next(checked)
+
+        if len(validation) == 0 and create:
+            storage.Write_Survey(survey_id, options.pop('survey'), options)
+            created += 1
+        elif len(validation) > 0:
+            failed += 1
+
+        results.append(collections.OrderedDict([('name', name), ('survey_id', survey_id), ('valid', len(validation) == 0), ('created', len(validation) == 0 and create), ('log10_permutations', log10_permutations), ('errors', validation)]))
+
+    return collections.OrderedDict([('surveys', len(results)), ('created', created), ('failed', failed), ('results', results)])
+
+class Compiled_Survey(object):
+
+    """ class Compiled_Survey(object): Everything needed to serve a survey, parsed once and kept in the Survey_Cache.
+            survey_id, all_letter_blocks, required_fields: Return values of Load_Letter_Blocks()
+            options: the survey's option fragments, keyed by SURVEY_OPTION_KEYS and COMPLETED_OPTION_KEYS; missing fragments are blank
+            signature: Return value of storage.Signature() at load time
+            template: the survey page as a Survey_Template
+            answer_values, answer_codes: Return values of Answer_Values() and Answer_Codes(), used to save and read back compact responses
+    """
+
+    def __init__(self, survey_id, signature):
+        self.signature = signature
+
+        with handler_metrics.Timer('load_letter_blocks', survey_id):
+            (self.survey_id, self.all_letter_blocks, self.required_fields) = storage.Load_Survey(survey_id)
+
+        with handler_metrics.Timer('file_read', survey_id):
+            self.options = storage.Read_Options(survey_id)
+
+        if self.all_letter_blocks is not None:
+            with handler_metrics.Timer('create_enduser_survey', survey_id):
+                self.template = Compile_EndUser_Survey(self.survey_id, self.all_letter_blocks, self.required_fields, header=self.options['survey_header'], footer=self.options['survey_footer'])
+                if self.template.etag is not None:
+                    compressor.Precompress(self.template.etag, self.template.page)
+                if share_templates:
+                    self.template.Share()
+            self.answer_values = Answer_Values(self.all_letter_blocks)
+            self.answer_codes = Answer_Codes(self.answer_values)
+        else:
+            self.template = None
+            self.answer_values = collections.OrderedDict()
+            self.answer_codes = {}
+
+        # Approximate footprint; the parsed blocks grow roughly in step with the text they came from.  Fragments are shared between surveys (see Fragment_Cache) and mostly aren't counted
+        self.size = sum(file_signature[1] for file_signature in signature if file_signature is not None)
+
+class Survey_Cache(object):
+
+    """ class Survey_Cache(object): Process-wide LRU cache of Compiled_Survey objects, keyed by survey_id.
+        Entries are reloaded whenever the mtime or size of any of the survey's files changes.
+            max_entries: most surveys to keep at once
+            max_bytes: most survey file bytes to keep at once (see Compiled_Survey.size)
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64*1024*1024):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.Configure(max_entries, max_bytes)
+
+    def Configure(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        with self.lock:
+            self.Evict()
+
+    def Get(self, survey_id):
+
+        """\t Get(survey_id): Returns the Compiled_Survey for survey_id, loading it if it isn't cached or has gone stale.  Returns None if the survey doesn't exist.
+        """
+
+        signature = storage.Signature(survey_id)
+
+        with self.lock:
+            compiled = self.entries.pop(survey_id, None)
+            if compiled is not None:
+                self.total_bytes -= compiled.size
+                if compiled.signature == signature:
+                    self.hits += 1
+                    self.Store(survey_id, compiled)
+                    return compiled
+                self.Discard(compiled)
+            self.misses += 1
+
+        if signature is None:
+            return None
+
+        compiled = Compiled_Survey(survey_id, signature) # Parsed outside the lock so one slow survey doesn't hold up the others
+
+        with self.lock:
+            stale = self.entries.pop(survey_id, None)
+            if stale is not None:
+                self.total_bytes -= stale.size
+            self.Store(survey_id, compiled)
+            if stale is not None:
+                self.Discard(stale)
+            self.Evict()
+
+        return compiled
+
+    def Store(self, survey_id, compiled):
+        self.entries[survey_id] = compiled
+        self.total_bytes += compiled.size
+
+    def Evict(self):
+
+        """\t Evict(): Drops least recently used surveys until the cache is within max_entries and max_bytes.  Call with self.lock held.
+        """
+
+        while len(self.entries) > 0 and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            (survey_id, compiled) = self.entries.popitem(last=False)
+            self.total_bytes -= compiled.size
+            self.Discard(compiled)
+
+    def Discard(self, compiled):
+
+        """\t Discard(compiled): Removes the page file of a survey dropped from the cache (see Survey_Template.Share()), unless a cached survey still maps the same file.
+            Call with self.lock held.
+        """
+
+        if compiled.template is None or compiled.template.shared_filename is None:
+            return
+
+        if any(entry.template is not None and entry.template.shared_filename == compiled.template.shared_filename for entry in self.entries.itervalues()):
+            return
+
+        compiled.template.Unshare()
+
+    def Clear(self):
+        with self.lock:
+            dropped = self.entries.values()
+            self.entries.clear()
+            self.total_bytes = 0
+            for compiled in dropped:
+                self.Discard(compiled)
+
+    def Stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total_bytes, 'hits': self.hits, 'misses': self.misses}
+
+survey_cache = Survey_Cache()
+
+# Set in pre-fork mode (see Prefork()) so that the workers map one copy of each survey page rather than each holding their own
+share_templates = False
+
+def Serialize_Response(response_values):
+
+    """ Serialize_Response(response_values): Returns the line saved to <survey_id>-responses.txt for one submitted survey.
+        Keys are sorted (ck, rd, static; CHL_choices, survey_id) and tabs and newlines are stripped from each key: value pair.
+    """
+
+    response = []
+    sorted_response_keys = response_values.keys()
+    sorted_response_keys.sort()
+
+    for key in sorted_response_keys:
+        response.append("{}: {}".format(key, response_values[key]))
+    for (index, value) in enumerate(response):
+        response[index] = value.replace("\t", "").replace("\n", "").replace("\r", "")
+
+    return "{}\n".format('\t'.join(response))
+
+def Answer_Values(all_letter_blocks):
+
+    """ Answer_Values(all_letter_blocks): Maps each form field, in form order, to a list per option of the values that option can be submitted as.
+    """
+
+    answer_values = collections.OrderedDict()
+
+    for x in xrange(len(all_letter_blocks)):
+        block = all_letter_blocks[x]
+        answer_values[Field_Name(x, block)] = [[value.rstrip("\n") for value in candidates] for (display_during_choice, candidates, in_between) in block.Iter_Options()] # Browsers submit the unescaped value
+
+    return answer_values
+
+def Answer_Codes(answer_values):
+
+    """ Answer_Codes(answer_values): Inverts the return value of Answer_Values() into {form field: {submitted value: answer code}}.
+        An answer code is the index of the option within its block, followed for Random blocks by a period and the index of the variant that was picked, e.g. 2 or 2.1
+    """
+
+    answer_codes = {}
+
+    for (field, options) in answer_values.iteritems():
+        codes = answer_codes[field] = {}
+        for (option, candidates) in enumerate(options):
+            for (variant, value) in enumerate(candidates):
+                if len(candidates) > 1:
+                    codes.setdefault(value, '{}.{}'.format(option, variant))
+                else:
+                    codes.setdefault(value, str(option))
+
+    return answer_codes
+
+def Rebuild_Letter(response_values, answer_values):
+
+    """ Rebuild_Letter(response_values, answer_values): Rebuilds CHL_choices from the submitted values, the same way generate_unform() does: the survey_id, then each chosen value in form order, each followed by a space.
+    """
+
+    values = [response_values.get('survey_id')]
+
+    for field in answer_values:
+        value = response_values.get(field)
+        if isinstance(value, list):
+            values.extend(value)
+        else:
+            values.append(value)
+
+    return ''.join([value + " " for value in values if value is not None and value.strip() not in ("", "0")])
+
+def Encode_Response(response_values, compiled):
+
+    """ Encode_Response(response_values, compiled): Compact alternative to Serialize_Response().
+        Values that match an option of the Compiled_Survey are saved as field=answer code (comma-separated for several checkboxes); anything else is saved as field: value, as before.
+        CHL_choices is left out when Rebuild_Letter() can reproduce it exactly.
+    """
+
+    response = []
+    sorted_response_keys = response_values.keys()
+    sorted_response_keys.sort()
+
+    for key in sorted_response_keys:
+        value = response_values[key]
+        codes = compiled.answer_codes.get(key)
+
+        if key == 'CHL_choices' and value == Rebuild_Letter(response_values, compiled.answer_values):
+            continue
+
+        if codes is not None:
+            if isinstance(value, list):
+                values = value
+            else:
+                values = [value]
+            if all(single_value in codes for single_value in values):
+                response.append("{}={}".format(key, ','.join([codes[single_value] for single_value in values])))
+                continue
+
+        response.append("{}: {}".format(key, value).replace("\t", "").replace("\n", "").replace("\r", ""))
+
+    return "{}\n".format('\t'.join(response))
+
+def Parse_Response(response):
+
+    """ Parse_Response(response): Splits one saved response into a list of (key, separator, value); separator is ': ' for saved values and '=' for answer codes.
+    """
+
+    fields = []
+
+    for field in response.rstrip("\r\n").split("\t"):
+        value_at = field.find(": ")
+        code_at = field.find("=")
+        if code_at != -1 and (value_at == -1 or code_at < value_at):
+            fields.append((field[:code_at], "=", field[code_at+1:]))
+        elif value_at != -1:
+            fields.append((field[:value_at], ": ", field[value_at+2:]))
+
+    return fields
+
+def Decode_Response(response, compiled):
+
+    """ Decode_Response(response, compiled): Turns one saved response, in either format, back into the values that were submitted.
+        Returns an OrderedDict of {field: value}; several checked checkboxes are returned as a list.  CHL_choices is rebuilt when it wasn't saved.
+            compiled: the response's Compiled_Survey, or None if the survey is gone (answer codes are then left as they are)
+    """
+
+    if compiled is None:
+        answer_values = {}
+    else:
+        answer_values = compiled.answer_values
+
+    response_values = collections.OrderedDict()
+
+    for (key, separator, value) in Parse_Response(response):
+        options = answer_values.get(key)
+
+        if separator == "=" and options is not None:
+            values = []
+            for code in value.split(","):
+                (option, period, variant) = code.partition(".")
+                values.append(options[int(option)][int(variant or 0)])
+            if len(values) > 1:
+                response_values[key] = values
+            else:
+                response_values[key] = values[0]
+
+        elif key.startswith('ck') and value.startswith("["): # Several checkboxes were saved as a list
+            try:
+                response_values[key] = list(ast.literal_eval(value))
+            except (ValueError, SyntaxError):
+                response_values[key] = value
+
+        else:
+            response_values[key] = value
+
+    if 'CHL_choices' not in response_values and compiled is not None:
+        response_values['CHL_choices'] = Rebuild_Letter(response_values, answer_values)
+
+    return response_values
+
+def Convert_Responses(survey_id, output_filename):
+
+    """ Convert_Responses(survey_id, output_filename): Re-saves every response to the survey in the compact format of Encode_Response(), to output_filename.
+        Returns a tuple of (bytes read, bytes written).
+    """
+
+    compiled = survey_cache.Get(survey_id)
+
+    if compiled is None or compiled.all_letter_blocks is None:
+        raise IOError("Survey {} not found.".format(survey_id))
+
+    (bytes_read, bytes_written) = (0, 0)
+
+    with open(output_filename, "w") as output_file:
+        for (cursor, response) in storage.Read_Responses(survey_id):
+            bytes_read += len(response)
+            response = Encode_Response(Decode_Response(response, compiled), compiled)
+            bytes_written += len(response)
+            output_file.write(response)
+
+    return (bytes_read, bytes_written)
+
+def Lock_Responses(responses_file):
+
+    """ Lock_Responses(responses_file): Takes an exclusive lock on an open responses file, held until Unlock_Responses() or the file is closed.
+        Keeps a batch of responses from interleaving with another process's when several processes append to the same file.
+    """
+
+    if fcntl is not None:
+        fcntl.flock(responses_file.fileno(), fcntl.LOCK_EX)
+
+def Unlock_Responses(responses_file):
+    if fcntl is not None:
+        fcntl.flock(responses_file.fileno(), fcntl.LOCK_UN)
+
+EXPORT_CONTENT_TYPES = {'tsv': 'text/tab-separated-values', 'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+class TSV_Writer(object):
+
+    """ class TSV_Writer(object): Stands in for csv.writer for TSV exports.  Saved responses never contain tabs or newlines, so nothing needs quoting.
+    """
+
+    def __init__(self, output):
+        self.output = output
+
+    def writerow(self, row):
+        self.output.write("{}\n".format("\t".join([str(value) for value in row])))
+
+def Export_Columns(compiled):
+
+    """ Export_Columns(compiled): Returns the column names used by Export_Responses() for TSV and CSV exports.
+    """
+
+    return ['cursor', 'CHL_submitted', 'CHL_seed', 'survey_id'] + compiled.answer_values.keys() + ['CHL_choices']
+
+def Export_Responses(survey_id, export_format, cursor=0, since=None, chunk_size=64*1024):
+
+    """ Export_Responses(survey_id, export_format, cursor, since, chunk_size): Generator that yields a survey's responses as TSV, CSV or JSON Lines, about chunk_size bytes at a time.
+        Only responses already saved when the export starts are included; responses saved afterwards are picked up by the next export.
+            cursor: where to start from (see Storage.Read_Responses()); every exported response carries the cursor to resume from after it
+            since: only export responses saved at or after this unix time (responses saved before CHL_submitted was recorded are skipped)
+    """
+
+    compiled = survey_cache.Get(survey_id)
+    if compiled is not None:
+        columns = Export_Columns(compiled)
+    else:
+        columns = ['cursor', 'CHL_submitted', 'survey_id', 'CHL_choices']
+
+    output = StringIO.StringIO()
+    if export_format == 'csv':
+        writer = csv.writer(output)
+    elif export_format == 'tsv':
+        writer = TSV_Writer(output)
+    else:
+        writer = None
+
+    if writer is not None and cursor == 0:
+        writer.writerow(columns)
+
+    for (cursor, response) in storage.Read_Responses(survey_id, cursor, since):
+
+        response_values = Decode_Response(response, compiled)
+
+        if since is not None:
+            try:
+                if int(response_values.get('CHL_submitted')) < since:
+                    continue
+            except (TypeError, ValueError):
+                continue
+
+        response_values['cursor'] = cursor
+
+        if writer is None:
+            output.write(json.dumps(response_values))
+            output.write("\n")
+        else:
+            row = []
+            for column in columns:
+                value = response_values.get(column, "")
+                if isinstance(value, list):
+                    value = "; ".join(value)
+                row.append(value)
+            writer.writerow(row)
+
+        if output.tell() >= chunk_size:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+    if output.tell() > 0:
+        yield output.getvalue()
+
+class Response_Writer(object):
+
+    """ class Response_Writer(object): Group-commits responses to <survey_id>-responses.txt from a dedicated thread.
+        Root.submit queues serialized responses with Write(); the writer thread collects them per survey and appends each survey's batch with a single write.
+        With any storage other than File_Storage, each batch is saved with one storage.Append_Responses() call instead, and fsync and max_open_files don't apply.
+        Until Start() is called (or after Stop()), Write() saves directly with storage.Append_Responses().
+            queue_size: most responses waiting to be written; Write() blocks when the queue is full
+            flush_bytes: write out once this many bytes are waiting
+            flush_interval: write out once the oldest waiting response is this many seconds old
+            fsync: 'never' leaves writes to the OS; 'batch' calls os.fsync() on each file after every batch
+            max_open_files: most response files to keep open between batches
+    """
+
+    def __init__(self, queue_size=10000, flush_bytes=64*1024, flush_interval=0.2, fsync='never', max_open_files=64):
+        assert fsync in ('never', 'batch'), "fsync must be 'never' or 'batch'."
+        self.queue = Queue.Queue(queue_size)
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_open_files = max_open_files
+        self.open_files = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def Start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.Run, name="Response_Writer")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def Stop(self):
+
+        """\t Stop(): Stops accepting responses, then waits for every queued response to be written before closing the files.
+        """
+
+        with self.lock:
+            thread = self.thread
+            if thread is None:
+                return
+            self.thread = None
+            self.queue.put(None)
+
+        thread.join()
+
+    def Write(self, survey_id, response):
+
+        """\t Write(survey_id, response): Queues one serialized response for survey_id.
+        """
+
+        with self.lock: # Held while queueing so Stop() can't slip its end marker in ahead of an accepted response
+            if self.thread is not None:
+                self.queue.put((survey_id, response))
+                return
+
+        storage.Append_Responses(survey_id, [response])
+
+    def Run(self):
+        pending = collections.OrderedDict()
+        pending_bytes = 0
+        flush_at = None
+
+        while True:
+            if flush_at is None:
+                item = self.queue.get()
+            else:
+                try:
+                    item = self.queue.get(timeout=max(flush_at - time.time(), 0))
+                except Queue.Empty:
+                    item = False
+
+            if item is None:
+                break
+
+            if item:
+                (survey_id, response) = item
+                pending.setdefault(survey_id, []).append(response)
+                pending_bytes += len(response)
+                if flush_at is None:
+                    flush_at = time.time() + self.flush_interval
+
+            if pending_bytes >= self.flush_bytes or (flush_at is not None and time.time() >= flush_at):
+                self.Flush(pending)
+                pending = collections.OrderedDict()
+                pending_bytes = 0
+                flush_at = None
+
+        self.Flush(pending)
+
+        for responses_file in self.open_files.itervalues():
+            responses_file.close()
+        self.open_files.clear()
+
+    def Flush(self, pending):
+        for (survey_id, responses) in pending.iteritems():
+            try:
+                if not isinstance(storage, File_Storage): # Each batch is a single transaction
+                    with handler_metrics.Timer('response_flush', survey_id):
+                        storage.Append_Responses(survey_id, responses)
+                    continue
+                with handler_metrics.Timer('response_flush', survey_id):
+                    responses_file = self.Open(survey_id)
+                    if not storage.Lock_Current(survey_id, responses_file): # Rolled over into a segment
+                        responses_file.close()
+                        responses_file = self.open_files[survey_id] = storage.Open_Responses(survey_id)
+                    try:
+                        responses_file.write(''.join(responses))
+                        responses_file.flush()
+                    finally:
+                        Unlock_Responses(responses_file)
+                    if self.fsync == 'batch':
+                        os.fsync(responses_file.fileno())
+            except (IOError, OSError):
+                cherrypy.log("Response_Writer failed to save {} response(s) for survey {}".format(len(responses), survey_id), traceback=True)
+                self.open_files.pop(survey_id, None)
+
+    def Open(self, survey_id):
+        responses_file = self.open_files.pop(survey_id, None)
+
+        if responses_file is None:
+            responses_file = open(storage.Responses_Filename(survey_id), "a")
+            while len(self.open_files) >= self.max_open_files:
+                self.open_files.popitem(last=False)[1].close()
+
+        self.open_files[survey_id] = responses_file
+        return responses_file
+
+response_writer = Response_Writer()
+
+# 'text' saves each response with Serialize_Response(); 'compact' saves it with Encode_Response()
+response_format = 'text'
+
+class Distinct_Letters(object):
+
+    """ class Distinct_Letters(object): HyperLogLog estimate of how many different letters a survey's supporters have sent, in the same small, fixed memory however many they send.
+        Letters are compared with tabs and newlines removed, the way Serialize_Response() strips them, so a letter counts the same whether it was just submitted or read back from the file;
+        letters that differ in any other whitespace count separately.
+        The estimate is usually within relative_error (1.04 / sqrt(2 ** precision); 1.6% at the default) of the true count.
+            precision: bits of each letter's hash used to pick one of 2 ** precision one-byte registers
+    """
+
+    # Bump whenever Add() changes how letters are hashed; snapshots from earlier versions are then rebuilt from the responses
+    VERSION = 2
+
+    def __init__(self, precision=12):
+        self.registers = bytearray(2 ** precision)
+        self.precision = precision
+        self.letters = 0
+
+    def Add(self, letter):
+        if isinstance(letter, unicode):
+            letter = letter.encode('utf-8')
+
+        hashed = int(hashlib.new('md5', letter.replace("\t", "").replace("\n", "").replace("\r", "")).hexdigest()[:16], 16)
+        register = hashed >> (64 - self.precision)
+        rank = 64 - self.precision - (hashed & ((1 << (64 - self.precision)) - 1)).bit_length() + 1 # Position of the first 1 bit after the register's bits
+
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+        self.letters += 1
+
+    def Estimate(self):
+
+        """\t Estimate(): Returns the estimated number of distinct letters added, never more than the number added.
+        """
+
+        registers = len(self.registers)
+        empty = self.registers.count('\x00')
+        estimate = 0.7213 / (1 + 1.079 / registers) * registers * registers / sum(2.0 ** -rank for rank in self.registers)
+
+        if estimate <= 2.5 * registers and empty > 0: # Few letters yet; counting the empty registers is more accurate
+            estimate = registers * math.log(float(registers) / empty)
+
+        return min(int(round(estimate)), self.letters)
+
+    def Stats(self):
+        distinct = self.Estimate()
+        return collections.OrderedDict([
+            ('letters', self.letters),
+            ('distinct', distinct),
+            ('duplicate_rate', 1 - float(distinct) / self.letters if self.letters > 0 else 0.0),
+            ('relative_error', 1.04 / math.sqrt(len(self.registers))),
+        ])
+
+    def Snapshot(self):
+        return {'version': self.VERSION, 'letters': self.letters, 'precision': self.precision, 'registers': base64.b64encode(zlib.compress(str(self.registers)))}
+
+    def Restore(self, snapshot):
+        try:
+            registers = bytearray(zlib.decompress(base64.b64decode(snapshot['registers'])))
+        except (TypeError, zlib.error):
+            return False
+
+        if snapshot.get('version') != self.VERSION or snapshot['precision'] != self.precision or len(registers) != len(self.registers):
+            return False
+
+        self.registers = registers
+        self.letters = snapshot['letters']
+        return True
+
+class Survey_Tally(object):
+
+    """ class Survey_Tally(object): Running count of the responses to one survey and of how many times each option was chosen.
+            responses: number of responses counted
+            counts: {form field: [times each option was chosen]} for every Radio and Checkbox block
+            other: {form field: times a value matching none of the options was submitted}
+            letters: Distinct_Letters of the letters sent
+            cursor: where Response_Tallies.Catch_Up() carries on reading the responses; None until it has found its place.  Root.submit doesn't move it, so it's only
+                kept up to date where the tally is only ever caught up from storage (Response_Tallies.shared)
+        Hold lock while saving a response and calling Add() so the tally always matches the responses file.
+    """
+
+    def __init__(self, compiled):
+        self.lock = threading.Lock()
+        self.responses = 0
+        self.cursor = None
+        self.counts = collections.OrderedDict()
+        self.other = {}
+        self.letters = Distinct_Letters()
+        self.dirty = False
+
+        for (field, options) in compiled.answer_values.iteritems():
+            if not field.startswith('static'):
+                self.counts[field] = [0] * len(options)
+                self.other[field] = 0
+
+    def Add(self, response_values, compiled):
+        self.responses += 1
+        self.dirty = True
+
+        if response_values.get('CHL_choices') is not None:
+            self.letters.Add(response_values['CHL_choices'])
+
+        for (field, counts) in self.counts.iteritems():
+            value = response_values.get(field)
+            if value is None:
+                continue
+            if not isinstance(value, list):
+                value = [value]
+            codes = compiled.answer_codes[field]
+            for single_value in value:
+                code = codes.get(single_value)
+                if code is None:
+                    self.other[field] += 1
+                else:
+                    counts[int(code.partition(".")[0])] += 1
+
+    def Snapshot(self):
+        return {'responses': self.responses, 'counts': self.counts, 'other': self.other, 'letters': self.letters.Snapshot()}
+
+    def Restore(self, snapshot):
+
+        """\t Restore(snapshot): Loads counts saved by Snapshot(); returns False, leaving the tally untouched, if they don't fit this survey.
+            Snapshots saved before letters were counted don't fit either, so the tally is rebuilt from the responses once.
+        """
+
+        counts = snapshot.get('counts', {})
+
+        if sorted(counts.keys()) != sorted(self.counts.keys()) or any(len(counts[field]) != len(self.counts[field]) for field in self.counts):
+            return False
+
+        if 'letters' not in snapshot or not self.letters.Restore(snapshot['letters']):
+            return False
+
+        self.responses = snapshot['responses']
+        for field in self.counts:
+            self.counts[field] = counts[field]
+            self.other[field] = snapshot['other'][field]
+        return True
+
+class Response_Tallies(object):
+
+    """ class Response_Tallies(object): Keeps a Survey_Tally for every survey that has been submitted to or asked about since startup.
+        A tally starts from the survey's last snapshot (see Storage.Read_Stats()) and catches up on any responses saved after it; without a usable snapshot it is rebuilt from all of the survey's responses.
+            shared: set when other processes append to the same responses files; Root.submit then leaves the tallies alone and Get() catches up on the file instead
+    """
+
+    def __init__(self, shared=False):
+        self.lock = threading.Lock()
+        self.tallies = {}
+        self.loading = {}
+        self.shared = shared
+
+    def Get(self, survey_id, compiled):
+
+        """\t Get(survey_id, compiled): Returns the Survey_Tally for survey_id, loading it first if needed.
+            Loading can read every response to the survey, so it happens outside lock: only callers for the same survey wait on its entry in loading,
+            and a tally that has to be loaded again in shared mode is swapped in once it's ready.
+        """
+
+        with self.lock:
+            tally = self.tallies.get(survey_id)
+            if tally is None:
+                loading = self.loading.setdefault(survey_id, threading.Lock())
+
+        if tally is None:
+            with loading:
+                with self.lock:
+                    tally = self.tallies.get(survey_id)
+                if tally is None:
+                    tally = self.Load(survey_id, compiled)
+                    with self.lock:
+                        self.tallies[survey_id] = tally
+                        del self.loading[survey_id]
+                    return tally
+
+        while self.shared:
+            with tally.lock:
+                with self.lock:
+                    current = self.tallies[survey_id]
+                if current is tally:
+                    if not self.Catch_Up(survey_id, compiled, tally):
+                        tally = self.Load(survey_id, compiled)
+                        with self.lock:
+                            self.tallies[survey_id] = tally
+                    break
+            tally = current # Another caller swapped in a reloaded tally while this one waited
+
+        return tally
+
+    def Load(self, survey_id, compiled):
+        tally = Survey_Tally(compiled)
+
+        try:
+            snapshot = storage.Read_Stats(survey_id)
+            if snapshot is not None and not tally.Restore(json.loads(snapshot)):
+                tally = Survey_Tally(compiled)
+        except (IOError, ValueError, KeyError, sqlite3.Error):
+            pass
+
+        if not self.Catch_Up(survey_id, compiled, tally): # The responses file was replaced since the snapshot
+            tally = Survey_Tally(compiled)
+            self.Catch_Up(survey_id, compiled, tally)
+
+        return tally
+
+    def Catch_Up(self, survey_id, compiled, tally):
+
+        """\t Catch_Up(survey_id, compiled, tally): Adds the responses saved after tally.cursor to the tally, so each call only reads what's new.
+            A tally without a cursor first skips the tally.responses responses it has already counted.  Returns False if the responses were replaced since
+            (storage holds fewer responses than were counted, or ends before tally.cursor); the tally then needs loading again.
+        """
+
+        if tally.cursor is None:
+            (tally.cursor, seen) = storage.Skip_Responses(survey_id, tally.responses)
+            if seen < tally.responses:
+                return False
+        elif storage.Responses_End(survey_id) < tally.cursor:
+            return False
+
+        for (cursor, response) in storage.Read_Responses(survey_id, tally.cursor):
+            tally.Add(Decode_Response(response, compiled), compiled)
+            tally.cursor = cursor
+
+        return True
+
+    def Snapshot(self):
+
+        """\t Snapshot(): Saves a snapshot with storage.Write_Stats() for every tally that changed since the last snapshot.
+        """
+
+        with self.lock:
+            tallies = self.tallies.items()
+
+        for (survey_id, tally) in tallies:
+            with tally.lock:
+                if not tally.dirty:
+                    continue
+                snapshot = json.dumps(tally.Snapshot())
+                tally.dirty = False
+
+            try:
+                storage.Write_Stats(survey_id, snapshot)
+            except (IOError, OSError, sqlite3.Error):
+                cherrypy.log("Response_Tallies failed to save a snapshot for survey {}".format(survey_id), traceback=True)
+
+response_tallies = Response_Tallies()
+
+def Survey_Stats(compiled, tally):
+
+    """ Survey_Stats(compiled, tally): Returns the current tally as a JSON-ready dictionary, labelled with each block's title and options,
+        along with how many different letters have been sent (see Distinct_Letters) and how many could be (see Letter_Diversity()).
+    """
+
+    fields = collections.OrderedDict()
+
+    with tally.lock:
+        responses = tally.responses
+        letters = tally.letters.Stats()
+        for (field, counts) in tally.counts.iteritems():
+            block = compiled.all_letter_blocks[int(field[2:])]
+            fields[field] = collections.OrderedDict([
+                ('title', block.GetTitle()),
+                ('options', [collections.OrderedDict([('option', option), ('count', count)]) for (option, count) in zip(block.display_during_choice, counts)]),
+                ('other', tally.other[field]),
+            ])
+
+    return collections.OrderedDict([('survey_id', compiled.survey_id), ('responses', responses), ('letters', letters), ('diversity', Letter_Diversity(compiled.all_letter_blocks)), ('fields', fields)])
+
+class Stage_Timer(object):
+
+    """ class Stage_Timer(object): Context manager returned by Metrics.Timer(); records the time spent inside the with block when it exits.
+    """
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.metrics.Observe(self.name, self.labels, time.time() - self.started)
+
+class Null_Timer(object):
+
+    """ class Null_Timer(object): Stands in for Stage_Timer while metrics are off. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        pass
+
+NULL_TIMER = Null_Timer()
+
+class Metrics(object):
+
+    """ class Metrics(object): Latency histograms and counters for the Root handlers and the stages inside them, served at /metrics in Prometheus text format.
+        Everything is a no-op until on is True, so the calls can stay in place when metrics are switched off.
+            on: whether to record anything
+            max_survey_ids: most distinct survey_id labels to keep; requests for any others, and for survey_ids that don't exist, are recorded under survey_id="other"
+    """
+
+    # Histogram bucket upper bounds, in seconds
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    HELP = {
+        'chl_request_seconds': ('histogram', "Time spent in each Root handler."),
+        'chl_stage_seconds': ('histogram', "Time spent in each stage of a request: file_read, load_letter_blocks, create_enduser_survey, render, response_write, response_flush."),
+        'chl_request_errors_total': ('counter', "Requests to each Root handler that raised an exception."),
+    }
+
+    def __init__(self, on=False, max_survey_ids=1000):
+        self.on = on
+        self.max_survey_ids = max_survey_ids
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.survey_ids = set()
+
+    def Configure(self, on, max_survey_ids):
+        self.on = on
+        self.max_survey_ids = max_survey_ids
+
+    def Survey_Label(self, survey_id):
+
+        """\t Survey_Label(survey_id): Returns the label to record survey_id under, so that requests for made up survey_ids can't grow the metrics without bound.
+            Only survey_ids that storage holds a survey for are given labels of their own; requests without one are labelled "".
+        """
+
+        if survey_id is None or survey_id == "":
+            return ""
+
+        survey_id = str(survey_id)
+
+        if survey_id in self.survey_ids:
+            return survey_id
+
+        if len(self.survey_ids) >= self.max_survey_ids or storage.Signature(survey_id) is None:
+            return "other"
+
+        with self.lock:
+            if len(self.survey_ids) < self.max_survey_ids:
+                self.survey_ids.add(survey_id)
+                return survey_id
+
+        return "other"
+
+    def Timer(self, stage, survey_id=None):
+
+        """\t Timer(stage, survey_id): Returns a context manager that adds the time spent inside it to chl_stage_seconds.
+        """
+
+        if not self.on:
+            return NULL_TIMER
+
+        return Stage_Timer(self, 'chl_stage_seconds', (('stage', stage), ('survey_id', self.Survey_Label(survey_id))))
+
+    def Observe(self, name, labels, seconds):
+        bucket = bisect.bisect_left(self.BUCKETS, seconds)
+
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+            histogram[bucket] += 1
+            histogram[-1] += seconds
+
+    def Count(self, name, labels, amount=1):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + amount
+
+    def Handler(self, handler):
+
+        """\t Handler(handler): Decorator for Root handlers; records chl_request_seconds and chl_request_errors_total labelled with the handler's name and the request's survey_id.
+        """
+
+        @functools.wraps(handler)
+        def Timed_Handler(root, **kwargs):
+            if not self.on:
+                return handler(root, **kwargs)
+
+            labels = (('handler', handler.__name__), ('survey_id', self.Survey_Label(kwargs.get('survey_id'))))
+            started = time.time()
+            try:
+                return handler(root, **kwargs)
+            except cherrypy.HTTPRedirect: # Includes 304 Not Modified
+                raise
+            except Exception:
+                self.Count('chl_request_errors_total', labels)
+                raise
+            finally:
+                self.Observe('chl_request_seconds', labels, time.time() - started)
+
+        return Timed_Handler
+
+    def Exposition(self):
+
+        """\t Exposition(): Returns every metric in the Prometheus text exposition format.
+        """
+
+        with self.lock:
+            histograms = sorted((key, list(value)) for (key, value) in self.histograms.iteritems())
+            counters = sorted(self.counters.iteritems())
+
+        def Labels(labels, *extra):
+            return ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for (key, value) in labels + extra)
+
+        lines = []
+        described = set()
+
+        def Describe(name):
+            if name not in described:
+                described.add(name)
+                lines.append("# HELP {} {}".format(name, self.HELP[name][1]))
+                lines.append("# TYPE {} {}".format(name, self.HELP[name][0]))
+
+        for ((name, labels), histogram) in histograms:
+            Describe(name)
+            cumulative = 0
+            for (upper_bound, count) in zip(self.BUCKETS, histogram):
+                cumulative += count
+                lines.append("{}_bucket{{{}}} {}".format(name, Labels(labels, ('le', repr(upper_bound))), cumulative))
+            cumulative += histogram[len(self.BUCKETS)]
+            lines.append("{}_bucket{{{}}} {}".format(name, Labels(labels, ('le', '+Inf')), cumulative))
+            lines.append("{}_sum{{{}}} {!r}".format(name, Labels(labels), histogram[-1]))
+            lines.append("{}_count{{{}}} {}".format(name, Labels(labels), cumulative))
+
+        for ((name, labels), count) in counters:
+            Describe(name)
+            lines.append("{}{{{}}} {}".format(name, Labels(labels), count))
+
+        cache_stats = survey_cache.Stats()
+        lines.append("# HELP chl_survey_cache_hits_total Survey_Cache lookups answered from memory.")
+        lines.append("# TYPE chl_survey_cache_hits_total counter")
+        lines.append("chl_survey_cache_hits_total {}".format(cache_stats['hits']))
+        lines.append("# HELP chl_survey_cache_misses_total Survey_Cache lookups that had to load the survey.")
+        lines.append("# TYPE chl_survey_cache_misses_total counter")
+        lines.append("chl_survey_cache_misses_total {}".format(cache_stats['misses']))
+        lines.append("# HELP chl_survey_cache_bytes Survey file bytes held by the Survey_Cache.")
+        lines.append("# TYPE chl_survey_cache_bytes gauge")
+        lines.append("chl_survey_cache_bytes {}".format(cache_stats['bytes']))
+
+        if admission.on:
+            admission_stats = admission.Stats()
+            lines.append("# HELP chl_admission_requests_total Requests to each admission controlled handler by outcome: admitted, queued, rejected (queue full), timed_out (waited too long) or shed (made way for a submit).")
+            lines.append("# TYPE chl_admission_requests_total counter")
+            for ((endpoint, outcome), count) in sorted(admission_stats['counters'].iteritems()):
+                lines.append("chl_admission_requests_total{{{}}} {}".format(Labels((('endpoint', endpoint), ('outcome', outcome))), count))
+            lines.append("# HELP chl_admission_active Requests running in each admission controlled handler.")
+            lines.append("# TYPE chl_admission_active gauge")
+            for (endpoint, active) in sorted(admission_stats['active'].iteritems()):
+                lines.append("chl_admission_active{{{}}} {}".format(Labels((('endpoint', endpoint),)), active))
+            lines.append("# HELP chl_admission_waiting Requests waiting to be admitted.")
+            lines.append("# TYPE chl_admission_waiting gauge")
+            lines.append("chl_admission_waiting {}".format(admission_stats['waiting']))
+
+        return '\n'.join(lines) + '\n'
+
+handler_metrics = Metrics()
+
+class Admission_Waiter(object):
+    def __init__(self, endpoint, priority, sequence):
+        self.endpoint = endpoint
+        self.order = (priority, sequence)
+        self.event = threading.Event()
+        self.granted = False
+        self.shed = False
+
+class Admission(object):
+
+    """ class Admission(object): Admission control for the Root handlers, so that a burst of requests is answered quickly with 503 Service Unavailable instead of slowing every request down until clients give up and retry.
+        A request runs straight away if its endpoint and the server as a whole are under their limits; otherwise it waits in a bounded queue for up to queue_timeout seconds.
+        Waiting requests are let in by priority, then in order of arrival.  A request that finds the queue full takes the place of the newest waiting request of lower priority, if there is one,
+        so supporters who have finished the survey (submit) get their letter ahead of those just opening it (survey).
+        Everything is let straight in until on is True.
+            limits: {endpoint: most requests to run at once}; endpoints not listed are only held to max_active
+            max_active: most requests to run at once across every limited endpoint; 0 for no limit
+            queue_size: most requests waiting at once; each holds one of the server's threads while it waits
+            queue_timeout: seconds a request may wait before it's turned away
+            retry_after: seconds to suggest in the Retry-After header of a 503
+    """
+
+    # Lower runs first; endpoints not listed come after these
+    PRIORITIES = {'submit': 0, 'survey': 1}
+
+    OUTCOMES = ('admitted', 'queued', 'rejected', 'timed_out', 'shed')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = collections.defaultdict(int)
+        self.total_active = 0
+        self.waiters = []
+        self.sequence = 0
+        self.counters = collections.defaultdict(int)
+        self.Configure(False, {}, 0, 0, 1.0, 5)
+
+    def Configure(self, on, limits, max_active, queue_size, queue_timeout, retry_after):
+        self.on = on
+        self.limits = dict(limits)
+        self.max_active = max_active
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+    def Can_Run(self, endpoint):
+        if self.max_active > 0 and self.total_active >= self.max_active:
+            return False
+
+        return endpoint not in self.limits or self.active[endpoint] < self.limits[endpoint]
+
+    def Start(self, endpoint):
+        self.active[endpoint] += 1
+        self.total_active += 1
+
+    def Acquire(self, endpoint):
+
+        """\t Acquire(endpoint): Waits for a place to run a request to endpoint; returns False if the request should be turned away.  Every True must be followed by Release().
+        """
+
+        with self.lock:
+            if self.Can_Run(endpoint):
+                self.Start(endpoint)
+                self.counters[(endpoint, 'admitted')] += 1
+                return True
+
+            waiter = Admission_Waiter(endpoint, self.PRIORITIES.get(endpoint, len(self.PRIORITIES)), self.sequence)
+            self.sequence += 1
+
+            if len(self.waiters) >= self.queue_size:
+                lower = [other for other in self.waiters if other.order[0] > waiter.order[0]]
+                if len(lower) == 0:
+                    self.counters[(endpoint, 'rejected')] += 1
+                    return False
+                shed = max(lower, key=lambda other: (other.order[0], other.order[1]))
+                self.waiters.remove(shed)
+                shed.shed = True
+                shed.event.set()
+                self.counters[(shed.endpoint, 'shed')] += 1
+
+            self.waiters.append(waiter)
+            self.counters[(endpoint, 'queued')] += 1
+
+        waiter.event.wait(self.queue_timeout)
+
+        with self.lock:
+            if waiter.granted:
+                self.counters[(endpoint, 'admitted')] += 1
+                return True
+            if not waiter.shed:
+                self.waiters.remove(waiter)
+                self.counters[(endpoint, 'timed_out')] += 1
+            return False
+
+    def Release(self, endpoint):
+        with self.lock:
+            self.active[endpoint] -= 1
+            self.total_active -= 1
+
+            for waiter in sorted(self.waiters, key=lambda waiter: waiter.order):
+                if self.max_active > 0 and self.total_active >= self.max_active:
+                    break
+                if self.Can_Run(waiter.endpoint):
+                    self.waiters.remove(waiter)
+                    self.Start(waiter.endpoint)
+                    waiter.granted = True
+                    waiter.event.set()
+
+    def Limit(self, endpoint):
+
+        """\t Limit(endpoint): Decorator for Root handlers; admits each request with Acquire(), and answers 503 with Retry-After when it's turned away.
+        """
+
+        def Decorator(handler):
+
+            @functools.wraps(handler)
+            def Admitted_Handler(root, **kwargs):
+                if not self.on:
+                    return handler(root, **kwargs)
+
+                if not self.Acquire(endpoint):
+                    cherrypy.response.status = 503 # Set directly; raising HTTPError would strip Retry-After
+                    cherrypy.response.headers['Retry-After'] = str(self.retry_after)
+                    return "We're very busy right now.  Please try again in a few seconds."
+
+                try:
+                    return handler(root, **kwargs)
+                finally:
+                    self.Release(endpoint)
+
+            return Admitted_Handler
+
+        return Decorator
+
+    def Stats(self):
+        with self.lock:
+            return {'active': dict(self.active), 'waiting': len(self.waiters), 'counters': dict(self.counters)}
+
+admission = Admission()
+
+def Validate_ETag(etag):
+
+    """ Validate_ETag(etag): Sends etag with the response, answering with 304 Not Modified instead if it matches the request's If-None-Match.
+        Only for pages whose etag is known before the body is built, such as surveys without random blocks; for anything else, leave the ETag off.
+    """
+
+    cherrypy.response.headers['ETag'] = etag
+    cherrypy.response.headers.setdefault('Cache-Control', 'no-cache') # Cache, but check back each time so an edited survey shows up straight away
+    cherrypy.lib.cptools.validate_etags()
+
+class Compressor(object):
+
+    """ class Compressor(object): Negotiates the Content-Encoding of Root's responses and keeps compressed copies of cacheable pages, keyed by ETag, so that each is compressed only once.
+        Offers br when the brotli module is installed, and gzip.  Pages without an ETag are gzipped afresh on each request.
+            on: whether to compress at all
+            min_bytes: responses shorter than this go out uncompressed
+            max_entries: most pages to keep compressed copies of; least recently used pages are dropped first
+    """
+
+    def __init__(self, on=False, min_bytes=1024, max_entries=256):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.max_entries = max_entries
+        self.Configure(on, min_bytes)
+
+    def Configure(self, on, min_bytes):
+        self.on = on
+        self.min_bytes = min_bytes
+
+        if brotli is not None:
+            self.encodings = ['br', 'gzip']
+        else:
+            self.encodings = ['gzip']
+
+    def Negotiate(self, size):
+
+        """\t Negotiate(size): Returns the encoding to send a response of size bytes in, going by the request's Accept-Encoding, or None to send it as it is.
+        """
+
+        if not self.on or size < self.min_bytes:
+            return None
+
+        accepted = dict((element.value.lower(), element.qvalue) for element in cherrypy.request.headers.elements('Accept-Encoding'))
+
+        for encoding in self.encodings:
+            if accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+
+        return None
+
+    def Compress(self, body, encoding, level=6):
+        if encoding == 'br':
+            return brotli.compress(body, quality=level)
+
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # 16 + MAX_WBITS writes the gzip header and trailer
+        return compressor.compress(body) + compressor.flush()
+
+    def Precompress(self, etag, body):
+
+        """\t Precompress(etag, body): Compresses body in every offered encoding, at the highest level since it's only done once, and keeps the results under etag.
+        """
+
+        with self.lock:
+            variants = self.entries.pop(etag, None)
+            if variants is not None:
+                self.entries[etag] = variants
+                return variants
+
+        if not self.on or len(body) < self.min_bytes:
+            return {}
+
+        variants = {}
+        for encoding in self.encodings:
+            variants[encoding] = self.Compress(body, encoding, level=11 if encoding == 'br' else 9)
+
+        with self.lock:
+            self.entries[etag] = variants
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return variants
+
+compressor = Compressor()
+
+def Send_Page(body, etag=None):
+
+    """ Send_Page(body, etag): Returns body as the response, compressed if the client accepts an encoding the Compressor offers.
+        With an etag, answers If-None-Match with 304 (see Validate_ETag()) and sends a compressed copy kept by the Compressor; each encoding gets its own ETag.
+    """
+
+    encoding = compressor.Negotiate(len(body))
+
+    if compressor.on:
+        cherrypy.response.headers['Vary'] = 'Accept-Encoding'
+
+    if etag is not None:
+        Validate_ETag(etag if encoding is None else '{}-{}"'.format(etag[:-1], encoding))
+
+    if encoding is None:
+        return body
+
+    cherrypy.response.headers['Content-Encoding'] = encoding
+
+    if etag is None:
+        return compressor.Compress(body, encoding)
+
+    return compressor.Precompress(etag, body)[encoding]
+
+# Credential for the admin-only handlers (Root.export and Root.stats), set from chl.admin.token; while it's blank they are switched off
+admin_token = ""
+
+def Admin_Allowed(kwargs):
+
+    """ Admin_Allowed(kwargs): True if the request carries admin_token, as an admin_token parameter or an X-CHL-Admin-Token header.
+        Otherwise sets the response status to 403 and returns False.  survey_id can't serve as the credential: it's in every campaign link.
+    """
+
+    token = kwargs.get('admin_token') or cherrypy.request.headers.get('X-CHL-Admin-Token', "")
+
+    if admin_token != "" and isinstance(token, basestring) and hmac.compare_digest(str(token), admin_token):
+        return True
+
+    cherrypy.response.status = 403
+    return False
+
+class Root(object):
+
+    """ CherryPy Root class for serving the survey page. """
+
+    def __init__(self):
+        pass
+
+    @handler_metrics.Handler
+    def admin(self, **kwargs):
+
+        """ cherrypy.Root.admin(): This is where the admin goes to create the survey. """
+
+        admin_filename = "admin.txt"
+
+        with handler_metrics.Timer('file_read'):
+            with open(admin_filename) as admin_file:
+                admin_source = admin_file.read()
+
+        return Send_Page(admin_source, '"{}"'.format(hashlib.new('md5', admin_source).hexdigest()))
+
+    @handler_metrics.Handler
+    @admission.Limit('createsurvey')
+    def createsurvey(self, **kwargs):
+
+        """ cherrypy.Root.createsurvey(): Action of cherrypy.Root.admin(); survey_id is displayed here. """
+
+        if kwargs.get('survey', "") != "":
+            survey_id = hashlib.new('md5', kwargs['survey']).hexdigest()
+        else:
+            return "Can't create a blank survey!"
+
+        # Just to get the Total Permutations - I think this is a cool stat to display for those creating the survey
+        with handler_metrics.Timer('load_letter_blocks', survey_id):
+            (survey_validation, returned_source, diversity) = Load_Letter_Blocks(kwargs['survey'], validation_mode=True)
+
+        storage.Write_Survey(survey_id, kwargs.pop('survey'), kwargs)
+        
+        return "<a href='../survey?survey_id={0}'>Survey #{0}</a> created successfully.<br>&nbsp;<br>{1}".format(survey_id, Diversity_Message(diversity))
+
+    def engine(self, **kwargs):
+
+        """ cherrypy.Root.engine(): The script shared by every survey page (ENGINE_JS).  Survey pages ask for /engine?v=<ENGINE_VERSION>, which can be cached for good. """
+
+        cherrypy.response.headers['Content-Type'] = 'application/javascript'
+
+        if kwargs.get('v') == ENGINE_VERSION:
+            cherrypy.response.headers['Cache-Control'] = 'public, max-age=31536000'
+        else:
+            cherrypy.response.headers['Cache-Control'] = 'no-cache'
+
+        return Send_Page(ENGINE_JS, '"{}"'.format(ENGINE_VERSION))
+
+    def export(self, **kwargs):
+
+        """ cherrypy.Root.export(): Streams a survey's responses for admins.  Access through /export?survey_id=<md5 hash>&format=<tsv, csv or jsonl>&admin_token=<chl.admin.token>
+            Optional: cursor=<byte offset> resumes an interrupted export (each exported response includes its cursor), since=<unix time> skips older responses.
+        """
+
+        if not Admin_Allowed(kwargs):
+            return "Exporting responses needs the admin token (chl.admin.token in cfg.cfg)."
+
+        survey_id = kwargs.get('survey_id')
+        export_format = kwargs.get('format', 'tsv')
+
+        if survey_id == None:
+            return # Returns nothing; change as needed
+
+        if export_format not in EXPORT_CONTENT_TYPES:
+            return "Unknown export format: {}.  Choose tsv, csv or jsonl.".format(export_format)
+
+        try:
+            cursor = int(kwargs.get('cursor', 0))
+            if kwargs.get('since', "") != "":
+                since = int(kwargs['since'])
+            else:
+                since = None
+        except ValueError:
+            return "cursor and since need to be whole numbers."
+
+        if not storage.Responses_Exist(survey_id):
+            return "No responses found for survey {}.".format(survey_id)
+
+        cherrypy.response.headers['Content-Type'] = EXPORT_CONTENT_TYPES[export_format]
+        cherrypy.response.headers['Content-Disposition'] = 'attachment; filename="{}-responses.{}"'.format(survey_id, export_format)
+
+        return Export_Responses(survey_id, export_format, cursor, since)
+
+    @handler_metrics.Handler
+    @admission.Limit('importsurveys')
+    def importsurveys(self, **kwargs):
+
+        """ cherrypy.Root.importsurveys(): Creates many surveys at once from an uploaded zip or tar archive (see Read_Survey_Bundle()) and returns the batch result as JSON (see Import_Surveys()).
+            Post the archive as bundle=<file>; with validate_only=1 the surveys are checked but not created.
+        """
+
+        bundle = kwargs.get('bundle')
+
+        if not hasattr(bundle, 'file'):
+            return "Upload a zip or tar archive of surveys as bundle."
+
+        try:
+            surveys = Read_Survey_Bundle(bundle.file)
+        except (tarfile.TarError, zipfile.BadZipfile, IOError), e:
+            return "Couldn't read {} as a zip or tar archive of surveys: {}".format(bundle.filename, e)
+
+        with handler_metrics.Timer('load_letter_blocks'):
+            result = Import_Surveys(surveys, 1, create=kwargs.get('validate_only', "") == "") # Validated in this thread; see Import_Surveys() on pools
+
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+
+        return Send_Page(json.dumps(result))
+
+    def index(self, **kwargs):
+
+        """ cherrypy.Root.index(): Without this, a 404 error would occur at the root.  Customize as desired. """
+        
+        return # Returns nothing; change as needed
+
+    @handler_metrics.Handler
+    @admission.Limit('survey')
+    def survey(self, **kwargs):
+
+        """ cherrypy.Root.survey(): The survey page to send supporters to.  Access through /survey?survey_id=<md5 hash> """
+
+        survey_id = kwargs.get('survey_id')
+
+        if survey_id == None:
+            return # Returns nothing; change as needed
+
+        compiled = survey_cache.Get(survey_id)
+
+        if compiled is None or compiled.template is None:
+            return Create_EndUser_Survey(None, None, None)
+
+        with handler_metrics.Timer('render', survey_id):
+            page = compiled.template.Render()
+
+        return Send_Page(page, compiled.template.etag)
         
+    @admission.Limit('stats')
+    def stats(self, **kwargs):
+
+        """ cherrypy.Root.stats(): How many responses a survey has had and how often each option was chosen, as JSON.  Access through /stats?survey_id=<md5 hash>&admin_token=<chl.admin.token> """
+
+        if not Admin_Allowed(kwargs):
+            return "Survey statistics need the admin token (chl.admin.token in cfg.cfg)."
+
+        survey_id = kwargs.get('survey_id')
+
+        if survey_id == None:
+            return # Returns nothing; change as needed
+
+        compiled = survey_cache.Get(survey_id)
+
+        if compiled is None or compiled.all_letter_blocks is None:
+            return "Survey not found."
+
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+
+        return json.dumps(Survey_Stats(compiled, response_tallies.Get(survey_id, compiled)))
+
+    @handler_metrics.Handler
+    @admission.Limit('submit')
     def submit(self, **kwargs):
 
         """ cherrypy.Root.submit(): Action of cherrypy.Root.survey(); Contains the unform letter generated by the user's survey choices. """
 
-        try:   
-            self.survey_id = kwargs['survey_id']
+        try:
+            survey_id = kwargs['survey_id'] # Kept local: every server thread shares this Root, so anything kept on self can be overwritten by another submit
         except KeyError:
             return # Returns nothing so you can't go directly to /submit; change as needed
 
-        # Saves the response; keys are sorted (ck, rd, static; CHL_choices, survey_id)
-        response = []
-        sorted_response_keys = kwargs.keys()
-        sorted_response_keys.sort()
-        
-        with open("{}-responses.txt".format(self.survey_id), "a") as responses_file:
-            for key in sorted_response_keys:
-                response.append("{}: {}".format(key, kwargs[key]))
-            for (index, value) in enumerate(response):
-                response[index] = value.replace("\t", "").replace("\n", "").replace("\r", "")
-            response = "{}\n".format('\t'.join(response))         
-            responses_file.write(response)
+        compiled = survey_cache.Get(survey_id)
 
-        keys = ['completed_textarea', 'completed_header', 'completed_engine', 'completed_cleanup', 'completed_footer']
+        response_values = dict(kwargs)
+        response_values['CHL_submitted'] = int(time.time())
 
-        options = {}.fromkeys(keys, "")
+        if response_format == 'compact' and compiled is not None:
+            response = Encode_Response(response_values, compiled)
+        else:
+            response = Serialize_Response(response_values)
+
+        if compiled is not None and compiled.all_letter_blocks is not None and not response_tallies.shared:
+            tally = response_tallies.Get(survey_id, compiled)
+            with tally.lock:
+                with handler_metrics.Timer('response_write', survey_id):
+                    response_writer.Write(survey_id, response)
+                tally.Add(response_values, compiled)
+        else:
+            with handler_metrics.Timer('response_write', survey_id):
+                response_writer.Write(survey_id, response)
 
-        for key in keys:
-            try:
-                with open("{}_{}.txt".format(self.survey_id, key)) as options_file:
-                    options[key] = options_file.read()
-            except IOError:
-                pass
-            
-        return Survey_Completed_Page(kwargs['CHL_choices'], textarea_attributes=options['completed_textarea'], header=options['completed_header'], form_engine=options['completed_engine'], cleanup=options['completed_cleanup'], footer=options['completed_footer']).replace(self.survey_id, '')
+        if compiled is None:
+            options = {}.fromkeys(COMPLETED_OPTION_KEYS, "")
+        else:
+            options = compiled.options
 
+        return Send_Page(Survey_Completed_Page(kwargs['CHL_choices'], textarea_attributes=options['completed_textarea'], header=options['completed_header'], form_engine=options['completed_engine'], cleanup=options['completed_cleanup'], footer=options['completed_footer']).replace(survey_id, ''))
+
+    @handler_metrics.Handler
+    @admission.Limit('validate')
     def validate(self, **kwargs):
 
         """ cherrypy.Root.submit(): Useful for admins to validate their survey and receive helpful error messages if they made a syntax error in assembling it. """
 
         if kwargs.get('survey', "") != "":
 
-            (survey_validation, returned_source, total_permutations) = Load_Letter_Blocks(kwargs['survey'], validation_mode=True)
+            with handler_metrics.Timer('load_letter_blocks'):
+                (survey_validation, returned_source, diversity) = Load_Letter_Blocks(kwargs['survey'], validation_mode=True)
             if survey_validation == True: # Survey passed; preview the survey
-                return "Your survey passed validation! Below is a preview.  When you're ready to create your survey, go to <a href='../admin'>Create Survey</a>.<br>&nbsp;<br>Based on your supporters' choices, this could create as many as <b>{:,}</b> unique Un-form letters.  Mathematical!<br>&nbsp; <br>{}".format(total_permutations, returned_source.replace("document.forms['cat_herding_laser'].submit();", "").replace('<textarea name="CHL_choices" rows=5 cols=30 hidden>', '<textarea name="CHL_choices" rows=5 cols=30>'))
+                return Send_Page("Your survey passed validation! Below is a preview.  When you're ready to create your survey, go to <a href='../admin'>Create Survey</a>.<br>&nbsp;<br>{}<br>&nbsp; <br>{}".format(Diversity_Message(diversity), returned_source.replace("document.forms['cat_herding_laser'].submit();", "").replace('<textarea name="CHL_choices" rows=5 cols=30 hidden>', '<textarea name="CHL_choices" rows=5 cols=30>')))
             else:            
                 return "Your survey had some errors in it, here's a summary: <br>{}".format('<br>\n'.join(returned_source))
         else:
             return "<html><form method=post action=validate>Copy and paste your survey below:<br><textarea name=survey cols=30 rows=15></textarea><input type=submit value='Validate Survey'></form></html>"
 
+    @handler_metrics.Handler
+    @admission.Limit('validatelines')
+    def validatelines(self, **kwargs):
+
+        """ cherrypy.Root.validatelines(): Incremental version of cherrypy.Root.validate() for editors that validate as the author types; returns JSON (see Validate_Lines()).
+            Post survey=<the whole survey> and known=<comma-separated tokens from earlier replies>; only lines that changed since are parsed and previewed again.
+        """
+
+        known = [token for token in kwargs.get('known', "").split(",") if token != ""]
+
+        with handler_metrics.Timer('load_letter_blocks'):
+            result = Validate_Lines(kwargs.get('survey', ""), known)
+
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+
+        return Send_Page(json.dumps(result))
+
+    def metrics(self, **kwargs):
+
+        """ cherrypy.Root.metrics(): Handler and stage timings in Prometheus text format, for scraping.  Turn on with chl.metrics.on in cfg.cfg. """
+
+        if not handler_metrics.on:
+            raise cherrypy.NotFound()
+
+        cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+
+        return handler_metrics.Exposition()
+
     def error(self, **kwargs):
 
         """ cherrypy.Root.error(): Catch-all error page. """
@@ -760,11 +3681,657 @@ class Root(object):
 
     admin.exposed = True
     createsurvey.exposed = True
+    engine.exposed = True
     error.exposed = True
+    export.exposed = True
+    export._cp_config = {'response.stream': True}
+    importsurveys.exposed = True
     index.exposed = True
+    metrics.exposed = True
+    stats.exposed = True
     survey.exposed = True
     submit.exposed = True
     validate.exposed = True
+    validatelines.exposed = True
+
+class Event_Connection(object):
+
+    """ class Event_Connection(object): One client of an Event_Server.  The server thread does all the receiving and sending; while a request is being answered,
+        the worker thread adds the response to output and waits on lock whenever the client has fallen more than max_buffer_bytes behind.
+    """
+
+    def __init__(self, client, address):
+        self.client = client
+        self.fd = client.fileno()
+        self.address = address
+        self.received = []
+        self.received_bytes = 0
+        self.environ = None
+        self.output = collections.deque()
+        self.output_bytes = 0
+        self.lock = threading.Condition()
+        self.state = 'reading' # 'reading' until a whole request is in, 'working' until its response has been sent, then 'reading' again or 'closed'
+        self.finished = False
+        self.keep_alive = False
+        self.events = select.POLLIN
+        self.last_active = time.time()
+
+class Event_Server(object):
+
+    """ class Event_Server(object): HTTP/1.1 server that receives requests and sends responses for every connection from a single thread with select.poll(),
+        so a slow or idle client costs a buffer instead of one of the numthreads worker threads.  Only complete requests (headers and Content-Length bytes of body)
+        are handed to the workers running wsgi_app, and their responses are sent from the same thread as they come; a worker streaming a long response
+        (see Root.export) waits whenever more than max_buffer_bytes are waiting for its client.  Request bodies without a Content-Length are answered with 411.
+        Used in place of CherryPy's threaded server when chl.event_server.on is set (see Run_Worker()); needs select.poll(), so it doesn't run on Windows.
+            listener: listening socket to accept on instead of binding bind_addr, as in Prefork_Server
+            timeout: seconds a connection can go without sending or receiving anything before it's closed, unless a worker is busy with its request
+            max_connections: most clients connected at once; the rest wait in the listen backlog
+            max_header_bytes, max_body_bytes: larger requests are answered with 431 and 413; 0 for no limit
+    """
+
+    software = "Cat Herding Laser"
+
+    def __init__(self, bind_addr, wsgi_app, numthreads=10, request_queue_size=5, timeout=10, max_connections=1000, max_header_bytes=500*1024, max_body_bytes=100*1024*1024, max_buffer_bytes=256*1024, listener=None):
+        self.bind_addr = bind_addr
+        self.wsgi_app = wsgi_app
+        self.numthreads = numthreads
+        self.request_queue_size = request_queue_size
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_header_bytes = max_header_bytes
+        self.max_body_bytes = max_body_bytes
+        self.max_buffer_bytes = max_buffer_bytes
+        self.listener = listener
+        self.requests = Queue.Queue()
+        self.answered = []
+        self.answered_lock = threading.Lock()
+        self.wake = None
+        self.connections = {}
+        self.threads = []
+        self.ready = False
+        self.stopping = False
+        self.serving_thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+
+        """\t start(): Serves until stop() is called.  Named after CherryPyWSGIServer.start() so that cherrypy.server can run it.
+        """
+
+        self.stopping = False
+
+        if self.listener is None:
+            self.socket = socket.socket(socket.AF_INET6 if ':' in self.bind_addr[0] else socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.socket.bind(self.bind_addr)
+            self.socket.listen(self.request_queue_size)
+        else:
+            self.socket = self.listener
+        self.socket.setblocking(False)
+        listener_fd = self.socket.fileno()
+
+        (wake_fd, self.wake) = os.pipe()
+        self.poller = select.poll()
+        self.poller.register(listener_fd, select.POLLIN)
+        self.poller.register(wake_fd, select.POLLIN)
+        accepting = True
+
+        for x in xrange(self.numthreads):
+            thread = threading.Thread(target=self.Work, name="Event_Server {}".format(x))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+        self.serving_thread = threading.current_thread()
+        self.stopped.clear()
+        self.ready = True
+        swept = time.time()
+
+        try:
+            while not self.stopping:
+                try:
+                    events = self.poller.poll(1000)
+                except select.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                for (fd, event) in events:
+                    if fd == wake_fd:
+                        os.read(wake_fd, 4096)
+                        with self.answered_lock:
+                            (answered, self.answered) = (self.answered, [])
+                        for connection in answered:
+                            self.Send(connection)
+                    elif fd == listener_fd:
+                        self.Accept()
+                    elif fd in self.connections:
+                        connection = self.connections[fd]
+                        if event & select.POLLIN:
+                            self.Receive(connection)
+                        elif event & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
+                            self.Close(connection)
+                        if event & select.POLLOUT:
+                            self.Send(connection)
+
+                if accepting != (len(self.connections) < self.max_connections):
+                    accepting = not accepting
+                    self.poller.modify(listener_fd, select.POLLIN if accepting else 0)
+
+                if time.time() - swept >= 1:
+                    swept = time.time()
+                    for connection in self.connections.values():
+                        if (connection.state == 'reading' or connection.output_bytes > 0) and swept - connection.last_active > self.timeout:
+                            self.Close(connection)
+        finally:
+            self.ready = False
+            for connection in self.connections.values():
+                self.Close(connection)
+            for thread in self.threads:
+                self.requests.put(None)
+            deadline = time.time() + self.timeout
+            for thread in self.threads:
+                thread.join(max(deadline - time.time(), 0))
+            self.threads = []
+            with self.answered_lock:
+                os.close(self.wake)
+                self.wake = None
+            os.close(wake_fd)
+            self.socket.close()
+            self.stopped.set()
+
+    def stop(self):
+
+        """\t stop(): Stops serving and closes every connection.  Waits for start() to return, unless it's called from the thread running start() (by a signal handler).
+        """
+
+        self.stopping = True
+        if not self.ready or threading.current_thread() is self.serving_thread:
+            return
+        self.Notify(None)
+        self.stopped.wait()
+
+    def Notify(self, connection):
+
+        """\t Notify(connection): Has the server thread send whatever a worker has added to connection's output; None only wakes it.
+        """
+
+        with self.answered_lock:
+            if self.wake is None:
+                return
+            if connection is not None:
+                self.answered.append(connection)
+            if len(self.answered) <= 1:
+                os.write(self.wake, "x")
+
+    def Accept(self):
+        while len(self.connections) < self.max_connections:
+            try:
+                (client, address) = self.socket.accept()
+            except socket.error, e:
+                if e.args[0] in (errno.EMFILE, errno.ENFILE):
+                    cherrypy.log("Event_Server is out of file descriptors with {} connections open".format(len(self.connections)))
+                elif e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.ECONNABORTED):
+                    raise
+                return
+
+            client.setblocking(False)
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = Event_Connection(client, address)
+            self.connections[connection.fd] = connection
+            self.poller.register(connection.fd, connection.events)
+
+    def Watch(self, connection, events):
+        if connection.state != 'closed' and connection.events != events:
+            self.poller.modify(connection.fd, events)
+            connection.events = events
+
+    def Close(self, connection):
+        with connection.lock:
+            if connection.state == 'closed':
+                return
+            connection.state = 'closed'
+            connection.output.clear()
+            connection.output_bytes = 0
+            connection.lock.notify_all()
+
+        del self.connections[connection.fd]
+        self.poller.unregister(connection.fd)
+        connection.client.close()
+
+    def Receive(self, connection):
+        try:
+            data = connection.client.recv(64*1024)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            data = ""
+
+        if data == "":
+            self.Close(connection)
+            return
+
+        connection.received.append(data)
+        connection.received_bytes += len(data)
+        connection.last_active = time.time()
+        self.Parse(connection)
+
+    def Parse(self, connection):
+
+        """\t Parse(connection): Hands the request waiting in connection.received to the workers once all of it is in.  Runs in the server thread.
+        """
+
+        if connection.environ is None:
+            received = "".join(connection.received).lstrip("\r\n")
+            connection.received = [received]
+            connection.received_bytes = len(received)
+            end = received.find("\r\n\r\n")
+
+            if end < 0:
+                if self.max_header_bytes and len(received) > self.max_header_bytes:
+                    self.Refuse(connection, "431 Request Header Fields Too Large", "The request's headers are too long.")
+                return
+
+            try:
+                environ = self.Environ(connection, received[:end])
+            except ValueError, e:
+                self.Refuse(connection, "400 Bad Request", str(e))
+                return
+
+            if environ['SERVER_PROTOCOL'] not in ("HTTP/1.0", "HTTP/1.1"):
+                self.Refuse(connection, "505 HTTP Version Not Supported", "Only HTTP/1.0 and HTTP/1.1 are supported.")
+                return
+            if 'HTTP_TRANSFER_ENCODING' in environ:
+                self.Refuse(connection, "411 Length Required", "Send the request's body with a Content-Length.")
+                return
+            if self.max_body_bytes and environ['chl.content_length'] > self.max_body_bytes:
+                self.Refuse(connection, "413 Request Entity Too Large", "The request's body is too long.")
+                return
+
+            connection.environ = environ
+            connection.received = [received[end + 4:]]
+            connection.received_bytes -= end + 4
+            connection.keep_alive = environ['SERVER_PROTOCOL'] == "HTTP/1.1" and 'close' not in environ.get('HTTP_CONNECTION', "").lower()
+
+            if connection.received_bytes < environ['chl.content_length'] and environ.get('HTTP_EXPECT', "").lower() == "100-continue":
+                self.Add(connection, "HTTP/1.1 100 Continue\r\n\r\n")
+
+        length = connection.environ['chl.content_length']
+        if connection.received_bytes < length:
+            return
+
+        received = "".join(connection.received)
+        environ = connection.environ
+        environ['wsgi.input'] = StringIO.StringIO(received[:length])
+        connection.received = [received[length:]]
+        connection.received_bytes = len(received) - length
+        connection.environ = None
+        connection.state = 'working'
+        self.Watch(connection, 0)
+        self.requests.put((connection, environ))
+
+    def Environ(self, connection, head):
+
+        """\t Environ(connection, head): Returns the WSGI environ of a request's line and headers, as CherryPyWSGIServer would; raises ValueError if they're malformed.
+        """
+
+        lines = head.split("\r\n")
+        request_line = lines[0].split(" ")
+        if len(request_line) != 3:
+            raise ValueError("Malformed request line.")
+        (method, uri, protocol) = request_line
+
+        if uri.startswith("http://") or uri.startswith("https://"):
+            uri = "/" + uri.split("/", 3)[3] if uri.count("/") >= 3 else "/"
+        (path, question, query_string) = uri.partition("?")
+        path = path.partition("#")[0]
+
+        environ = {
+            'ACTUAL_SERVER_PROTOCOL': "HTTP/1.1",
+            'PATH_INFO': "%2F".join(urllib.unquote(part) for part in path.replace("%2f", "%2F").split("%2F")), # As in CherryPyWSGIServer, "/this%2Fpath" stays as it is
+            'QUERY_STRING': query_string,
+            'REMOTE_ADDR': connection.address[0],
+            'REMOTE_PORT': str(connection.address[1]),
+            'REQUEST_METHOD': method,
+            'REQUEST_URI': uri,
+            'SCRIPT_NAME': "",
+            'SERVER_NAME': self.bind_addr[0],
+            'SERVER_PORT': str(self.bind_addr[1]),
+            'SERVER_PROTOCOL': protocol,
+            'SERVER_SOFTWARE': self.software,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multiprocess': self.listener is not None,
+            'wsgi.multithread': True,
+            'wsgi.run_once': False,
+            'wsgi.url_scheme': "http",
+            'wsgi.version': (1, 0),
+        }
+
+        for line in lines[1:]:
+            if line[:1] in (" ", "\t") or ":" not in line:
+                raise ValueError("Malformed header: {}".format(line))
+            (name, value) = line.split(":", 1)
+            key = "HTTP_{}".format(name.strip().upper().replace("-", "_"))
+            if key in environ:
+                environ[key] = "{}, {}".format(environ[key], value.strip())
+            else:
+                environ[key] = value.strip()
+
+        if 'HTTP_CONTENT_TYPE' in environ:
+            environ['CONTENT_TYPE'] = environ.pop('HTTP_CONTENT_TYPE')
+        if 'HTTP_CONTENT_LENGTH' in environ:
+            environ['CONTENT_LENGTH'] = environ.pop('HTTP_CONTENT_LENGTH')
+
+        try:
+            environ['chl.content_length'] = int(environ.get('CONTENT_LENGTH', 0))
+        except ValueError:
+            raise ValueError("Malformed Content-Length.")
+        if environ['chl.content_length'] < 0:
+            raise ValueError("Malformed Content-Length.")
+
+        return environ
+
+    def Refuse(self, connection, status, message):
+
+        """\t Refuse(connection, status, message): Answers with an error, then closes the connection: from the server thread for requests the workers never see,
+            or from a worker when wsgi_app fails before it starts its response.
+        """
+
+        in_server_thread = threading.current_thread() is self.serving_thread
+
+        connection.state = 'working'
+        connection.keep_alive = False
+        self.Add(connection, "HTTP/1.1 {}\r\nContent-Type: text/plain\r\nContent-Length: {}\r\nConnection: close\r\n\r\n{}".format(status, len(message), message))
+
+        if in_server_thread:
+            connection.finished = True
+            self.Send(connection)
+
+    def Add(self, connection, data):
+
+        """\t Add(connection, data): Queues data to send on connection.  In a worker, waits while more than max_buffer_bytes are already waiting;
+            returns False, without queueing, if the connection has been closed.
+        """
+
+        in_server_thread = threading.current_thread() is self.serving_thread
+
+        with connection.lock:
+            while connection.output_bytes > self.max_buffer_bytes and connection.state != 'closed' and not in_server_thread:
+                connection.lock.wait(1)
+            if connection.state == 'closed':
+                return False
+            connection.output.append(data)
+            connection.output_bytes += len(data)
+
+        if in_server_thread:
+            self.Send(connection)
+        else:
+            self.Notify(connection)
+
+        return True
+
+    def Send(self, connection):
+
+        """\t Send(connection): Sends as much of connection's output as the client will take now, then watches for whatever it's waiting on next.  Runs in the server thread.
+        """
+
+        with connection.lock:
+            while len(connection.output) > 0:
+                data = connection.output[0]
+                try:
+                    sent = connection.client.send(data)
+                except socket.error, e:
+                    if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                        break
+                    self.Close(connection)
+                    return
+
+                connection.output_bytes -= sent
+                connection.last_active = time.time()
+                if sent < len(data):
+                    connection.output[0] = data[sent:]
+                    break
+                connection.output.popleft()
+
+            connection.lock.notify_all()
+            (waiting, finished) = (len(connection.output) > 0, connection.finished)
+
+        if connection.state == 'closed':
+            return
+
+        if waiting:
+            self.Watch(connection, select.POLLOUT | (select.POLLIN if connection.state == 'reading' else 0))
+        elif connection.state == 'reading':
+            self.Watch(connection, select.POLLIN)
+        elif not finished:
+            self.Watch(connection, 0)
+        elif connection.keep_alive:
+            connection.state = 'reading'
+            connection.finished = False
+            connection.last_active = time.time()
+            self.Watch(connection, select.POLLIN)
+            self.Parse(connection) # The client may have sent its next request already
+        else:
+            self.Close(connection)
+
+    def Work(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+
+            (connection, environ) = item
+            try:
+                self.Respond(connection, environ)
+            except Exception:
+                cherrypy.log("Event_Server couldn't answer {} {}".format(environ['REQUEST_METHOD'], environ['REQUEST_URI']), traceback=True)
+                connection.keep_alive = False
+
+            connection.finished = True
+            self.Notify(connection)
+
+    def Respond(self, connection, environ):
+
+        """\t Respond(connection, environ): Runs wsgi_app for one request and queues the response on connection as it's produced.  Runs in a worker.
+        """
+
+        started = []
+        framing = []
+
+        def Start_Response(status, headers, exc_info=None):
+            if exc_info is not None and len(framing) > 0:
+                raise exc_info[0], exc_info[1], exc_info[2]
+            started[:] = [status, headers]
+            return Write
+
+        def Write(chunk):
+            if len(framing) == 0:
+                (head, how) = self.Head(connection, environ, started[0], started[1])
+                framing.append(how)
+                if not self.Add(connection, head):
+                    return False
+            if chunk == "" or framing[0] == 'none':
+                return connection.state != 'closed'
+            if framing[0] == 'chunked':
+                chunk = "{:x}\r\n{}\r\n".format(len(chunk), chunk)
+            return self.Add(connection, chunk)
+
+        try:
+            result = self.wsgi_app(environ, Start_Response)
+        except Exception:
+            cherrypy.log("Event_Server couldn't answer {} {}".format(environ['REQUEST_METHOD'], environ['REQUEST_URI']), traceback=True)
+            self.Refuse(connection, "500 Internal Server Error", "The server couldn't answer this request.")
+            return
+
+        try:
+            for chunk in result:
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode('ISO-8859-1')
+                if chunk != "" and not Write(chunk):
+                    return
+            Write("")
+            if framing[0] == 'chunked':
+                self.Add(connection, "0\r\n\r\n")
+        except Exception:
+            if len(framing) > 0:
+                raise
+            cherrypy.log("Event_Server couldn't answer {} {}".format(environ['REQUEST_METHOD'], environ['REQUEST_URI']), traceback=True)
+            self.Refuse(connection, "500 Internal Server Error", "The server couldn't answer this request.")
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    def Head(self, connection, environ, status, headers):
+
+        """\t Head(connection, environ, status, headers): Returns the status line and headers of a response as a string, along with how its body is framed:
+            'length' (wsgi_app gave a Content-Length), 'chunked', 'close' (an HTTP/1.0 client's body ends when the connection closes) or 'none' (there's no body).
+        """
+
+        names = set(name.lower() for (name, value) in headers)
+        code = int(status[:3])
+        headers = list(headers)
+
+        if environ['REQUEST_METHOD'] == "HEAD" or code < 200 or code in (204, 304):
+            how = 'none'
+        elif 'content-length' in names:
+            how = 'length'
+        elif environ['SERVER_PROTOCOL'] == "HTTP/1.1":
+            how = 'chunked'
+            headers.append(("Transfer-Encoding", "chunked"))
+        else:
+            how = 'close'
+            connection.keep_alive = False
+
+        if any(name.lower() == 'connection' and 'close' in value.lower() for (name, value) in headers):
+            connection.keep_alive = False
+        elif not connection.keep_alive:
+            headers.append(("Connection", "close"))
+
+        return ("HTTP/1.1 {}\r\n{}\r\n".format(status, "".join("{}: {}\r\n".format(name, value) for (name, value) in headers)), how)
+
+class Prefork_Server(cherrypy.wsgiserver.CherryPyWSGIServer):
+
+    """ class Prefork_Server(cherrypy.wsgiserver.CherryPyWSGIServer): A worker's HTTP server, accepting connections on the listening socket it inherited from Prefork() instead of binding its own.
+    """
+
+    def __init__(self, listener, *args, **kwargs):
+        self.listener = listener
+        cherrypy.wsgiserver.CherryPyWSGIServer.__init__(self, *args, **kwargs)
+
+    def bind(self, family, type, proto=0):
+        self.socket = self.listener
+
+def Event_Server_Options():
+
+    """ Event_Server_Options(): Returns the keyword arguments for an Event_Server, from the server.* and chl.event_server.* settings.
+    """
+
+    return {'numthreads': cherrypy.server.thread_pool, 'request_queue_size': cherrypy.server.socket_queue_size, 'timeout': cherrypy.server.socket_timeout,
+            'max_connections': cherrypy.config.get('chl.event_server.max_connections', 1000), 'max_buffer_bytes': cherrypy.config.get('chl.event_server.max_buffer_bytes', 256*1024),
+            'max_header_bytes': cherrypy.server.max_request_header_size, 'max_body_bytes': cherrypy.server.max_request_body_size}
+
+def Run_Worker(root, listener):
+
+    """ Run_Worker(root, listener): Serves root on the inherited listening socket until the worker is sent SIGTERM.  Runs in each process forked by Prefork().
+    """
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl-C reaches every process in the group; the supervisor stops the workers itself
+    signal.signal(signal.SIGTERM, lambda signum, frame: cherrypy.engine.exit())
+
+    cherrypy.server.unsubscribe() # The default server would try to bind the port the supervisor already holds
+    cherrypy.engine.autoreload.unsubscribe()
+    cherrypy.tree.mount(root, '/')
+
+    if cherrypy.config.get('chl.event_server.on', False):
+        server = Event_Server(listener.getsockname()[:2], cherrypy.tree, listener=listener, **Event_Server_Options())
+    else:
+        server = Prefork_Server(listener, listener.getsockname()[:2], cherrypy.tree, numthreads=cherrypy.server.thread_pool, request_queue_size=cherrypy.server.socket_queue_size, timeout=cherrypy.server.socket_timeout)
+    cherrypy.engine.subscribe('stop', server.stop)
+
+    cherrypy.engine.start()
+    server.start()
+
+    if cherrypy.engine.state not in (cherrypy.engine.states.STOPPED, cherrypy.engine.states.EXITING):
+        cherrypy.engine.exit()
+
+def Prefork(root, workers, restart_delay=1.0):
+
+    """ Prefork(root, workers, restart_delay): Binds the server socket, then forks workers processes that each serve root on it with their own thread pool.
+        Stays on as the supervisor, forking a replacement for any worker that dies, until it is sent SIGTERM or SIGINT and stops the workers.
+            restart_delay: seconds to wait before replacing a worker that died within restart_delay seconds of starting, so a worker that can't start doesn't fork endlessly
+    """
+
+    host = cherrypy.server.socket_host
+    port = cherrypy.server.socket_port
+
+    if ':' in host:
+        listener = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(cherrypy.server.socket_queue_size)
+
+    for filename in glob.glob("*.page") + glob.glob("*.page.*.tmp"): # Shared survey pages (see Survey_Template.Share()) left by a server that didn't stop cleanly
+        os.remove(filename)
+
+    children = {}
+    stopping = []
+
+    def Stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def Fork():
+        pid = os.fork()
+        if pid == 0:
+            exit_status = 1
+            try:
+                Run_Worker(root, listener)
+                exit_status = 0
+            except BaseException:
+                cherrypy.log("Worker {} failed".format(os.getpid()), traceback=True)
+            finally:
+                os._exit(exit_status)
+        children[pid] = time.time()
+
+    signal.signal(signal.SIGTERM, Stop)
+    signal.signal(signal.SIGINT, Stop)
+
+    cherrypy.log("Serving on {}:{} with {} worker processes".format(host, port, workers))
+
+    for x in xrange(workers):
+        Fork()
+
+    while len(children) > 0:
+        try:
+            (pid, status) = os.wait()
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+
+        started = children.pop(pid, None)
+
+        if started is None or len(stopping) > 0:
+            continue
+
+        if os.WIFSIGNALED(status):
+            cherrypy.log("Worker {} was killed by signal {}; starting a new one".format(pid, os.WTERMSIG(status)))
+        else:
+            cherrypy.log("Worker {} exited with status {}; starting a new one".format(pid, os.WEXITSTATUS(status)))
+
+        if time.time() - started < restart_delay:
+            time.sleep(restart_delay)
+
+        if len(stopping) == 0:
+            Fork()
+
+    listener.close()
 
 
 if __name__ == "__main__":
@@ -774,4 +4341,29 @@ if __name__ == "__main__":
     cherrypy.root = Root()
     cherrypy.config.update(configuration_file)
     cherrypy.config.update({'error_page.default': cherrypy.root.error})
-    cherrypy.quickstart(cherrypy.root)        
+    if cherrypy.config.get('chl.response_writer.on', False):
+        response_writer = Response_Writer(queue_size=cherrypy.config.get('chl.response_writer.queue_size', 10000), flush_bytes=cherrypy.config.get('chl.response_writer.flush_bytes', 64*1024), flush_interval=cherrypy.config.get('chl.response_writer.flush_interval', 0.2), fsync=cherrypy.config.get('chl.response_writer.fsync', 'never'))
+        cherrypy.engine.subscribe('start', response_writer.Start)
+        cherrypy.engine.subscribe('stop', response_writer.Stop)
+    response_format = cherrypy.config.get('chl.response_format', 'text')
+    admin_token = str(cherrypy.config.get('chl.admin.token', ""))
+    cherrypy.process.plugins.Monitor(cherrypy.engine, response_tallies.Snapshot, frequency=cherrypy.config.get('chl.stats.snapshot_interval', 60), name='Response_Tallies').subscribe()
+    cherrypy.engine.subscribe('stop', response_tallies.Snapshot)
+    if cherrypy.config.get('chl.storage.backend', 'files') == 'sqlite':
+        storage = SQLite_Storage(cherrypy.config.get('chl.storage.path', 'catherdinglaser.db'))
+    else:
+        storage = File_Storage(segment_bytes=cherrypy.config.get('chl.response_log.max_bytes', 0), segment_age=cherrypy.config.get('chl.response_log.max_age', 0))
+        cherrypy.process.plugins.Monitor(cherrypy.engine, storage.Compress_Segments, frequency=cherrypy.config.get('chl.response_log.compress_interval', 60), name='Response_Log').subscribe()
+    compressor.Configure(cherrypy.config.get('chl.compression.on', False), cherrypy.config.get('chl.compression.min_bytes', 1024))
+    handler_metrics.Configure(cherrypy.config.get('chl.metrics.on', False), cherrypy.config.get('chl.metrics.max_survey_ids', 1000))
+    admission.Configure(cherrypy.config.get('chl.admission.on', False), cherrypy.config.get('chl.admission.limits', {}), cherrypy.config.get('chl.admission.max_active', 0), cherrypy.config.get('chl.admission.queue_size', 0), cherrypy.config.get('chl.admission.queue_timeout', 1.0), cherrypy.config.get('chl.admission.retry_after', 5))
+    survey_cache.Configure(cherrypy.config.get('chl.survey_cache.max_entries', 256), cherrypy.config.get('chl.survey_cache.max_bytes', 64*1024*1024))
+    prefork_workers = cherrypy.config.get('chl.prefork.workers', 0)
+    if prefork_workers > 0:
+        share_templates = True
+        response_tallies.shared = True
+        Prefork(cherrypy.root, prefork_workers, cherrypy.config.get('chl.prefork.restart_delay', 1.0))
+    else:
+        if cherrypy.config.get('chl.event_server.on', False):
+            cherrypy.server.instance = Event_Server(cherrypy.server.bind_addr, cherrypy.tree, **Event_Server_Options())
+        cherrypy.quickstart(cherrypy.root)        
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+# Cat Herding Laser: converts saved survey responses to the compact format
+#
+# Usage: python convert_responses.py <survey_id> [--replace]
+#
+# Run this from the directory holding your surveys.  The compact copy is saved as <survey_id>-responses.compact.txt;
+# with --replace it takes the place of <survey_id>-responses.txt and its rolled over segments instead.  Stop Cat Herding Laser
+# before using --replace or any responses submitted while the conversion runs will be lost.
+
+import sys
+
+import catherdinglaser
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2 or sys.argv[1].startswith("-"):
+        sys.exit("Usage: python convert_responses.py <survey_id> [--replace]")
+
+    survey_id = sys.argv[1]
+    output_filename = "{}-responses.compact.txt".format(survey_id)
+
+    (bytes_read, bytes_written) = catherdinglaser.Convert_Responses(survey_id, output_filename)
+
+    if "--replace" in sys.argv[2:]:
+        catherdinglaser.storage.Replace_Responses(survey_id, output_filename)
+        output_filename = "{}-responses.txt".format(survey_id)
+
+    print "Converted {:,} bytes of responses to {:,} bytes in {}".format(bytes_read, bytes_written, output_filename)
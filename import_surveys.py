@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+# Cat Herding Laser: creates many surveys at once from a directory or archive
+#
+# Usage: python import_surveys.py <directory, .zip or .tar(.gz)> [--validate-only] [--processes N] [--database <database>]
+#
+# Run this from the directory holding your surveys.  Each <name>.txt or <name>.xlsx in the bundle is a survey; <name>_survey_header.txt
+# and the like are its fragments, and survey_header.txt and the like apply to every survey in the same directory that doesn't have its own.
+# Surveys are validated in parallel and only the ones without errors are created.  --database creates them in that SQLite database
+# instead of in this directory (see chl.storage.backend in cfg.cfg).  --json prints the whole batch result as /importsurveys returns it.
+
+import argparse
+import json
+import sys
+import tarfile
+import zipfile
+
+import catherdinglaser
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Creates many surveys at once from a directory or archive.")
+    parser.add_argument('bundle', help="directory, zip or tar archive of surveys")
+    parser.add_argument('--validate-only', action='store_true', help="check the surveys without creating them")
+    parser.add_argument('--processes', type=int, default=0, help="worker processes to validate with; 0 uses one per CPU")
+    parser.add_argument('--database', help="create the surveys in this SQLite database instead of this directory")
+    parser.add_argument('--json', action='store_true', help="print the batch result as JSON")
+    arguments = parser.parse_args()
+
+    if arguments.database is not None:
+        catherdinglaser.storage = catherdinglaser.SQLite_Storage(arguments.database)
+
+    try:
+        bundle = catherdinglaser.Read_Survey_Bundle(arguments.bundle)
+    except (IOError, OSError, tarfile.TarError, zipfile.BadZipfile), e: # Broken workbooks are reported with the other surveys
+        sys.exit("Couldn't read {}: {}".format(arguments.bundle, e))
+
+    result = catherdinglaser.Import_Surveys(bundle, arguments.processes, create=not arguments.validate_only)
+
+    if arguments.json:
+        print json.dumps(result, indent=1)
+    else:
+        for survey in result['results']:
+            if survey['valid']:
+                print "{}: {} ({} unique Un-form letters){}".format(survey['name'], survey['survey_id'], catherdinglaser.Log10_Amount(survey['log10_permutations'], html=False), "" if survey['created'] else ", not created")
+            else:
+                print "{}: {} error(s)".format(survey['name'], len(survey['errors']))
+                for error in survey['errors']:
+                    print "\t{}".format(error.strip())
+
+        print "{:,} surveys: {:,} created, {:,} with errors".format(result['surveys'], result['created'], result['failed'])
+
+    if result['failed'] > 0:
+        sys.exit(1)
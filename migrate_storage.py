@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+# Cat Herding Laser: copies saved surveys and responses into a SQLite database
+#
+# Usage: python migrate_storage.py <database>
+#
+# Run this from the directory holding your surveys.  Every survey, with its option fragments, responses and tallies,
+# is copied into <database>, which is created if it doesn't exist; the files themselves are left alone.  Then set
+# chl.storage.backend = 'sqlite' and chl.storage.path = '<database>' in cfg.cfg.  Stop Cat Herding Laser first
+# or any responses submitted while the migration runs won't be copied.
+
+import sys
+
+import catherdinglaser
+
+if __name__ == "__main__":
+
+    if len(sys.argv) != 2 or sys.argv[1].startswith("-"):
+        sys.exit("Usage: python migrate_storage.py <database>")
+
+    (surveys, responses) = catherdinglaser.Migrate_Storage(catherdinglaser.File_Storage(), catherdinglaser.SQLite_Storage(sys.argv[1]))
+
+    print "Copied {:,} surveys and {:,} responses to {}".format(surveys, responses, sys.argv[1])